@@ -1,89 +1,195 @@
-from fpdf import FPDF
 import pandas as pd
-import matplotlib.pyplot as plt
+import io
+import logging
+import math
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
 from data_manager import AgriculturalDataManager
+from static_map import StaticMapRenderer
+from instrumentation import configure_logging, instrumented, stage
 
-class AgriculturalReportGenerator:
-    def __init__(self, data_manager):
-        """Initialise le générateur de rapports avec le gestionnaire de données."""
-        self.data_manager = data_manager
+# Colonnes du monitoring utilisées par les rapports
+REPORT_COLUMNS = ['parcelle_id', 'date', 'culture', 'rendement']
 
-    def generate_parcelle_report(self, parcelle_id, output_file="rapport_parcelle.pdf"):
-        """Génère un rapport PDF pour une parcelle donnée."""
-        data = self.data_manager.prepare_features()
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
+# Instantané des données partagé par les processus de travail (voir _init_worker)
+_worker_snapshot = None
+
+logger = logging.getLogger(__name__)
+
+
+def render_yield_chart(parcelle_id, parcelle_data):
+    """Dessine le graphique des rendements et le retourne en PNG dans un tampon mémoire.
+
+    Utilise l'API objet de matplotlib (Figure + canevas Agg), sans l'état global
+    de pyplot, ce qui permet des rendus concurrents.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(parcelle_data['date'], parcelle_data['rendement'], label="Rendement")
+    ax.set_title(f"Rendement pour la parcelle {parcelle_id}")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Rendement (tonnes/ha)")
+    ax.legend()
+    fig.autofmt_xdate()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    buffer.seek(0)
+    return buffer
+
+
+def build_parcelle_pdf(parcelle_id, parcelle_data, output_file, map_image=None, risk=None):
+    """Construit et écrit le PDF d'une parcelle à partir de ses données de monitoring.
+
+    `risk` est la ligne de la parcelle dans la table du moteur de risque
+    (dictionnaire, voir AgriculturalRiskEngine.parcelle_risk).
+    """
+    from fpdf import FPDF
+
+    # Créer un PDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
 
-        # Créer un PDF
-        pdf = FPDF()
+    # Ajouter un titre
+    pdf.cell(200, 10, txt=f"Rapport pour la parcelle {parcelle_id}", ln=True, align="C")
+
+    # Ajouter des informations sur la parcelle
+    pdf.cell(200, 10, txt="Informations sur la parcelle :", ln=True)
+    pdf.cell(200, 10, txt=f"Culture : {parcelle_data['culture'].iloc[0]}", ln=True)
+    pdf.cell(200, 10, txt=f"Rendement moyen : {parcelle_data['rendement'].mean():.2f} tonnes/ha", ln=True)
+    if risk:
+        pdf.cell(200, 10, txt=f"Score de risque : {risk['score_risque']:.0%} (rang {risk['rang']})", ln=True)
+        pdf.cell(200, 10, txt=f"Réserve hydrique relative : {risk['reserve_relative']:.0%}", ln=True)
+
+    # Ajouter le graphique au PDF directement depuis la mémoire
+    with stage('report.chart', rows=len(parcelle_data)):
+        chart = render_yield_chart(parcelle_id, parcelle_data)
+    pdf.image(chart, x=10, y=pdf.get_y() + 5, w=180)
+
+    # Ajouter une carte (optionnel)
+    if map_image is not None and os.path.exists(map_image):
         pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        # Ajouter un titre
-        pdf.cell(200, 10, txt=f"Rapport pour la parcelle {parcelle_id}", ln=True, align="C")
-
-        # Ajouter des informations sur la parcelle
-        pdf.cell(200, 10, txt="Informations sur la parcelle :", ln=True)
-        pdf.cell(200, 10, txt=f"Culture : {parcelle_data['culture'].iloc[0]}", ln=True)
-        pdf.cell(200, 10, txt=f"Rendement moyen : {parcelle_data['rendement'].mean():.2f} tonnes/ha", ln=True)
-
-        # Ajouter un graphique (exemple : rendement au fil du temps)
-        plt.figure()
-        plt.plot(parcelle_data['date'], parcelle_data['rendement'], label="Rendement")
-        plt.title(f"Rendement pour la parcelle {parcelle_id}")
-        plt.xlabel("Date")
-        plt.ylabel("Rendement (tonnes/ha)")
-        plt.legend()
-        plot_path = "rendement_plot.png"
-        plt.savefig(plot_path)
-        plt.close()
-
-        # Ajouter le graphique au PDF
-        pdf.image(plot_path, x=10, y=50, w=180)
-
-        # Ajouter une carte (optionnel)
-        if os.path.exists("carte_parcelles.png"):
-            pdf.add_page()
-            pdf.cell(200, 10, txt="Carte des parcelles :", ln=True)
-            pdf.image("carte_parcelles.png", x=10, y=20, w=180)
-
-        # Sauvegarder le PDF
-        pdf.output(output_file)
-        print(f"Rapport généré avec succès : {output_file}")
-
-        # Nettoyer les fichiers temporaires
-        if os.path.exists(plot_path):
-            os.remove(plot_path)
-
-            from data_manager import AgriculturalDataManager
-
-# Initialisation du gestionnaire de données
-data_manager = AgriculturalDataManager()
-data_manager.load_data()
-
-# Initialisation du générateur de rapports
-report_generator = AgriculturalReportGenerator(data_manager)
-
-# Générer un rapport pour une parcelle spécifique
-parcelle_id = 'P001'  # Remplacez par l'ID d'une parcelle existante
-report_generator.generate_parcelle_report(parcelle_id)
-
-from selenium import webdriver
-import time
+        pdf.cell(200, 10, txt="Carte des parcelles :", ln=True)
+        pdf.image(map_image, x=10, y=20, w=180)
+
+    # Sauvegarder le PDF
+    pdf.output(output_file)
+
+
+def _init_worker(snapshot):
+    """Reçoit l'instantané des données une seule fois par processus de travail."""
+    global _worker_snapshot
+    _worker_snapshot = snapshot
 
-def save_folium_map_as_image(map_object, output_file="carte_parcelles.png"):
-    """Exporte une carte Folium en image."""
-    map_object.save("map.html")  # Sauvegarder la carte en HTML
-    
-    # Utiliser Selenium pour capturer une image de la carte
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")  # Exécuter en mode sans tête
-    driver = webdriver.Chrome(options=options)
-    driver.get(f"file://{os.path.abspath('map.html')}")
-    time.sleep(5)  # Attendre que la carte se charge
-    driver.save_screenshot(output_file)
-    driver.quit()
-
-    # Nettoyer le fichier HTML temporaire
-    if os.path.exists("map.html"):
-        os.remove("map.html")
\ No newline at end of file
+
+def _render_worker(task):
+    """Génère un rapport dans un processus de travail et retourne son temps d'exécution."""
+    parcelle_id, output_file, map_image, risk = task
+    start = time.perf_counter()
+    try:
+        build_parcelle_pdf(parcelle_id, _worker_snapshot[parcelle_id], output_file, map_image, risk)
+        status = 'ok'
+    except Exception as e:
+        status = f"erreur : {e}"
+    return parcelle_id, output_file, time.perf_counter() - start, status
+
+
+class AgriculturalReportGenerator:
+    def __init__(self, data_manager, map_color_by='risque'):
+        """Initialise le générateur de rapports avec le gestionnaire de données."""
+        self.data_manager = data_manager
+        self.map_renderer = StaticMapRenderer(data_manager)
+        self.map_color_by = map_color_by
+
+    def map_image(self):
+        """Chemin de l'image de la carte des parcelles (rendue une fois par version des données)."""
+        return self.map_renderer.render(color_by=self.map_color_by)
+
+    def report_snapshot(self, parcelle_ids=None):
+        """Découpe une fois les données de monitoring en un dictionnaire parcelle -> DataFrame trié."""
+        monitoring = self.data_manager.monitoring_data[REPORT_COLUMNS]
+        if parcelle_ids is not None:
+            monitoring = monitoring[monitoring['parcelle_id'].isin(parcelle_ids)]
+        monitoring = monitoring.sort_values(['parcelle_id', 'date'])
+        return {str(parcelle_id): group.reset_index(drop=True)
+                for parcelle_id, group in monitoring.groupby('parcelle_id', observed=True, sort=False)}
+
+    @instrumented('report.generate_parcelle_report')
+    def generate_parcelle_report(self, parcelle_id, output_file="rapport_parcelle.pdf", include_map=True):
+        """Génère un rapport PDF pour une parcelle donnée."""
+        parcelle_data = self.report_snapshot([parcelle_id]).get(parcelle_id)
+        if parcelle_data is None:
+            raise KeyError(f"Aucune donnée de monitoring pour la parcelle {parcelle_id}.")
+
+        map_image = self.map_image() if include_map else None
+        risk = self.data_manager.risk_engine.parcelle_risk(parcelle_id)
+        build_parcelle_pdf(parcelle_id, parcelle_data, output_file, map_image, risk)
+        logger.info("Rapport généré avec succès : %s", output_file)
+
+    @instrumented('report.generate_reports')
+    def generate_reports(self, parcelle_ids=None, output_dir="rapports", max_workers=None, include_map=True):
+        """Génère les rapports de plusieurs parcelles (toutes par défaut) sur un pool de processus.
+
+        Chaque processus reçoit une seule fois l'instantané des données. Retourne
+        un DataFrame avec, pour chaque rapport, le fichier produit, sa durée de
+        génération en secondes et son statut.
+        """
+        snapshot = self.report_snapshot(parcelle_ids)
+        if parcelle_ids is None:
+            parcelle_ids = list(snapshot)
+        missing = [parcelle_id for parcelle_id in parcelle_ids if parcelle_id not in snapshot]
+        if missing:
+            logger.warning("Aucune donnée de monitoring pour : %s", missing)
+        parcelle_ids = [parcelle_id for parcelle_id in parcelle_ids if parcelle_id in snapshot]
+
+        # La carte est rendue une seule fois puis partagée par tous les rapports
+        map_image = self.map_image() if include_map else None
+        os.makedirs(output_dir, exist_ok=True)
+        risk = self.data_manager.risk_engine.risk_table().set_index('parcelle_id')
+        tasks = [(parcelle_id, os.path.join(output_dir, f"rapport_{parcelle_id}.pdf"), map_image,
+                  risk.loc[parcelle_id].to_dict() if parcelle_id in risk.index else None)
+                 for parcelle_id in parcelle_ids]
+
+        start = time.perf_counter()
+        workers = max(1, min(max_workers or os.cpu_count() or 1, len(tasks)))
+        if workers == 1:
+            _init_worker(snapshot)
+            results = [_render_worker(task) for task in tasks]
+        else:
+            chunksize = max(1, math.ceil(len(tasks) / (workers * 4)))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(snapshot,)) as executor:
+                results = list(executor.map(_render_worker, tasks, chunksize=chunksize))
+
+        timings = pd.DataFrame(results, columns=['parcelle_id', 'fichier', 'secondes', 'statut'])
+        logger.info("%d rapport(s) généré(s) en %.2f s dans %s",
+                    (timings['statut'] == 'ok').sum(), time.perf_counter() - start, output_dir)
+        return timings
+
+def save_parcel_map_image(data_manager, output_file="carte_parcelles.png", color_by=None):
+    """Exporte la carte des parcelles en image PNG, sans navigateur (voir StaticMapRenderer)."""
+    shutil.copyfile(StaticMapRenderer(data_manager).render(color_by=color_by), output_file)
+    return output_file
+
+
+if __name__ == "__main__":
+    configure_logging()
+
+    # Initialisation du gestionnaire de données
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+
+    # Initialisation du générateur de rapports
+    report_generator = AgriculturalReportGenerator(data_manager)
+
+    # Générer un rapport pour une parcelle spécifique
+    parcelle_id = 'P001'  # Remplacez par l'ID d'une parcelle existante
+    report_generator.generate_parcelle_report(parcelle_id)
+
+    # Générer les rapports de toutes les parcelles
+    print(report_generator.generate_reports())
@@ -1,124 +1,217 @@
+import hashlib
+import logging
+
 import numpy as np
-from sklearn.metrics import mean_squared_error
+import pandas as pd
+
+from instrumentation import configure_logging, instrumented, stage
+from weather_api import WeatherAPI  # noqa: F401  (réexporté pour les scripts qui l'importent d'ici)
+
+WINDOWS = ('expanding', 'sliding')  # Fenêtres d'entraînement de la validation progressive
+
+logger = logging.getLogger(__name__)
+
+
+def walk_forward_splits(n_samples, n_folds=5, test_size=None, min_train_size=None, window='expanding'):
+    """Bornes des plis d'une validation progressive (walk-forward) sur une série ordonnée.
+
+    Les `n_folds` fenêtres de test consécutives, de `test_size` observations
+    (par défaut n_samples // (n_folds + 1)), couvrent la fin de la série.
+    Chaque pli est entraîné sur les observations qui précèdent sa fenêtre de
+    test : toutes ('expanding') ou les `min_train_size` dernières ('sliding').
+    Les plis disposant de moins de `min_train_size` observations
+    d'entraînement (par défaut `test_size`) sont écartés. Retourne un tableau
+    (n_plis x 3) : début d'entraînement, début et fin (exclue) du test.
+    """
+    if window not in WINDOWS:
+        raise ValueError(f"Fenêtre inconnue : {window} (attendu : {', '.join(WINDOWS)})")
+    test_size = test_size or n_samples // (n_folds + 1)
+    if test_size < 1:
+        return np.empty((0, 3), dtype=np.int64)
+    min_train_size = min_train_size or test_size
+
+    test_starts = n_samples - test_size * np.arange(n_folds, 0, -1, dtype=np.int64)
+    test_starts = test_starts[test_starts >= min_train_size]
+    train_starts = np.zeros_like(test_starts) if window == 'expanding' else test_starts - min_train_size
+    return np.column_stack([train_starts, test_starts, test_starts + test_size])
+
+
+def segment_metrics(y_true, y_pred, starts):
+    """MSE, MAE, MAPE et R² de segments contigus, calculés d'un bloc avec np.add.reduceat.
+
+    `starts` donne le début de chaque segment (pli ou parcelle) dans les
+    tableaux concaténés. La MAPE, exprimée en fraction comme dans
+    scikit-learn, ignore les rendements nuls ; le R² d'un segment constant vaut NaN.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.diff(np.append(starts, len(y_true)))
+    errors = y_pred - y_true
+    nonzero = y_true != 0
+    relative = np.where(nonzero, np.abs(errors) / np.where(nonzero, np.abs(y_true), 1.0), 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sse = np.add.reduceat(errors ** 2, starts)
+        mean_true = np.add.reduceat(y_true, starts) / counts
+        sst = np.add.reduceat((y_true - np.repeat(mean_true, counts)) ** 2, starts)
+        return {
+            'n_test': counts,
+            'mse': sse / counts,
+            'mae': np.add.reduceat(np.abs(errors), starts) / counts,
+            'mape': np.add.reduceat(relative, starts) / np.add.reduceat(nonzero.astype(np.float64), starts),
+            'r2': np.where(sst > 0, 1 - sse / sst, np.nan),
+        }
+
+
+def _run_folds(estimator, X, y, splits):
+    """Entraîne et évalue des plis d'une parcelle (exécuté dans un processus de travail joblib).
+
+    Seuls les plis à calculer sont transmis. Retourne, pour chacun, le
+    couple (modèle, prédictions).
+    """
+    from sklearn.base import clone
+
+    results = []
+    for train_start, test_start, test_end in splits:
+        model = clone(estimator).fit(X[train_start:test_start], y[train_start:test_start])
+        results.append((model, model.predict(X[test_start:test_end])))
+    return results
+
 
 class AgriculturalValidation:
     def __init__(self, analyzer):
         """Initialise le système de validation avec l'analyseur."""
         self.analyzer = analyzer
+        self._folds = {}  # (parcelle, schéma, empreintes entraînement/test) -> (modèle, prédictions)
 
     def validate_recommendations(self, parcelle_id, actual_yields):
-        """Valide les recommandations en comparant les prédictions aux rendements réels."""
-        predictions = self.analyzer.predict_yield(parcelle_id)
-        mse = mean_squared_error(actual_yields, predictions)
-        print(f"Erreur quadratique moyenne pour la parcelle {parcelle_id} : {mse:.2f}")
+        """Valide les recommandations en comparant les prédictions aux rendements réels.
+
+        `actual_yields` doit contenir un rendement (tonnes/ha) par observation
+        de la parcelle ; les prédictions normalisées sont ramenées en tonnes/ha
+        avant le calcul de l'erreur. Cette erreur est mesurée sur les données
+        d'entraînement ; la capacité de prévision s'évalue avec backtest().
+        """
+        registry = self.analyzer.model_registry
+        predictions = registry.to_yield(self.analyzer.predict_yield(parcelle_id))
+        actual_yields = np.asarray(actual_yields, dtype=np.float64)
+        if len(actual_yields) != len(predictions):
+            raise ValueError(f"{len(actual_yields)} rendements réels fournis pour {len(predictions)} "
+                             f"observations de la parcelle {parcelle_id}.")
+        mse = float(np.mean((actual_yields - predictions) ** 2))
+        logger.info("Erreur quadratique moyenne pour la parcelle %s : %.2f", parcelle_id, mse)
         return mse
-    
-    # Exemple de données réelles (à remplacer par vos données)
-actual_yields = np.random.uniform(10, 20, size=10)  # Rendements réels
-
-# Validation des recommandations
-validation = AgriculturalValidation(analyzer)
-mse = validation.validate_recommendations('P001', actual_yields)
-
-class AgriculturalAnalyzer:
-    def __init__(self, data_manager):
-        """Initialise l'analyseur avec le gestionnaire de données."""
-        self.data_manager = data_manager
-
-    def calculate_risk_metrics(self, parcelle_id):
-        """Calcule les métriques de risque pour une parcelle donnée."""
-        data = self.data_manager.prepare_features()
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
-
-        # Exemple de métrique de risque : probabilité de stress hydrique élevé
-        risk_metric = np.mean(parcelle_data['stress_hydrique'] > 0.15)  # Seuil arbitraire
-        return risk_metric
-
-    def identify_high_risk_parcelles(self, threshold=0.5):
-        """Identifie les parcelles à haut risque."""
-        data = self.data_manager.prepare_features()
-        high_risk_parcelles = data[data['stress_hydrique'] > threshold]
-        return high_risk_parcelles
-    
-    high_risk_parcelles = analyzer.identify_high_risk_parcelles()
-print("Parcelles à haut risque :")
-print(high_risk_parcelles[['parcelle_id', 'stress_hydrique']])
-
-import requests
-
-class WeatherAPI:
-    def __init__(self, api_key):
-        """Initialise l'API météorologique."""
-        self.api_key = api_key
-
-    def get_weather_data(self, latitude, longitude):
-        """Obtient les données météorologiques pour une localisation donnée."""
-        url = f"http://api.openweathermap.org/data/2.5/weather?lat={latitude}&lon={longitude}&appid={self.api_key}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Erreur lors de la récupération des données météorologiques : {response.status_code}")
-        
-        # Exemple d'utilisation de l'API météorologique
-api_key = "votre_clé_api"  # Remplacez par votre clé API OpenWeatherMap
-weather_api = WeatherAPI(api_key)
-
-# Coordonnées d'une parcelle
-latitude = 45.5236
-longitude = -122.6750
-
-# Récupérer les données météorologiques
-weather_data = weather_api.get_weather_data(latitude, longitude)
-print("Données météorologiques :", weather_data)
-
-from fpdf import FPDF
-import matplotlib.pyplot as plt
-
-class AgriculturalReportGenerator:
-    def __init__(self, data_manager):
-        """Initialise le générateur de rapports avec le gestionnaire de données."""
-        self.data_manager = data_manager
-
-    def generate_parcelle_report(self, parcelle_id, output_file="rapport_parcelle.pdf"):
-        """Génère un rapport PDF pour une parcelle donnée."""
-        data = self.data_manager.prepare_features()
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
-
-        # Créer un PDF
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        # Ajouter un titre
-        pdf.cell(200, 10, txt=f"Rapport pour la parcelle {parcelle_id}", ln=True, align="C")
-
-        # Ajouter des informations sur la parcelle
-        pdf.cell(200, 10, txt="Informations sur la parcelle :", ln=True)
-        pdf.cell(200, 10, txt=f"Culture : {parcelle_data['culture'].iloc[0]}", ln=True)
-        pdf.cell(200, 10, txt=f"Rendement moyen : {parcelle_data['rendement'].mean():.2f} tonnes/ha", ln=True)
-
-        # Ajouter un graphique (exemple : rendement au fil du temps)
-        plt.figure()
-        plt.plot(parcelle_data['date'], parcelle_data['rendement'], label="Rendement")
-        plt.title(f"Rendement pour la parcelle {parcelle_id}")
-        plt.xlabel("Date")
-        plt.ylabel("Rendement (tonnes/ha)")
-        plt.legend()
-        plot_path = "rendement_plot.png"
-        plt.savefig(plot_path)
-        plt.close()
-
-        # Ajouter le graphique au PDF
-        pdf.image(plot_path, x=10, y=50, w=180)
-
-        # Sauvegarder le PDF
-        pdf.output(output_file)
-        print(f"Rapport généré avec succès : {output_file}")
-
-        # Nettoyer les fichiers temporaires
-        if os.path.exists(plot_path):
-            os.remove(plot_path)
-
-            report_generator = AgriculturalReportGenerator(data_manager)
-report_generator.generate_parcelle_report('P001')
\ No newline at end of file
+
+    @instrumented('validation.backtest')
+    def backtest(self, parcelle_ids=None, n_folds=5, test_size=None, min_train_size=None,
+                 window='expanding', estimator=None, n_jobs=None, cache_models=True):
+        """Évalue la capacité de prévision des modèles par validation progressive (walk-forward).
+
+        Pour chaque parcelle (toutes par défaut), les observations sont prises
+        dans l'ordre chronologique et découpées par walk_forward_splits ; un
+        modèle (clone de `estimator`, par défaut le modèle du registre) est
+        entraîné par pli sur le passé puis évalué sur la fenêtre suivante. Les
+        parcelles sont traitées en parallèle (`n_jobs`, par défaut celui du
+        registre). Comme ceux du registre, les modèles sont entraînés sur les
+        valeurs brutes. Avec `cache_models`, les modèles de pli sont conservés
+        et réutilisés, avec leurs prédictions, tant que les données brutes du
+        pli sont inchangées ; seuls les plis du dernier appel sont gardés pour
+        chaque parcelle évaluée.
+
+        Retourne une ligne par parcelle : nombre de plis et d'observations
+        testées, MSE, MAE, MAPE et R² sur l'ensemble des fenêtres de test, en
+        t/ha. Le détail par pli est dans `attrs['folds']` et les parcelles trop
+        courtes pour un pli dans `attrs['skipped']`.
+        """
+        from joblib import Parallel, delayed
+        from sklearn.base import clone
+
+        registry = self.analyzer.model_registry
+        estimator = clone(estimator if estimator is not None else registry.estimator)
+        if 'n_jobs' in estimator.get_params():
+            estimator.set_params(n_jobs=1)
+        parcelle_ids = list(dict.fromkeys(
+            registry.data_manager.feature_store.parcelles if parcelle_ids is None else parcelle_ids))
+        schema = None
+
+        tasks, skipped = [], []
+        for parcelle_id in parcelle_ids:
+            data = registry.data_manager.get_features(parcelle_id)
+            splits = walk_forward_splits(len(data), n_folds, test_size, min_train_size, window)
+            if len(splits) == 0:
+                skipped.append(parcelle_id)
+                continue
+            # Valeurs brutes : une nouvelle normalisation ne change ni les modèles ni les empreintes
+            data = registry.to_raw(data)
+            X, y = registry.split_target(data)
+            if schema is None:
+                schema = registry.schema_hash(X.columns, estimator)
+
+            # Empreinte de chaque pli, à partir des empreintes de lignes de la partition
+            row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+            keys = [(parcelle_id, schema, hashlib.sha256(row_hashes[train_start:test_start].tobytes()).hexdigest(),
+                     hashlib.sha256(row_hashes[test_start:test_end].tobytes()).hexdigest())
+                    for train_start, test_start, test_end in splits]
+            folds = [self._folds.get(key) for key in keys]
+            tasks.append((parcelle_id, data['date'].to_numpy(), X.to_numpy(np.float64),
+                          y.to_numpy(np.float64), splits, keys, folds))
+
+        # Seuls les plis à calculer sont envoyés aux processus de travail (sans les modèles en cache)
+        pending = [(task, [position for position, fold in enumerate(task[6]) if fold is None]) for task in tasks]
+        pending = [(task, missing) for task, missing in pending if missing]
+        with stage('validation.fold_fit', rows=sum(len(missing) for _, missing in pending)):
+            outputs = Parallel(n_jobs=registry.n_jobs if n_jobs is None else n_jobs)(
+                delayed(_run_folds)(estimator, task[2], task[3], [task[4][position] for position in missing])
+                for task, missing in pending)
+        for (task, missing), output in zip(pending, outputs):
+            for position, fold in zip(missing, output):
+                task[6][position] = fold
+
+        if cache_models:
+            # Un seul jeu de plis par parcelle : ceux des appels précédents sont oubliés
+            evaluated = set(parcelle_ids)
+            self._folds = {key: fold for key, fold in self._folds.items() if key[0] not in evaluated}
+            for task in tasks:
+                self._folds.update(zip(task[5], task[6]))
+
+        # Concaténation de toutes les fenêtres de test pour un calcul vectorisé des scores
+        y_true, y_pred, fold_rows = [], [], []
+        for parcelle_id, dates, _, y, splits, keys, folds in tasks:
+            y_true.extend(y[test_start:test_end] for _, test_start, test_end in splits)
+            y_pred.extend(predictions for _, predictions in folds)
+            fold_rows.extend((parcelle_id, fold, dates[test_start], dates[test_end - 1])
+                             for fold, (_, test_start, test_end) in enumerate(splits, start=1))
+
+        folds = pd.DataFrame(fold_rows, columns=['parcelle_id', 'pli', 'debut_test', 'fin_test'])
+        scores = pd.DataFrame(columns=['parcelle_id', 'n_plis', 'n_test', 'mse', 'mae', 'mape', 'r2'])
+        if tasks:
+            y_true = np.concatenate(y_true)
+            y_pred = np.concatenate(y_pred)
+            fold_sizes = np.array([end - start for task in tasks for _, start, end in task[4]])
+            fold_starts = np.concatenate([[0], np.cumsum(fold_sizes)[:-1]])
+            folds = folds.assign(**segment_metrics(y_true, y_pred, fold_starts))
+
+            n_folds_per_parcel = np.array([len(task[4]) for task in tasks])
+            parcel_starts = fold_starts[np.concatenate([[0], np.cumsum(n_folds_per_parcel)[:-1]])]
+            scores = pd.DataFrame({'parcelle_id': [task[0] for task in tasks], 'n_plis': n_folds_per_parcel,
+                                   **segment_metrics(y_true, y_pred, parcel_starts)})
+
+        if skipped:
+            logger.warning("%d parcelle(s) trop courte(s) pour la validation progressive : %s",
+                           len(skipped), skipped[:10])
+        scores.attrs['folds'] = folds
+        scores.attrs['skipped'] = skipped
+        return scores
+
+
+# Validation progressive des modèles de rendement sur toutes les parcelles
+if __name__ == "__main__":
+    from data_manager import AgriculturalDataManager
+    from analyzer import AgriculturalAnalyzer
+
+    configure_logging()
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+
+    validation = AgriculturalValidation(AgriculturalAnalyzer(data_manager))
+    scores = validation.backtest(n_folds=5, window='expanding')
+    print(scores.sort_values('mse').to_string(index=False))
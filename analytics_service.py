@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+from pydantic import BaseModel
+
+from analyzer import AgriculturalAnalyzer
+from data_manager import AgriculturalDataManager
+from instrumentation import configure_logging, get_registry, stage
+
+# Analyses servies par parcelle (voir AgriculturalAnalyticsService._compute)
+KINDS = ('correlations', 'risk', 'trends', 'predictions')
+
+logger = logging.getLogger(__name__)
+
+
+def _json_values(values):
+    """Convertit un tableau en liste JSON (NaN -> null, dates au format ISO)."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return np.datetime_as_string(values, unit='D').tolist()
+    values = values.astype(np.float64)
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def _json_scalar(value):
+    """Convertit une valeur numpy/pandas en valeur JSON (NaN et NA -> null)."""
+    if isinstance(value, (str, bool)) or value is None:
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(value) else value
+
+
+class AgriculturalAnalyticsService:
+    def __init__(self, data_manager, analyzer=None, max_workers=None, cache_size=10_000):
+        """Service d'analyse au-dessus d'un gestionnaire de données chargé une seule fois.
+
+        Les caractéristiques, la table de risque et les modèles restent en
+        mémoire. Les calculs s'exécutent dans un pool de `max_workers` threads
+        (numpy, pandas et sklearn libèrent le GIL sur l'essentiel du travail),
+        ce qui laisse la boucle asyncio libre de répondre aux autres requêtes.
+        Les réponses sont gardées encodées en JSON, indexées par analyse,
+        paramètres, parcelle et version des données (`cache_size` entrées au
+        plus, les moins récemment lues sont évincées). Une même réponse
+        demandée simultanément n'est calculée qu'une fois.
+        """
+        self.data_manager = data_manager
+        self.analyzer = analyzer or AgriculturalAnalyzer(data_manager)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                           thread_name_prefix='analyse')
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (analyse, paramètres, parcelle, version) -> JSON encodé
+        self._pending = {}           # Même clé -> asyncio.Future du calcul en cours
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def warm_up(self, train_models=False):
+        """Construit les caractéristiques et la table de risque (et, sur demande, entraîne les modèles)."""
+        with stage('service.warm_up'):
+            self.data_manager.prepare_features()
+            self.data_manager.risk_engine.risk_table()
+            if train_models:
+                self.analyzer.model_registry.train()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def data_version(self):
+        return self.data_manager.data_version
+
+    @property
+    def parcelles(self):
+        return self.data_manager.feature_store.parcelles
+
+    def _compute_correlations(self, parcelle_ids, method='pearson'):
+        correlations = self.analyzer.analyze_yield_factors_batch(parcelle_ids, method=method)
+        features = list(correlations.columns)
+        return {str(parcelle_id): {'correlations': dict(zip(features, _json_values(row)))}
+                for parcelle_id, row in zip(correlations.index, correlations.to_numpy())}
+
+    def _compute_risk(self, parcelle_ids):
+        table = self.data_manager.risk_engine.risk_table()
+        table = table[table['parcelle_id'].isin(parcelle_ids)]
+        return {row['parcelle_id']: {key: _json_scalar(value) for key, value in row.items() if key != 'parcelle_id'}
+                for row in table.to_dict('records')}
+
+    def _compute_trends(self, parcelle_ids):
+        components = self.analyzer.analyze_yield_trends_batch(parcelle_ids)
+        result = {}
+        for parcelle_id, group in components.groupby('parcelle_id', observed=True, sort=False):
+            result[str(parcelle_id)] = {column: _json_values(group[column].to_numpy())
+                                        for column in ('date', 'observed', 'trend', 'seasonal', 'resid')}
+        return result
+
+    def _compute_predictions(self, parcelle_ids):
+        # Les modèles manquants sont entraînés ensemble (en parallèle) avant les prédictions
+        self.analyzer.model_registry.train(parcelle_ids)
+        result = {}
+        for parcelle_id in parcelle_ids:
+            dates = self.data_manager.get_features(parcelle_id)['date'].to_numpy()
+            predictions = self.analyzer.model_registry.to_yield(self.analyzer.predict_yield(parcelle_id))
+            result[parcelle_id] = {'date': _json_values(dates), 'rendement_predit': _json_values(predictions)}
+        return result
+
+    def _compute(self, kind, params, parcelle_ids):
+        """Calcule une analyse pour plusieurs parcelles en un seul appel ; exécuté dans le pool.
+
+        Retourne parcelle -> JSON encodé, ou None si la parcelle n'a pas de résultat.
+        """
+        with stage(f"service.{kind}", rows=len(parcelle_ids)):
+            payloads = getattr(self, f"_compute_{kind}")(parcelle_ids, **dict(params))
+        return {parcelle_id: json.dumps(payloads[parcelle_id], ensure_ascii=False, allow_nan=False).encode()
+                if parcelle_id in payloads else None
+                for parcelle_id in parcelle_ids}
+
+    async def query(self, kind, parcelle_ids, **params):
+        """Retourne parcelle -> JSON encodé (ou None) pour l'analyse `kind`, depuis le cache si possible."""
+        if kind not in KINDS:
+            raise ValueError(f"Analyse inconnue : {kind}")
+        params = tuple(sorted(params.items()))
+        version = self.data_version
+        keys = {parcelle_id: (kind, params, parcelle_id, version) for parcelle_id in parcelle_ids}
+
+        results, waiting, missing = {}, {}, []
+        for parcelle_id, key in keys.items():
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                results[parcelle_id] = self._cache[key]
+            elif key in self._pending:
+                waiting[parcelle_id] = self._pending[key]
+            else:
+                missing.append(parcelle_id)
+        self.cache_hits += len(results)
+        self.cache_misses += len(missing)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self._compute, kind, params, missing)
+            for parcelle_id in missing:
+                self._pending[keys[parcelle_id]] = future
+            try:
+                # Protégé : l'annulation d'un client ne doit pas annuler le calcul partagé
+                computed = await asyncio.shield(future)
+            finally:
+                for parcelle_id in missing:
+                    self._pending.pop(keys[parcelle_id], None)
+            for parcelle_id, payload in computed.items():
+                self._store(keys[parcelle_id], payload)
+            results.update(computed)
+
+        for parcelle_id, future in waiting.items():
+            results[parcelle_id] = (await asyncio.shield(future))[parcelle_id]
+        return results
+
+    def _store(self, key, payload):
+        self._cache[key] = payload
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def invalidate(self):
+        """Vide le cache des réponses (les entrées d'une ancienne version ne sont de toute façon plus lues)."""
+        self._cache.clear()
+
+
+class BulkRequest(BaseModel):
+    parcelle_ids: list[str]
+    analyses: list[str] = ['risk']
+    method: str = 'pearson'
+
+
+def _params(kind, method):
+    return {'method': method} if kind == 'correlations' else {}
+
+
+def create_app(service, train_models=False):
+    """Crée l'application FastAPI du service (préchauffé au démarrage, pool fermé à l'arrêt)."""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await asyncio.get_running_loop().run_in_executor(service.executor, service.warm_up, train_models)
+        logger.info("Service prêt : %d parcelle(s), version des données %s",
+                    len(service.parcelles), service.data_version)
+        yield
+        service.close()
+
+    app = FastAPI(title="Service d'analyse agricole", lifespan=lifespan)
+    app.state.service = service
+
+    def envelope(payload):
+        return Response(content=payload, media_type='application/json')
+
+    async def parcel_response(kind, parcelle_id, **params):
+        if parcelle_id not in service.parcelles:
+            raise HTTPException(status_code=404, detail=f"Parcelle inconnue : {parcelle_id}")
+        payload = (await service.query(kind, [parcelle_id], **params))[parcelle_id]
+        if payload is None:
+            raise HTTPException(status_code=404, detail=f"Aucun résultat '{kind}' pour la parcelle {parcelle_id}")
+        return envelope(payload)
+
+    @app.get('/health')
+    async def health():
+        return {'statut': 'ok', 'data_version': service.data_version, 'parcelles': len(service.parcelles),
+                'cache': {'entrees': len(service._cache), 'hits': service.cache_hits,
+                          'misses': service.cache_misses}}
+
+    @app.get('/parcelles')
+    async def parcelles():
+        return {'data_version': service.data_version, 'parcelles': service.parcelles}
+
+    @app.get('/parcelles/{parcelle_id}/correlations')
+    async def correlations(parcelle_id: str, method: str = Query('pearson', pattern='^(pearson|spearman)$')):
+        return await parcel_response('correlations', parcelle_id, method=method)
+
+    @app.get('/parcelles/{parcelle_id}/risk')
+    async def risk(parcelle_id: str):
+        return await parcel_response('risk', parcelle_id)
+
+    @app.get('/parcelles/{parcelle_id}/trends')
+    async def trends(parcelle_id: str):
+        return await parcel_response('trends', parcelle_id)
+
+    @app.get('/parcelles/{parcelle_id}/predictions')
+    async def predictions(parcelle_id: str):
+        return await parcel_response('predictions', parcelle_id)
+
+    @app.post('/bulk')
+    async def bulk(request: BulkRequest):
+        """Plusieurs analyses pour plusieurs parcelles : chaque analyse est calculée en un seul lot."""
+        kinds = list(dict.fromkeys(request.analyses))
+        unknown_kinds = [kind for kind in kinds if kind not in KINDS]
+        if unknown_kinds or request.method not in ('pearson', 'spearman'):
+            raise HTTPException(status_code=422, detail=f"Analyse ou méthode inconnue : {unknown_kinds or request.method}")
+        known = set(service.parcelles)
+        parcelle_ids = list(dict.fromkeys(p for p in request.parcelle_ids if p in known))
+        unknown = [p for p in request.parcelle_ids if p not in known]
+
+        results = await asyncio.gather(*(service.query(kind, parcelle_ids, **_params(kind, request.method))
+                                         for kind in kinds))
+
+        # Réponse assemblée à partir des fragments JSON déjà encodés
+        parts = []
+        for kind, payloads in zip(kinds, results):
+            entries = b",".join(json.dumps(p).encode() + b":" + (payloads[p] or b"null") for p in parcelle_ids)
+            parts.append(json.dumps(kind).encode() + b":{" + entries + b"}")
+        header = json.dumps({'data_version': service.data_version, 'inconnues': unknown})[:-1].encode()
+        return envelope(header + b',"resultats":{' + b",".join(parts) + b"}}")
+
+    @app.get('/metrics', response_class=PlainTextResponse)
+    async def metrics():
+        """Mesures des étapes au format Prometheus (instrumentation activée avec métriques)."""
+        registry = get_registry()
+        if registry is None:
+            raise HTTPException(status_code=404, detail="Instrumentation désactivée")
+        return registry.to_prometheus()
+
+    return app
+
+
+def serve(data_dir='data', host='127.0.0.1', port=8000, workers=None, cache_size=10_000, warm_models=False,
+          cache_dir=None):
+    """Charge les données une fois et sert l'application avec uvicorn (bloquant)."""
+    import uvicorn
+
+    data_manager = AgriculturalDataManager(data_dir, cache_dir=cache_dir)
+    data_manager.load_data()
+    service = AgriculturalAnalyticsService(data_manager, max_workers=workers, cache_size=cache_size)
+    uvicorn.run(create_app(service, train_models=warm_models), host=host, port=port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Service HTTP d'analyse des parcelles.")
+    parser.add_argument('--data-dir', default='data', help="Répertoire des fichiers CSV")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help="Threads de calcul (défaut : nombre de cœurs)")
+    parser.add_argument('--cache-size', type=int, default=10_000, help="Réponses gardées en cache")
+    parser.add_argument('--warm-models', action='store_true', help="Entraîne tous les modèles au démarrage")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    serve(args.data_dir, args.host, args.port, args.workers, args.cache_size, args.warm_models)
+
+
+if __name__ == "__main__":
+    main()
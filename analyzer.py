@@ -1,20 +1,76 @@
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from scipy import stats
-from statsmodels.tsa.seasonal import seasonal_decompose
 from data_manager import AgriculturalDataManager
+from model_registry import YieldModelRegistry
+from scenario_engine import AgriculturalScenarioEngine
+from trend_engine import YieldTrendEngine, resolve_yield_column
+from instrumentation import configure_logging, instrumented
+
+
+def grouped_correlations(codes, n_groups, X, y):
+    """Corrélations de Pearson entre chaque colonne de X et y, groupe par groupe.
+
+    Les moments (effectifs, moyennes, sommes des produits centrés) sont
+    accumulés par groupe avec np.add.reduceat après un tri stable des codes,
+    en ignorant les paires contenant des NaN. Une colonne constante dans un
+    groupe (variance au niveau du bruit d'arrondi) donne NaN, comme
+    DataFrame.corr. Retourne les corrélations (n_groups x n_features) et les
+    effectifs utilisés.
+    """
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    X = X[order]
+    y = y[order]
+
+    # Bornes de chaque groupe dans le tableau trié
+    present = np.unique(codes)
+    starts = np.searchsorted(codes, present)
+
+    valid = ~np.isnan(X) & ~np.isnan(y)[:, None]
+    x_valid = np.where(valid, X, 0.0)
+    y_valid = np.where(valid, y[:, None], 0.0)
+
+    counts = np.add.reduceat(valid.astype(np.float64), starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = np.add.reduceat(x_valid, starts, axis=0) / counts
+        mean_y = np.add.reduceat(y_valid, starts, axis=0) / counts
+
+        # Seconde passe sur les valeurs centrées pour la stabilité numérique
+        group_of_row = np.repeat(np.arange(len(present)), np.diff(np.append(starts, len(codes))))
+        dx = np.where(valid, X - mean_x[group_of_row], 0.0)
+        dy = np.where(valid, y[:, None] - mean_y[group_of_row], 0.0)
+        sxy = np.add.reduceat(dx * dy, starts, axis=0)
+        sxx = np.add.reduceat(dx * dx, starts, axis=0)
+        syy = np.add.reduceat(dy * dy, starts, axis=0)
+
+        # Variance nulle aux erreurs d'arrondi près : somme des carrés sous eps * n * max(x²)
+        eps = np.finfo(np.float64).eps
+        x_scale = np.maximum.reduceat(x_valid * x_valid, starts, axis=0)
+        y_scale = np.maximum.reduceat(y_valid * y_valid, starts, axis=0)
+        constant = (sxx <= eps * counts * x_scale) | (syy <= eps * counts * y_scale)
+        corr = np.where(constant, np.nan, sxy / np.sqrt(sxx * syy))
+
+    result = np.full((n_groups, X.shape[1]), np.nan)
+    result_counts = np.zeros((n_groups, X.shape[1]))
+    result[present] = np.clip(corr, -1.0, 1.0)
+    result_counts[present] = counts
+    return result, result_counts
+
 
 class AgriculturalAnalyzer:
     def __init__(self, data_manager):
         """Initialise l'analyseur avec le gestionnaire de données."""
+        from sklearn.ensemble import RandomForestRegressor
+
         self.data_manager = data_manager
         self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+        self.model_registry = YieldModelRegistry(data_manager, self.model)
+        self.scenario_engine = AgriculturalScenarioEngine(self)
 
+    @instrumented('analyzer.analyze_yield_factors')
     def analyze_yield_factors(self, parcelle_id):
         """Analyse les facteurs influençant les rendements pour une parcelle donnée."""
-        data = self.data_manager.prepare_features()
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
+        parcelle_data = self.data_manager.get_features(parcelle_id)
 
         # Sélectionnez uniquement les colonnes numériques
         numeric_data = parcelle_data.select_dtypes(include=[np.number])
@@ -27,53 +83,130 @@ class AgriculturalAnalyzer:
         correlations = numeric_data.corr()['rendement'].drop('rendement')
         return correlations
 
-    def analyze_yield_trends(self, parcelle_id):
-        """Analyse les tendances des rendements pour une parcelle donnée."""
-        parcelle_data = self.data_manager.yield_history[self.data_manager.yield_history['parcelle_id'] == parcelle_id]
+    @instrumented('analyzer.analyze_yield_factors_batch')
+    def analyze_yield_factors_batch(self, parcelle_ids=None, method='pearson', with_pvalues=False):
+        """Calcule les corrélations rendement/facteurs pour toutes les parcelles en une passe.
 
-        # Vérifiez que la colonne 'rendement' existe
-        if 'rendement' not in parcelle_data.columns:
+        Retourne une matrice parcelles x caractéristiques. `method` vaut 'pearson'
+        ou 'spearman' (corrélation de rang) ; avec `with_pvalues=True`, retourne
+        le couple (corrélations, p-values).
+        """
+        if method not in ('pearson', 'spearman'):
+            raise ValueError(f"Méthode de corrélation inconnue : {method}")
+
+        data = self.data_manager.get_features()
+        if parcelle_ids is not None:
+            data = data[data['parcelle_id'].isin(parcelle_ids)]
+
+        numeric_data = data.select_dtypes(include=[np.number])
+        if 'rendement' not in numeric_data.columns:
             raise KeyError("La colonne 'rendement' est manquante dans les données.")
+        feature_cols = numeric_data.columns.drop('rendement')
+
+        if method == 'spearman':
+            # Rangs calculés à l'intérieur de chaque parcelle
+            numeric_data = numeric_data.groupby(data['parcelle_id'], observed=True).rank()
+
+        codes, parcelles = pd.factorize(data['parcelle_id'], sort=True)
+        correlations, counts = grouped_correlations(
+            codes, len(parcelles),
+            numeric_data[feature_cols].to_numpy(dtype=np.float64),
+            numeric_data['rendement'].to_numpy(dtype=np.float64),
+        )
+        index = pd.Index(parcelles, name='parcelle_id')
+        correlations = pd.DataFrame(correlations, index=index, columns=feature_cols)
+        if not with_pvalues:
+            return correlations
+
+        # Test de significativité : t = r * sqrt((n - 2) / (1 - r²)) à n - 2 degrés de liberté
+        from scipy import stats
+
+        dof = counts - 2.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_stat = correlations.to_numpy() * np.sqrt(dof / (1.0 - correlations.to_numpy() ** 2))
+            pvalues = 2 * stats.t.sf(np.abs(t_stat), np.where(dof > 0, dof, np.nan))
+        pvalues = pd.DataFrame(pvalues, index=index, columns=feature_cols)
+        return correlations, pvalues
+
+    @instrumented('analyzer.analyze_yield_trends')
+    def analyze_yield_trends(self, parcelle_id, value_col=None):
+        """Analyse les tendances des rendements pour une parcelle donnée.
+
+        La colonne décomposée est `value_col` ou, à défaut, 'rendement' puis
+        'rendement_estime' (colonnes de historique_rendements.csv).
+        """
+        from statsmodels.tsa.seasonal import seasonal_decompose
+
+        yield_history = self.data_manager.yield_history
+        value_col = resolve_yield_column(yield_history.columns, value_col)
+        parcelle_data = yield_history[yield_history['parcelle_id'] == parcelle_id].sort_values('date')
 
         # Décomposition des séries temporelles
-        decomposition = seasonal_decompose(parcelle_data['rendement'], model='additive', period=12)
+        series = parcelle_data.set_index('date')[value_col]
+        decomposition = seasonal_decompose(series, model='additive', period=12)
         trend = decomposition.trend
         seasonal = decomposition.seasonal
         residual = decomposition.resid
 
         return trend, seasonal, residual
 
-    def calculate_risk_metrics(self, parcelle_id):
-        """Calcule les métriques de risque pour une parcelle donnée."""
-        data = self.data_manager.prepare_features()
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
-
-        # Exemple de métrique de risque : probabilité de stress hydrique élevé
-        risk_metric = np.mean(parcelle_data['stress_hydrique'] > 0.15)  # Seuil arbitraire
-        return risk_metric
+    @instrumented('analyzer.analyze_yield_trends_batch')
+    def analyze_yield_trends_batch(self, parcelle_ids=None, method='numpy', value_col=None, max_workers=None):
+        """Décompose les séries de rendement de toutes les parcelles (voir YieldTrendEngine.decompose)."""
+        engine = YieldTrendEngine(self.data_manager.yield_history, value_col=value_col,
+                                  max_workers=max_workers)
+        return engine.decompose(parcelle_ids, method=method)
 
-    def predict_yield(self, parcelle_id):
-        """Prédit les rendements futurs pour une parcelle donnée."""
-        data = self.data_manager.prepare_features()
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
-
-        # Vérifiez que la colonne 'rendement' existe
-        if 'rendement' not in parcelle_data.columns:
-            raise KeyError("La colonne 'rendement' est manquante dans les données.")
-
-        # Séparation des caractéristiques et de la cible
-        X = parcelle_data.select_dtypes(include=[np.number]).drop(columns=['rendement'])
-        y = parcelle_data['rendement']
+    @instrumented('analyzer.calculate_risk_metrics')
+    def calculate_risk_metrics(self, parcelle_id):
+        """Calcule les métriques de risque pour une parcelle donnée.
+
+        Retourne la probabilité que le stress hydrique mesuré dépasse le seuil
+        de référence, lue dans la table du moteur de risque (NaN si la
+        parcelle n'a aucun relevé).
+        """
+        engine = self.data_manager.risk_engine
+        risk = engine.parcelle_risk(parcelle_id)
+        return float(risk.get(f"p_stress_{engine.reference_threshold:g}", np.nan))
+
+    @instrumented('analyzer.identify_high_risk_parcelles')
+    def identify_high_risk_parcelles(self, threshold=0.5):
+        """Identifie les parcelles à haut risque.
+
+        Retourne les lignes de la table de risque (classée, voir
+        AgriculturalRiskEngine.risk_table) dont le score atteint `threshold`.
+        """
+        table = self.data_manager.risk_engine.risk_table()
+        return table[table['score_risque'] >= threshold].reset_index(drop=True)
+
+    @instrumented('analyzer.predict_yield')
+    def predict_yield(self, parcelle_id, X_new=None):
+        """Prédit les rendements pour une parcelle donnée.
+
+        Le modèle de la parcelle est servi par le registre (entraîné une seule fois
+        par version de ses données) ; sans `X_new`, la prédiction porte sur les
+        observations de la parcelle.
+        """
+        if X_new is None:
+            parcelle_data = self.data_manager.get_features(parcelle_id)
+            X_new, _ = self.model_registry.split_target(parcelle_data)
+
+        # Prédiction avec le modèle entraîné de la parcelle
+        predictions = self.model_registry.predict(parcelle_id, X_new)
+        return predictions
 
-        # Entraînement du modèle
-        self.model.fit(X, y)
+    def simulate_yield_scenarios(self, parcelle_ids=None, n_scenarios=10_000, scenario='reference', **options):
+        """Simule la distribution des rendements des parcelles sous un scénario météo.
 
-        # Prédiction
-        predictions = self.model.predict(X)
-        return predictions
+        Voir AgriculturalScenarioEngine.simulate : quantiles de rendement et
+        probabilité de passer sous l'objectif, une ligne par parcelle.
+        """
+        return self.scenario_engine.simulate(parcelle_ids, n_scenarios=n_scenarios, scenario=scenario, **options)
 
 # Test de la classe AgriculturalAnalyzer
 if __name__ == "__main__":
+    configure_logging()
+
     # Initialisation du gestionnaire de données
     data_manager = AgriculturalDataManager()
     data_manager.load_data()
@@ -102,10 +235,20 @@ if __name__ == "__main__":
     risk_metric = analyzer.calculate_risk_metrics(parcelle_id)
     print(f"Métrique de risque pour la parcelle {parcelle_id} : {risk_metric:.2f}")
 
+    # Parcelles à haut risque, classées par score
+    high_risk = analyzer.identify_high_risk_parcelles()
+    print(f"{len(high_risk)} parcelle(s) à haut risque :")
+    print(high_risk[['rang', 'parcelle_id', 'score_risque']].head())
+
     # Prédiction des rendements
     try:
         predictions = analyzer.predict_yield(parcelle_id)
         print(f"Prédictions des rendements pour la parcelle {parcelle_id} :")
         print(predictions[:5])  # Affiche les 5 premières prédictions
     except KeyError as e:
-        print(f"Erreur : {e}")
\ No newline at end of file
+        print(f"Erreur : {e}")
+
+    # Rendements simulés sous un printemps sec
+    scenarios = analyzer.simulate_yield_scenarios([parcelle_id], n_scenarios=2000, scenario='printemps_sec')
+    print(f"Rendements simulés (printemps sec) pour la parcelle {parcelle_id} :")
+    print(scenarios.to_string(index=False))
\ No newline at end of file
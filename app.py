@@ -1,30 +1,129 @@
+import time
+
 import streamlit as st
+import streamlit.components.v1 as components
 from data_manager import AgriculturalDataManager
 from dashboard import AgriculturalDashboard
-from map_visualization import AgriculturalMap
+
+PANELS = ["Historique des Rendements", "Évolution du NDVI", "Carte des Parcelles", "Risque des Parcelles"]
+
+
+@st.cache_resource
+def get_data_manager():
+    """Charge les données et construit les caractéristiques une seule fois par processus."""
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+    data_manager.prepare_features()
+    return data_manager
+
+
+@st.cache_data
+def get_parcelle_ids(data_version):
+    """Liste des parcelles disponibles pour une version des données."""
+    return sorted(get_data_manager().feature_store.parcelles)
+
+
+@st.cache_resource
+def get_dashboard(data_version):
+    """Tableau de bord de référence, construit une fois par version des données.
+
+    Il est partagé par toutes les sessions : ses sources Bokeh ne sont jamais
+    affichées ni modifiées, chaque session travaille sur sa propre copie.
+    """
+    return AgriculturalDashboard(get_data_manager())
+
+
+def get_session_dashboard(parcelle_id, data_version):
+    """Copie du tableau de bord propre à la session, positionnée sur la parcelle choisie."""
+    dashboard = st.session_state.get('dashboard')
+    if dashboard is None or st.session_state.get('dashboard_version') != data_version:
+        dashboard = get_dashboard(data_version).session_copy()
+        st.session_state['dashboard'] = dashboard
+        st.session_state['dashboard_version'] = data_version
+    if dashboard.selected_parcelle != parcelle_id:
+        dashboard.select_parcelle(parcelle_id)
+    return dashboard
+
+
+@st.cache_data
+def get_map_html(data_version):
+    """Rendu HTML de la carte des parcelles, calculé une fois par version des données."""
+    from map_visualization import AgriculturalMap
+
+    agricultural_map = AgriculturalMap(get_data_manager())
+    return agricultural_map.create_base_map().get_root().render()
+
+
+@st.cache_data
+def get_risk_table(data_version):
+    """Table de risque classée des parcelles, calculée une fois par version des données."""
+    return get_data_manager().risk_engine.risk_table()[['rang', 'parcelle_id', 'score_risque', 'reserve_relative']]
+
+
+@st.cache_data
+def get_plot_html(parcelle_id, data_version, panel, _dashboard):
+    """HTML autonome d'un graphique Bokeh du tableau de bord et sa hauteur, rendu une fois par
+    parcelle et version des données (st.bokeh_chart n'existe plus dans Streamlit).
+
+    `_dashboard` (exclu de la clé de cache) est le tableau de bord de la session,
+    déjà positionné sur `parcelle_id`.
+    """
+    from bokeh.embed import file_html
+    from bokeh.resources import CDN
+
+    plots = {
+        PANELS[0]: _dashboard.create_yield_history_plot,
+        PANELS[1]: _dashboard.create_ndvi_temporal_plot,
+        PANELS[3]: _dashboard.create_risk_plot,
+    }
+    figure = plots[panel]()
+    html = file_html(figure, CDN)
+    # Les sources de la session servent à d'autres rendus : on les libère du document
+    figure.document.clear()
+    return html, figure.height or 400
+
+
+def show_plot(panel):
+    dashboard = get_session_dashboard(parcelle_id, data_version)
+    html, height = get_plot_html(parcelle_id, data_version, panel, dashboard)
+    components.html(html, height=height + 20)
+
+
+start = time.perf_counter()
 
 # Titre de l'application
 st.title("Tableau de Bord Agricole Interactif")
 
-# Chargement des données
-data_manager = AgriculturalDataManager()
-data_manager.load_data()
-prepared_data = data_manager.prepare_features()
+# Chargement des données (mis en cache pour tout le processus)
+data_manager = get_data_manager()
+data_version = data_manager.data_version
 
-# Initialisation du tableau de bord
-dashboard = AgriculturalDashboard(data_manager)
+# Sélection de la parcelle et des panneaux à afficher
+parcelle_id = st.sidebar.selectbox("Parcelle", get_parcelle_ids(data_version))
+panels = st.sidebar.multiselect("Panneaux", PANELS, default=PANELS[:2])
+if st.sidebar.button("Recharger les données"):
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    st.rerun()
 
+# Seuls les panneaux sélectionnés sont calculés
 # Afficher les visualisations Bokeh
-st.write("### Historique des Rendements")
-yield_plot = dashboard.create_yield_history_plot()
-st.bokeh_chart(yield_plot)
+if PANELS[0] in panels:
+    st.write("### Historique des Rendements")
+    show_plot(PANELS[0])
+
+if PANELS[1] in panels:
+    st.write("### Évolution du NDVI")
+    show_plot(PANELS[1])
 
-st.write("### Évolution du NDVI")
-ndvi_plot = dashboard.create_ndvi_temporal_plot()
-st.bokeh_chart(ndvi_plot)
+if PANELS[3] in panels:
+    st.write("### Risque des Parcelles")
+    show_plot(PANELS[3])
+    st.dataframe(get_risk_table(data_version), hide_index=True)
 
 # Afficher la carte Folium
-st.write("### Carte des Parcelles")
-agricultural_map = AgriculturalMap(data_manager)
-base_map = agricultural_map.create_base_map()
-st.folium_static(base_map)
\ No newline at end of file
+if PANELS[2] in panels:
+    st.write("### Carte des Parcelles")
+    components.html(get_map_html(data_version), height=500)
+
+st.sidebar.caption(f"Rendu en {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# Les modules du projet sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_data import generate_dataset  # noqa: E402
+from data_cache import current_rss_mb  # noqa: E402
+
+
+class MemorySampler:
+    def __init__(self, interval=0.005):
+        """Échantillonne la mémoire résidente dans un thread pour mesurer le pic d'une étape."""
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+@contextmanager
+def measure(results, scale, stage):
+    """Mesure le temps (mur et CPU) et le pic de mémoire résidente d'une étape."""
+    rss_start = current_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with MemorySampler() as sampler:
+        yield
+    results.append({
+        'scale': scale,
+        'stage': stage,
+        'seconds': time.perf_counter() - wall_start,
+        'cpu_seconds': time.process_time() - cpu_start,
+        'peak_rss_delta_mb': max(sampler.peak - rss_start, 0.0),
+    })
+    print(f"  {stage:<32} {results[-1]['seconds']:9.3f} s  {results[-1]['peak_rss_delta_mb']:9.1f} Mo")
+
+
+def run_scale(n_parcelles, args, results):
+    """Génère (ou réutilise) le jeu de données d'une échelle et mesure chaque étape du pipeline."""
+    from data_manager import AgriculturalDataManager
+    from analyzer import AgriculturalAnalyzer
+    from dashboard import AgriculturalDashboard
+    from map_visualization import AgriculturalMap
+    from AgriculturalReportGenerator import AgriculturalReportGenerator
+
+    data_dir = os.path.join(args.data_root, f"p{n_parcelles}_y{args.years}_s{args.stations}")
+    if not os.path.exists(os.path.join(data_dir, 'sols.csv')):
+        print(f"Génération du jeu de données synthétique : {data_dir}")
+        generate_dataset(data_dir, n_parcelles, args.years, args.stations, seed=args.seed)
+
+    print(f"Échelle : {n_parcelles} parcelles")
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    data_manager = AgriculturalDataManager(data_dir, cache_dir=os.path.join(work_dir, 'cache'))
+
+    with measure(results, n_parcelles, 'load_data_froid'):
+        data_manager.load_data(refresh_cache=True)
+    with measure(results, n_parcelles, 'load_data_chaud'):
+        data_manager.load_data()
+    with measure(results, n_parcelles, 'prepare_features'):
+        data_manager.prepare_features()
+
+    analyzer = AgriculturalAnalyzer(data_manager)
+    parcelles = data_manager.feature_store.parcelles
+    sample = parcelles[:args.sample]
+
+    with measure(results, n_parcelles, 'analyze_yield_factors_batch'):
+        analyzer.analyze_yield_factors_batch()
+    with measure(results, n_parcelles, 'risk_table'):
+        data_manager.risk_engine.risk_table()
+    with measure(results, n_parcelles, 'calculate_risk_metrics'):
+        for parcelle_id in sample:
+            analyzer.calculate_risk_metrics(parcelle_id)
+    with measure(results, n_parcelles, 'analyze_yield_trends_batch'):
+        analyzer.analyze_yield_trends_batch()
+    with measure(results, n_parcelles, 'predict_yield_entrainement'):
+        analyzer.model_registry.train(sample)
+    with measure(results, n_parcelles, 'predict_yield_inference'):
+        for parcelle_id in sample:
+            analyzer.predict_yield(parcelle_id)
+    with measure(results, n_parcelles, 'simulate_yield_scenarios'):
+        analyzer.simulate_yield_scenarios(sample, n_scenarios=args.scenarios)
+    with measure(results, n_parcelles, 'dashboard_create_data_sources'):
+        AgriculturalDashboard(data_manager)
+    with measure(results, n_parcelles, 'map_create_base_map'):
+        AgriculturalMap(data_manager).create_base_map()
+    with measure(results, n_parcelles, 'generate_reports'):
+        AgriculturalReportGenerator(data_manager).generate_reports(
+            sample[:args.report_sample], output_dir=os.path.join(work_dir, 'rapports'))
+
+    # Ingestion incrémentale d'une semaine de relevés supplémentaire
+    monitoring = data_manager.monitoring_data
+    latest = monitoring['date'].max()
+    batch = monitoring[monitoring['date'] == latest].assign(date=latest + pd.Timedelta(days=7))
+    with measure(results, n_parcelles, 'append_monitoring'):
+        data_manager.append_monitoring(batch)
+
+    return {'rows': {row['source']: row['rows'] for row in data_manager.load_stats}}
+
+
+def git_commit():
+    """Retourne le commit courant du dépôt, si disponible."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, time_threshold, memory_threshold, min_seconds=0.05, min_memory_mb=10.0):
+    """Compare les résultats à une référence et retourne la liste des régressions.
+
+    Une étape régresse si son temps dépasse la référence de plus de
+    `time_threshold` (fraction) et de plus de `min_seconds`, ou si son pic de
+    mémoire la dépasse de plus de `memory_threshold` et de plus de
+    `min_memory_mb` ; les planchers absolus évitent de signaler le bruit de mesure.
+    """
+    reference = {(row['scale'], row['stage']): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        base = reference.get((row['scale'], row['stage']))
+        if base is None:
+            continue
+        slower = (row['seconds'] > base['seconds'] * (1 + time_threshold)
+                  and row['seconds'] - base['seconds'] > min_seconds)
+        heavier = (row['peak_rss_delta_mb'] > base['peak_rss_delta_mb'] * (1 + memory_threshold)
+                   and row['peak_rss_delta_mb'] - base['peak_rss_delta_mb'] > min_memory_mb)
+        if slower or heavier:
+            regressions.append({
+                'scale': row['scale'],
+                'stage': row['stage'],
+                'seconds': row['seconds'],
+                'baseline_seconds': base['seconds'],
+                'peak_rss_delta_mb': row['peak_rss_delta_mb'],
+                'baseline_peak_rss_delta_mb': base['peak_rss_delta_mb'],
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure les performances du pipeline sur des données synthétiques.")
+    parser.add_argument('--scales', default='50,1000,10000',
+                        help="Nombres de parcelles, séparés par des virgules (défaut : 50,1000,10000)")
+    parser.add_argument('--years', type=int, default=3, help="Années d'historique générées")
+    parser.add_argument('--stations', type=int, default=1, help="Nombre de stations météo")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sample', type=int, default=20,
+                        help="Parcelles utilisées pour les étapes unitaires (risque, modèles)")
+    parser.add_argument('--scenarios', type=int, default=10_000,
+                        help="Trajectoires météo simulées pour les parcelles de l'échantillon")
+    parser.add_argument('--report-sample', type=int, default=10, help="Nombre de rapports PDF générés")
+    parser.add_argument('--data-root', default=os.path.join(tempfile.gettempdir(), 'agri_bench_data'),
+                        help="Répertoire des jeux de données générés (réutilisés d'une exécution à l'autre)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Fichier JSON des résultats")
+    parser.add_argument('--baseline', help="Résultats de référence (JSON) à comparer")
+    parser.add_argument('--time-threshold', type=float, default=0.2,
+                        help="Hausse de temps tolérée, en fraction (défaut : 0.2)")
+    parser.add_argument('--memory-threshold', type=float, default=0.2,
+                        help="Hausse de mémoire tolérée, en fraction (défaut : 0.2)")
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help="Écart de temps minimal (s) pour signaler une régression")
+    parser.add_argument('--min-memory-mb', type=float, default=10.0,
+                        help="Écart de mémoire minimal (Mo) pour signaler une régression")
+    args = parser.parse_args(argv)
+
+    results, datasets = [], {}
+    for scale in (int(value) for value in args.scales.split(',')):
+        datasets[scale] = run_scale(scale, args, results)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'years': args.years,
+            'stations': args.stations,
+            'datasets': datasets,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Résultats enregistrés dans {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_threshold, args.memory_threshold,
+                              args.min_seconds, args.min_memory_mb)
+        for row in regressions:
+            print(f"Régression {row['stage']} ({row['scale']} parcelles) : "
+                  f"{row['baseline_seconds']:.3f} s -> {row['seconds']:.3f} s, "
+                  f"{row['baseline_peak_rss_delta_mb']:.1f} Mo -> {row['peak_rss_delta_mb']:.1f} Mo")
+        if regressions:
+            return 1
+        print("Aucune régression détectée.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+CULTURES = np.array(['Ble', 'Mais', 'Tournesol', 'Orge'])
+TYPES_SOL = np.array(['argileux', 'sablo-limoneux', 'argilo-limoneux', 'limoneux'])
+
+# Zone géographique des parcelles (autour des données fournies)
+CENTER_LAT, CENTER_LON, SPREAD_DEG = 33.88, -5.55, 0.5
+
+
+def generate_soil(n_parcelles, rng):
+    """Génère sols.csv : une ligne par parcelle avec coordonnées et propriétés du sol."""
+    return pd.DataFrame({
+        'parcelle_id': [f"P{i:05d}" for i in range(1, n_parcelles + 1)],
+        'latitude': np.round(CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG, n_parcelles), 6),
+        'longitude': np.round(CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG, n_parcelles), 6),
+        'type_sol': rng.choice(TYPES_SOL, n_parcelles),
+        'surface_ha': np.round(rng.uniform(2, 25, n_parcelles), 2),
+        'capacite_retention_eau': np.round(rng.uniform(0.3, 0.95, n_parcelles), 2),
+        'ph': np.round(rng.uniform(6, 8.2, n_parcelles), 1),
+        'matiere_organique': np.round(rng.uniform(1.5, 4.5, n_parcelles), 2),
+        'azote': np.round(rng.uniform(0.1, 0.3, n_parcelles), 3),
+        'phosphore': np.round(rng.uniform(20, 60, n_parcelles), 1),
+        'potassium': np.round(rng.uniform(150, 320, n_parcelles), 1),
+    })
+
+
+def generate_monitoring(soil, start, n_years, rng, frequency='7D'):
+    """Génère monitoring_cultures.csv : relevés NDVI/LAI/stress réguliers pour chaque parcelle."""
+    dates = pd.date_range(start, periods=int(n_years * 365 / int(frequency[:-1])), freq=frequency)
+    n_parcelles, n_dates = len(soil), len(dates)
+    n = n_parcelles * n_dates
+
+    # Saisonnalité commune + bruit par relevé
+    season = np.sin(2 * np.pi * (dates.dayofyear.to_numpy() - 80) / 365.25)
+    ndvi = np.clip(0.55 + 0.25 * season[None, :] + rng.normal(0, 0.07, (n_parcelles, n_dates)), 0, 1)
+    stress = np.clip(0.2 - 0.15 * season[None, :] + rng.normal(0, 0.08, (n_parcelles, n_dates)), 0, 1)
+
+    return pd.DataFrame({
+        'parcelle_id': np.repeat(soil['parcelle_id'].to_numpy(), n_dates),
+        'date': np.tile(dates.to_numpy(), n_parcelles),
+        'latitude': np.repeat(soil['latitude'].to_numpy(), n_dates),
+        'longitude': np.repeat(soil['longitude'].to_numpy(), n_dates),
+        'culture': np.repeat(rng.choice(CULTURES, n_parcelles), n_dates),
+        'ndvi': np.round(ndvi.ravel(), 3),
+        'lai': np.round(ndvi.ravel() * 6 + rng.normal(0, 0.3, n), 2),
+        'stress_hydrique': np.round(stress.ravel(), 3),
+        'biomasse_estimee': np.round(ndvi.ravel() * 10 + rng.normal(0, 0.5, n), 2),
+        'rendement': np.round(8 + 8 * ndvi.ravel() - 5 * stress.ravel() + rng.normal(0, 0.8, n), 2),
+    })
+
+
+def generate_stations(n_stations, rng):
+    """Génère stations.csv : coordonnées des stations météo."""
+    return pd.DataFrame({
+        'station_id': [f"S{i:04d}" for i in range(1, n_stations + 1)],
+        'latitude': np.round(CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG, n_stations), 6),
+        'longitude': np.round(CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG, n_stations), 6),
+    })
+
+
+def generate_weather(start, n_years, rng, station_ids=None):
+    """Génère meteo_detaillee.csv : relevés horaires (une série par station si `station_ids`)."""
+    dates = pd.date_range(start, periods=int(n_years * 365 * 24), freq='h')
+    hours = dates.hour.to_numpy()
+    day_of_year = dates.dayofyear.to_numpy()
+    frames = []
+    for station_id in (station_ids if station_ids is not None else [None]):
+        n = len(dates)
+        temperature = (15 + 9 * np.sin(2 * np.pi * (day_of_year - 110) / 365.25)
+                       + 5 * np.sin(2 * np.pi * (hours - 9) / 24) + rng.normal(0, 1.5, n))
+        rain = np.where(rng.random(n) < 0.04, rng.exponential(1.5, n), 0.0)
+        weather = pd.DataFrame({
+            'date': dates,
+            'temperature': np.round(temperature, 2),
+            'humidite': np.round(np.clip(70 - 1.5 * (temperature - 15) + rng.normal(0, 8, n), 5, 100), 2),
+            'precipitation': np.round(rain, 2),
+            'rayonnement_solaire': np.round(np.clip(800 * np.sin(np.pi * (hours - 6) / 12), 0, None), 1),
+            'vitesse_vent': np.round(np.abs(rng.normal(4, 2, n)), 1),
+            'direction_vent': np.round(rng.uniform(0, 360, n), 1),
+        })
+        if station_id is not None:
+            weather['station_id'] = station_id
+        frames.append(weather)
+    return pd.concat(frames, ignore_index=True)
+
+
+def generate_yield_history(soil, start, n_years, rng):
+    """Génère historique_rendements.csv : rendement estimé mensuel de chaque parcelle."""
+    dates = pd.date_range(start, periods=int(n_years * 12), freq='ME')
+    n_parcelles, n_dates = len(soil), len(dates)
+    progression = (np.arange(n_dates) % 12 + 1) / 12
+    estimate = progression[None, :] * rng.uniform(4, 9, (n_parcelles, 1)) + rng.normal(0, 0.2, (n_parcelles, n_dates))
+    final = np.where(progression[None, :] == 1, estimate, np.nan)
+
+    return pd.DataFrame({
+        'parcelle_id': np.repeat(soil['parcelle_id'].to_numpy(), n_dates),
+        'date': np.tile(dates.to_numpy(), n_parcelles),
+        'culture': np.repeat(rng.choice(CULTURES, n_parcelles), n_dates),
+        'rendement_estime': np.round(np.clip(estimate, 0, None).ravel(), 2),
+        'rendement_final': np.round(final.ravel(), 2),
+        'progression': np.round(np.tile(progression * 100, n_parcelles), 1),
+    })
+
+
+def generate_dataset(output_dir, n_parcelles=50, n_years=3, n_stations=1, start='2020-01-01', seed=42):
+    """Écrit un jeu de données synthétique compatible avec AgriculturalDataManager.
+
+    Produit monitoring_cultures.csv, meteo_detaillee.csv, sols.csv et
+    historique_rendements.csv (et stations.csv si `n_stations` > 1, la météo
+    portant alors une colonne station_id). Retourne le nombre de lignes par fichier.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    soil = generate_soil(n_parcelles, rng)
+    tables = {
+        'sols.csv': soil,
+        'monitoring_cultures.csv': generate_monitoring(soil, start, n_years, rng),
+        'historique_rendements.csv': generate_yield_history(soil, start, n_years, rng),
+    }
+    if n_stations > 1:
+        stations = generate_stations(n_stations, rng)
+        tables['stations.csv'] = stations
+        tables['meteo_detaillee.csv'] = generate_weather(start, n_years, rng, stations['station_id'])
+    else:
+        tables['meteo_detaillee.csv'] = generate_weather(start, n_years, rng)
+
+    for file_name, table in tables.items():
+        table.to_csv(os.path.join(output_dir, file_name), index=False)
+    return {file_name: len(table) for file_name, table in tables.items()}
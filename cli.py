@@ -0,0 +1,249 @@
+import argparse
+import os
+import shutil
+import sys
+
+from instrumentation import configure_logging
+
+# Analyses disponibles pour la sous-commande analyze
+ANALYSES = ('correlations', 'risk', 'trends')
+
+# Scénarios de scenario_engine.SCENARIO_PRESETS (repris ici pour ne pas importer numpy avec `--help`)
+SCENARIOS = ('reference', 'printemps_sec', 'canicule', 'automne_humide')
+
+# Les modules lourds (pandas, sklearn, folium, fpdf, FastAPI...) sont importés par
+# chaque sous-commande à son exécution : `--help` et `cache` n'en chargent aucun.
+
+
+def _data_manager(args):
+    """Charge les données (depuis le cache Parquet lorsqu'il est à jour)."""
+    from data_manager import AgriculturalDataManager
+
+    data_manager = AgriculturalDataManager(args.data_dir, cache_dir=args.cache_dir)
+    data_manager.load_data()
+    return data_manager
+
+
+def _parcelles(data_manager, parcelle_ids):
+    """Parcelles demandées (toutes par défaut) ; quitte avec un message si certaines sont inconnues."""
+    known = data_manager.feature_store.parcelles
+    if not parcelle_ids:
+        return known
+    unknown = sorted(set(parcelle_ids).difference(known))
+    if unknown:
+        sys.exit(f"Parcelles inconnues : {', '.join(unknown)} (disponibles : {', '.join(sorted(known)[:10])}"
+                 f"{', ...' if len(known) > 10 else ''})")
+    return parcelle_ids
+
+
+def _write(table, output, index=False):
+    """Écrit un tableau en CSV dans `output`, ou l'affiche sur la sortie standard."""
+    if output:
+        table.to_csv(output, index=index)
+        print(f"Résultats enregistrés dans {output}")
+    else:
+        print(table.to_string(index=index))
+
+
+def cmd_cache(args):
+    from data_cache import AgriculturalDataCache
+
+    cache = AgriculturalDataCache(args.cache_dir or os.path.join(args.data_dir, '.cache'))
+    if args.clear or args.all:
+        removed = cache.clear(everything=args.all)
+        print(f"{removed} fichier(s) supprimé(s) de {cache.cache_dir}")
+        return 0
+
+    entries = cache.entries()
+    if not entries:
+        print(f"Cache vide : {cache.cache_dir}")
+        return 0
+    states = {True: 'à jour', False: 'périmé', None: 'source absente'}
+    for entry in entries:
+        print(f"{entry['name']:<24} {entry['size_bytes'] / 1e6:9.2f} Mo  {states[entry['valid']]:<14} "
+              f"{entry['source'] or ''}")
+    return 0
+
+
+def cmd_load(args):
+    from data_manager import AgriculturalDataManager
+
+    data_manager = AgriculturalDataManager(args.data_dir, cache_dir=args.cache_dir, weather_grain=args.grain)
+    data_manager.load_data(refresh_cache=args.refresh)
+    report = data_manager.get_load_report()
+    print(report.to_string(index=False))
+    print(f"Total : {report.attrs['total_seconds']:.3f} s - mémoire résidente : {report.attrs['rss_mb']:.1f} Mo "
+          f"- version des données : {data_manager.data_version}")
+    return 0
+
+
+def cmd_analyze(args):
+    data_manager = _data_manager(args)
+    if args.analysis == 'risk':
+        table = data_manager.risk_engine.risk_table()
+        if args.parcelles:
+            table = table[table['parcelle_id'].isin(args.parcelles)]
+        _write(table.head(args.top) if args.top else table, args.output)
+        return 0
+
+    from analyzer import AgriculturalAnalyzer
+
+    analyzer = AgriculturalAnalyzer(data_manager)
+    if args.analysis == 'correlations':
+        _write(analyzer.analyze_yield_factors_batch(args.parcelles, method=args.method), args.output, index=True)
+    else:
+        _write(analyzer.analyze_yield_trends_batch(args.parcelles), args.output)
+    return 0
+
+
+def cmd_predict(args):
+    import pandas as pd
+
+    from analyzer import AgriculturalAnalyzer
+
+    data_manager = _data_manager(args)
+    analyzer = AgriculturalAnalyzer(data_manager)
+    parcelle_ids = _parcelles(data_manager, args.parcelles)
+    registry = analyzer.model_registry
+    registry.train(parcelle_ids)
+
+    frames = []
+    for parcelle_id in parcelle_ids:
+        frames.append(pd.DataFrame({
+            'parcelle_id': parcelle_id,
+            'date': data_manager.get_features(parcelle_id)['date'].to_numpy(),
+            # Prédictions normalisées ramenées en tonnes/ha
+            'rendement_predit': registry.to_yield(analyzer.predict_yield(parcelle_id)),
+        }))
+    _write(pd.concat(frames, ignore_index=True), args.output)
+    return 0
+
+
+def cmd_simulate(args):
+    import pandas as pd
+
+    from analyzer import AgriculturalAnalyzer
+
+    data_manager = _data_manager(args)
+    parcelle_ids = _parcelles(data_manager, args.parcelles)
+    analyzer = AgriculturalAnalyzer(data_manager)
+    analyzer.scenario_engine.n_jobs = args.workers or -1
+    tables = []
+    for scenario in args.scenario:
+        table = analyzer.simulate_yield_scenarios(
+            parcelle_ids, n_scenarios=args.scenarios, scenario=scenario, target=args.target, start=args.start,
+            days=args.days, precipitation_percentile=args.precipitation_percentile, random_state=args.seed)
+        tables.append(table.assign(scenario=scenario))
+    _write(pd.concat(tables, ignore_index=True), args.output)
+    return 0
+
+
+def cmd_report(args):
+    from AgriculturalReportGenerator import AgriculturalReportGenerator
+
+    generator = AgriculturalReportGenerator(_data_manager(args))
+    timings = generator.generate_reports(args.parcelles, output_dir=args.output_dir, max_workers=args.workers,
+                                         include_map=not args.no_map)
+    print(timings.to_string(index=False))
+    return 0 if (timings['statut'] == 'ok').all() else 1
+
+
+def cmd_map(args):
+    data_manager = _data_manager(args)
+    if args.output.lower().endswith('.png'):
+        from static_map import StaticMapRenderer
+
+        shutil.copyfile(StaticMapRenderer(data_manager).render(color_by=args.color_by), args.output)
+    else:
+        from map_visualization import AgriculturalMap
+
+        AgriculturalMap(data_manager).create_base_map(color_by=args.color_by).save(args.output)
+    print(f"Carte enregistrée dans {args.output}")
+    return 0
+
+
+def cmd_serve(args):
+    from analytics_service import serve
+
+    serve(args.data_dir, args.host, args.port, args.workers, args.cache_size, args.warm_models, args.cache_dir)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Pipeline d'analyse des parcelles agricoles.")
+    parser.add_argument('--data-dir', default='data', help="Répertoire des fichiers CSV (défaut : data)")
+    parser.add_argument('--cache-dir', help="Répertoire du cache (défaut : <data-dir>/.cache)")
+    parser.add_argument('--log-json', action='store_true', help="Logs structurés (une ligne JSON par message)")
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='commande')
+
+    cache = subparsers.add_parser('cache', help="État du cache Parquet (sans charger les données)")
+    cache.add_argument('--clear', action='store_true', help="Supprime les sources en cache")
+    cache.add_argument('--all', action='store_true', help="Supprime tout le cache (modèles et cartes compris)")
+    cache.set_defaults(handler=cmd_cache)
+
+    load = subparsers.add_parser('load', help="Charge les sources et met le cache à jour")
+    load.add_argument('--refresh', action='store_true', help="Relit les CSV et reconstruit le cache")
+    load.add_argument('--grain', choices=('daily', 'hourly'), default='daily', help="Grain de la météo chargée")
+    load.set_defaults(handler=cmd_load)
+
+    analyze = subparsers.add_parser('analyze', help="Corrélations, risque ou tendances des parcelles")
+    analyze.add_argument('analysis', choices=ANALYSES)
+    analyze.add_argument('--parcelles', nargs='+', help="Parcelles analysées (défaut : toutes)")
+    analyze.add_argument('--method', choices=('pearson', 'spearman'), default='pearson',
+                         help="Méthode de corrélation")
+    analyze.add_argument('--top', type=int, help="Nombre de parcelles les plus à risque affichées")
+    analyze.add_argument('--output', help="Fichier CSV de sortie (défaut : affichage)")
+    analyze.set_defaults(handler=cmd_analyze)
+
+    predict = subparsers.add_parser('predict', help="Prédictions de rendement des parcelles")
+    predict.add_argument('--parcelles', nargs='+', help="Parcelles prédites (défaut : toutes)")
+    predict.add_argument('--output', help="Fichier CSV de sortie (défaut : affichage)")
+    predict.set_defaults(handler=cmd_predict)
+
+    simulate = subparsers.add_parser('simulate', help="Rendements simulés sous des scénarios météo (Monte-Carlo)")
+    simulate.add_argument('--parcelles', nargs='+', help="Parcelles simulées (défaut : toutes)")
+    simulate.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=['reference'],
+                          help="Scénarios simulés, avec les mêmes tirages (défaut : reference)")
+    simulate.add_argument('--scenarios', type=int, default=10_000, help="Nombre de trajectoires météo")
+    simulate.add_argument('--start', help="Premier jour de l'horizon (défaut : lendemain de la dernière météo)")
+    simulate.add_argument('--days', type=int, default=182, help="Durée de l'horizon en jours")
+    simulate.add_argument('--precipitation-percentile', type=float,
+                          help="Centile (0-100) des cumuls de précipitations visé par le scénario médian")
+    simulate.add_argument('--target', type=float,
+                          help="Rendement objectif en t/ha (défaut : rendement moyen observé de chaque parcelle)")
+    simulate.add_argument('--seed', type=int, default=42)
+    simulate.add_argument('--workers', type=int, help="Threads de prédiction (défaut : nombre de cœurs)")
+    simulate.add_argument('--output', help="Fichier CSV de sortie (défaut : affichage)")
+    simulate.set_defaults(handler=cmd_simulate)
+
+    report = subparsers.add_parser('report', help="Rapports PDF des parcelles")
+    report.add_argument('--parcelles', nargs='+', help="Parcelles (défaut : toutes)")
+    report.add_argument('--output-dir', default='rapports', help="Répertoire des rapports")
+    report.add_argument('--workers', type=int, help="Processus de rendu (défaut : nombre de cœurs)")
+    report.add_argument('--no-map', action='store_true', help="Rapports sans carte")
+    report.set_defaults(handler=cmd_report)
+
+    map_parser = subparsers.add_parser('map', help="Carte des parcelles (HTML folium, ou PNG statique)")
+    map_parser.add_argument('--color-by', choices=('ndvi', 'rendement', 'risque'), help="Indicateur de couleur")
+    map_parser.add_argument('--output', default='carte_parcelles.html',
+                            help="Fichier de sortie ; l'extension .png produit une image statique")
+    map_parser.set_defaults(handler=cmd_map)
+
+    serve = subparsers.add_parser('serve', help="Service HTTP d'analyse (FastAPI)")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--workers', type=int, help="Threads de calcul (défaut : nombre de cœurs)")
+    serve.add_argument('--cache-size', type=int, default=10_000, help="Réponses gardées en cache")
+    serve.add_argument('--warm-models', action='store_true', help="Entraîne tous les modèles au démarrage")
+    serve.set_defaults(handler=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(structured=args.log_json)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
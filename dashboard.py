@@ -1,29 +1,148 @@
-from bokeh.plotting import figure
-from bokeh.models import ColumnDataSource, HoverTool
+import copy
+
+import numpy as np
+from instrumentation import instrumented, stage
+
+
+def lttb_downsample(x, y, n_out):
+    """Réduit une série à `n_out` points avec l'algorithme LTTB.
+
+    Largest-Triangle-Three-Buckets conserve la forme visuelle de la courbe en
+    gardant, dans chaque intervalle, le point formant le plus grand triangle
+    avec le point retenu précédemment et la moyenne de l'intervalle suivant.
+    Retourne les positions des points conservés.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = np.nanmean(y[next_start:next_stop]) if next_stop > next_start else y[-1]
+        # Aire (au facteur 1/2 près) du triangle point précédent / candidat / moyenne suivante
+        areas = np.abs((x[previous] - avg_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (avg_y - y[previous]))
+        previous = start + int(np.nanargmax(areas)) if np.isfinite(areas).any() else start
+        selected[i + 1] = previous
+    return selected
+
+
+def min_max_downsample(x, y, n_buckets):
+    """Réduit une série en gardant le minimum et le maximum de chaque intervalle.
+
+    Retourne les positions des points conservés (au plus 2 * `n_buckets`).
+    """
+    n = len(x)
+    if 2 * n_buckets >= n:
+        return np.arange(n)
+
+    starts = np.linspace(0, n, n_buckets, endpoint=False).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(np.append(starts, n)))
+    y_filled = np.where(np.isnan(y), np.inf, y)
+    order_min = np.lexsort((y_filled, bucket))
+    order_max = np.lexsort((-np.where(np.isnan(y), -np.inf, y), bucket))
+    return np.unique(np.concatenate([order_min[starts], order_max[starts]]))
+
+
+DOWNSAMPLERS = {'lttb': lttb_downsample, 'minmax': min_max_downsample}
+
 
 class AgriculturalDashboard:
-    def __init__(self, data_manager):
-        """Initialise le tableau de bord avec le gestionnaire de données."""
+    def __init__(self, data_manager, parcelle_id='P001', plot_width=800, downsampling='lttb'):
+        """Initialise le tableau de bord avec le gestionnaire de données.
+
+        Chaque graphique ne reçoit que ses colonnes, réduites côté serveur à
+        environ un point par pixel de largeur (`plot_width`) avec la méthode
+        `downsampling` ('lttb', 'minmax' ou None).
+        """
+        from bokeh.models import ColumnDataSource
+
+        if downsampling is not None and downsampling not in DOWNSAMPLERS:
+            raise ValueError(f"Méthode de réduction inconnue : {downsampling}")
         self.data_manager = data_manager
-        self.source = ColumnDataSource(data=dict())
-        self.hist_source = ColumnDataSource(data=dict())
-        self.selected_parcelle = None
+        self.plot_width = plot_width
+        self.downsampling = downsampling
+        self.yield_source = ColumnDataSource(data=dict(date=[], rendement=[]))
+        self.ndvi_source = ColumnDataSource(data=dict(date=[], ndvi=[]))
+        self.risk_source = ColumnDataSource(data=dict(seuil=[], probabilite=[]))
+        self.selected_parcelle = parcelle_id
+        self._columns = {}   # parcelle_id -> colonnes brutes triées par date
+        self._reduced = {}   # (parcelle_id, colonne) -> données réduites pour un graphique
         self.create_data_sources()
 
+    @instrumented('dashboard.create_data_sources')
     def create_data_sources(self):
-        """Prépare les sources de données pour Bokeh."""
-        data = self.data_manager.prepare_features()
-        self.source.data = data.to_dict(orient='list')
+        """Prépare, une fois pour toutes les parcelles, les colonnes utilisées par les graphiques."""
+        monitoring = self.data_manager.monitoring_data[['parcelle_id', 'date', 'rendement', 'ndvi']]
+        monitoring = monitoring.sort_values(['parcelle_id', 'date'])
+
+        dates = monitoring['date'].to_numpy()
+        values = {col: monitoring[col].to_numpy(dtype=np.float64) for col in ('rendement', 'ndvi')}
+        self._columns = {}
+        self._reduced = {}
+        for parcelle_id, positions in monitoring.groupby('parcelle_id', observed=True, sort=False).indices.items():
+            self._columns[parcelle_id] = {'date': dates[positions],
+                                          **{col: array[positions] for col, array in values.items()}}
+
+        self.select_parcelle(self.selected_parcelle)
+
+    def _plot_data(self, parcelle_id, column):
+        """Colonnes réduites (date, `column`) d'une parcelle, mémorisées après le premier calcul."""
+        key = (parcelle_id, column)
+        if key not in self._reduced:
+            columns = self._columns.get(parcelle_id)
+            if columns is None:
+                return {'date': np.array([], dtype='datetime64[ns]'), column: np.array([])}
+            dates, values = columns['date'], columns[column]
+            if self.downsampling is not None:
+                downsample = DOWNSAMPLERS[self.downsampling]
+                n_out = self.plot_width if self.downsampling == 'lttb' else self.plot_width // 2
+                with stage('dashboard.downsample', rows=len(values)):
+                    keep = downsample(dates.astype('datetime64[ms]').astype(np.int64), values, n_out)
+                dates, values = dates[keep], values[keep]
+            self._reduced[key] = {'date': dates, column: values}
+        return self._reduced[key]
+
+    def _risk_data(self, parcelle_id):
+        """Probabilités de dépassement des seuils de stress hydrique d'une parcelle (table du moteur de risque)."""
+        engine = self.data_manager.risk_engine
+        risk = engine.parcelle_risk(parcelle_id)
+        labels = [f"{threshold:g}" for threshold in engine.thresholds]
+        return {'seuil': labels, 'probabilite': [risk.get(f"p_stress_{label}", np.nan) for label in labels]}
+
+    def select_parcelle(self, parcelle_id):
+        """Affiche une autre parcelle en remplaçant les colonnes des sources, sans recalcul."""
+        self.selected_parcelle = parcelle_id
+        self.yield_source.data = self._plot_data(parcelle_id, 'rendement')
+        self.ndvi_source.data = self._plot_data(parcelle_id, 'ndvi')
+        self.risk_source.data = self._risk_data(parcelle_id)
+
+    def session_copy(self):
+        """Copie pour une session : colonnes préparées partagées, sources Bokeh propres à la copie."""
+        from bokeh.models import ColumnDataSource
 
-        # Exemple : Historique des rendements pour une parcelle
-        parcelle_id = 'P001'  # Parcelle par défaut
-        parcelle_data = data[data['parcelle_id'] == parcelle_id]
-        self.hist_source.data = parcelle_data.to_dict(orient='list')
+        dashboard = copy.copy(self)
+        dashboard.yield_source = ColumnDataSource(data=dict(self.yield_source.data))
+        dashboard.ndvi_source = ColumnDataSource(data=dict(self.ndvi_source.data))
+        dashboard.risk_source = ColumnDataSource(data=dict(self.risk_source.data))
+        return dashboard
 
     def create_yield_history_plot(self):
         """Crée un graphique montrant l'historique des rendements."""
-        p = figure(title="Historique des Rendements", x_axis_type='datetime', height=400)
-        p.line('date', 'rendement', source=self.hist_source, line_width=2, legend_label="Rendement")
+        from bokeh.models import HoverTool
+        from bokeh.plotting import figure
+
+        p = figure(title="Historique des Rendements", x_axis_type='datetime', height=400, width=self.plot_width)
+        p.line('date', 'rendement', source=self.yield_source, line_width=2, legend_label="Rendement")
         p.xaxis.axis_label = "Date"
         p.yaxis.axis_label = "Rendement (tonnes/ha)"
         p.add_tools(HoverTool(tooltips=[("Date", "@date{%F}"), ("Rendement", "@rendement{0.2f}")],
@@ -32,10 +151,27 @@ class AgriculturalDashboard:
 
     def create_ndvi_temporal_plot(self):
         """Crée un graphique montrant l'évolution du NDVI."""
-        p = figure(title="Évolution du NDVI", x_axis_type='datetime', height=400)
-        p.line('date', 'ndvi', source=self.hist_source, line_width=2, color="green", legend_label="NDVI")
+        from bokeh.models import HoverTool
+        from bokeh.plotting import figure
+
+        p = figure(title="Évolution du NDVI", x_axis_type='datetime', height=400, width=self.plot_width)
+        p.line('date', 'ndvi', source=self.ndvi_source, line_width=2, color="green", legend_label="NDVI")
         p.xaxis.axis_label = "Date"
         p.yaxis.axis_label = "NDVI"
         p.add_tools(HoverTool(tooltips=[("Date", "@date{%F}"), ("NDVI", "@ndvi{0.2f}")],
                               formatters={'@date': 'datetime'}))
-        return p
\ No newline at end of file
+        return p
+
+    def create_risk_plot(self):
+        """Crée un graphique des probabilités de dépassement des seuils de stress hydrique."""
+        from bokeh.models import HoverTool
+        from bokeh.plotting import figure
+
+        seuils = [f"{threshold:g}" for threshold in self.data_manager.risk_engine.thresholds]
+        p = figure(title="Risque de Stress Hydrique", x_range=seuils, y_range=(0, 1), height=400,
+                   width=self.plot_width)
+        p.vbar(x='seuil', top='probabilite', source=self.risk_source, width=0.8, color="firebrick")
+        p.xaxis.axis_label = "Seuil de stress hydrique"
+        p.yaxis.axis_label = "Probabilité de dépassement"
+        p.add_tools(HoverTool(tooltips=[("Seuil", "@seuil"), ("Probabilité", "@probabilite{0.0%}")]))
+        return p
@@ -0,0 +1,225 @@
+import glob
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+
+# Version du format de cache : à incrémenter si la conversion des types change
+CACHE_SCHEMA_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+class AgriculturalDataCache:
+    def __init__(self, cache_dir):
+        """Initialise le cache colonnaire (Parquet) des fichiers sources."""
+        self.cache_dir = cache_dir
+        self.enabled = self._parquet_available()
+        if not self.enabled:
+            logger.warning("pyarrow indisponible : le cache Parquet est désactivé, lecture directe des CSV.")
+
+    @staticmethod
+    def _parquet_available():
+        """Vérifie que le moteur Parquet (pyarrow) est installé, sans l'importer."""
+        return importlib.util.find_spec('pyarrow') is not None
+
+    @staticmethod
+    def file_hash(path, chunk_size=1 << 20):
+        """Calcule l'empreinte SHA-256 d'un fichier source."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _paths(self, name):
+        """Retourne les chemins du fichier Parquet et de ses métadonnées."""
+        return (os.path.join(self.cache_dir, f"{name}.parquet"),
+                os.path.join(self.cache_dir, f"{name}.meta.json"))
+
+    def fingerprint(self, source_path):
+        """Retourne l'empreinte (mtime, taille, hash) d'un fichier source."""
+        stat = os.stat(source_path)
+        return {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': self.file_hash(source_path),
+        }
+
+    def _read_meta(self, meta_path):
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def is_valid(self, name, source_path):
+        """Indique si le cache d'une source est à jour.
+
+        Le mtime et la taille sont comparés d'abord ; le hash n'est recalculé que
+        s'ils ont changé, afin qu'un simple `touch` n'invalide pas le cache.
+        """
+        parquet_path, meta_path = self._paths(name)
+        meta = self._read_meta(meta_path)
+        if meta is None or not os.path.exists(parquet_path):
+            return False
+        if meta.get('schema_version') != CACHE_SCHEMA_VERSION:
+            return False
+
+        stat = os.stat(source_path)
+        if meta.get('mtime_ns') == stat.st_mtime_ns and meta.get('size') == stat.st_size:
+            return True
+        if meta.get('size') != stat.st_size or meta.get('sha256') != self.file_hash(source_path):
+            return False
+
+        # Contenu identique malgré un nouveau mtime : on rafraîchit les métadonnées
+        meta['mtime_ns'] = stat.st_mtime_ns
+        self._write_meta(meta_path, meta)
+        return True
+
+    def source_hash(self, name, source_path):
+        """Retourne le hash d'une source, depuis les métadonnées si possible."""
+        if self.enabled and self.is_valid(name, source_path):
+            return self._read_meta(self._paths(name)[1])['sha256']
+        return self.file_hash(source_path)
+
+    def read(self, name):
+        """Lit une source depuis le cache Parquet."""
+        import pandas as pd
+
+        parquet_path, _ = self._paths(name)
+        return pd.read_parquet(parquet_path)
+
+    def write(self, name, source_path, data):
+        """Écrit une source dans le cache Parquet avec ses métadonnées."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        parquet_path, meta_path = self._paths(name)
+        tmp_path = f"{parquet_path}.tmp"
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+
+        meta = self.fingerprint(source_path)
+        meta['schema_version'] = CACHE_SCHEMA_VERSION
+        meta['source'] = os.path.abspath(source_path)
+        self._write_meta(meta_path, meta)
+
+    def load(self, name, source_path, reader, refresh=False):
+        """Charge une source depuis le cache, ou via `reader` puis met le cache à jour.
+
+        Retourne le DataFrame et son origine ('cache' ou 'csv').
+        """
+        if self.enabled and not refresh and self.is_valid(name, source_path):
+            return self.read(name), 'cache'
+
+        data = reader(source_path)
+        if self.enabled:
+            self.write(name, source_path, data)
+        return data, 'csv'
+
+    def entries(self):
+        """Décrit les sources en cache, sans lire les données (ni importer pandas).
+
+        Retourne une liste de dictionnaires : name, source, size_bytes et
+        valid (None si le fichier source n'est plus trouvé).
+        """
+        entries = []
+        for meta_path in sorted(glob.glob(os.path.join(self.cache_dir, '*.meta.json'))):
+            name = os.path.basename(meta_path)[:-len('.meta.json')]
+            parquet_path, _ = self._paths(name)
+            source = (self._read_meta(meta_path) or {}).get('source')
+            entries.append({
+                'name': name,
+                'source': source,
+                'size_bytes': os.path.getsize(parquet_path) if os.path.exists(parquet_path) else 0,
+                'valid': self.is_valid(name, source) if source and os.path.exists(source) else None,
+            })
+        return entries
+
+    def clear(self, everything=False):
+        """Supprime les fichiers Parquet et leurs métadonnées ; avec `everything`, tout le
+        répertoire du cache (modèles et cartes compris). Retourne le nombre de fichiers supprimés."""
+        if everything:
+            count = sum(len(files) for _, _, files in os.walk(self.cache_dir))
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            return count
+        paths = (glob.glob(os.path.join(self.cache_dir, '*.parquet'))
+                 + glob.glob(os.path.join(self.cache_dir, '*.meta.json')))
+        for path in paths:
+            os.remove(path)
+        return len(paths)
+
+
+def optimize_dtypes(data, categorical_cols=(), keep_float64=()):
+    """Convertit un DataFrame vers des types compacts.
+
+    Les colonnes de `categorical_cols` deviennent catégorielles, les mesures
+    numériques passent en float32, sauf celles listées dans `keep_float64`
+    (coordonnées GPS, dont la précision doit être conservée).
+    """
+    import numpy as np
+
+    data = data.copy()
+    for col in categorical_cols:
+        if col in data.columns:
+            data[col] = data[col].astype('category')
+
+    for col in data.select_dtypes(include=[np.number]).columns:
+        if col not in keep_float64:
+            data[col] = data[col].astype(np.float32)
+    return data
+
+
+def concat_aligned(frames):
+    """Concatène des DataFrames de même schéma en conservant leurs colonnes catégorielles.
+
+    Lorsque les morceaux n'ont pas les mêmes catégories, celles-ci sont
+    fusionnées au lieu de faire retomber la colonne en type objet.
+    """
+    import pandas as pd
+
+    frames = [frame for frame in frames if frame is not None]
+    casts = {}
+    for col in frames[0].columns:
+        if not isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            continue
+        dtypes = list(dict.fromkeys(frame[col].dtype for frame in frames))
+        if len(dtypes) > 1:
+            categories = frames[0][col].cat.categories
+            for frame in frames[1:]:
+                values = frame[col]
+                extra = (values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype)
+                         else pd.Index(values.dropna().unique()))
+                categories = categories.append(extra.difference(categories))
+            casts[col] = pd.CategoricalDtype(categories)
+
+    if casts:
+        frames = [frame.astype({col: dtype for col, dtype in casts.items() if frame[col].dtype != dtype})
+                  for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def current_rss_mb():
+    """Retourne la mémoire résidente du processus en Mo."""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, IndexError, AttributeError):
+        # Plateformes sans /proc : on se rabat sur le pic de mémoire résidente
+        import sys
+        try:
+            import resource
+        except ImportError:
+            return float('nan')
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
@@ -1,60 +1,482 @@
+import hashlib
+import logging
+import os
+import time
+
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
+
+from data_cache import AgriculturalDataCache, concat_aligned, optimize_dtypes, current_rss_mb
+from instrumentation import configure_logging, instrumented, stage
+from feature_store import AgriculturalFeatureStore
+from risk_engine import AgriculturalRiskEngine
+from online_scaler import OnlineStandardScaler
+from weather_aggregator import METADATA_COLUMNS, WeatherAggregator
+from station_index import WeatherStationIndex, spatial_weather_join
+
+# Description des fichiers sources : nom de fichier, dates à parser et colonnes catégorielles
+DATA_SOURCES = {
+    'monitoring_data': {
+        'file': 'monitoring_cultures.csv',
+        'parse_dates': ['date'],
+        'categorical': ['parcelle_id', 'culture'],
+    },
+    'weather_data': {
+        'file': 'meteo_detaillee.csv',
+        'parse_dates': ['date'],
+        'categorical': [],
+    },
+    'soil_data': {
+        'file': 'sols.csv',
+        'parse_dates': [],
+        'categorical': ['parcelle_id', 'type_sol'],
+    },
+    'yield_history': {
+        'file': 'historique_rendements.csv',
+        'parse_dates': ['date'],
+        'categorical': ['parcelle_id', 'culture'],
+    },
+    # Facultatif : coordonnées des stations météo (la météo porte alors une colonne station_id)
+    'station_data': {
+        'file': 'stations.csv',
+        'parse_dates': [],
+        'categorical': ['station_id'],
+        'optional': True,
+    },
+}
+
+# Colonnes conservées en float64 (coordonnées GPS)
+COORDINATE_COLUMNS = ('latitude', 'longitude')
+
+logger = logging.getLogger(__name__)
+
 
 class AgriculturalDataManager:
-    def __init__(self):
-        """Initialise le gestionnaire de données."""
+    def __init__(self, data_dir='data', cache_dir=None, use_cache=True, weather_grain='daily',
+                 station_neighbors=3, idw_power=2.0, scaler_tolerance=0.02):
+        """Initialise le gestionnaire de données.
+
+        `data_dir` est le répertoire des fichiers CSV ; le cache Parquet est écrit
+        dans `cache_dir` (par défaut `<data_dir>/.cache`). Avec `weather_grain`
+        'daily' (par défaut), la météo horaire est lue en flux et seuls ses
+        agrégats journaliers et mensuels sont gardés en mémoire ; 'hourly'
+        conserve les relevés horaires bruts. Si `stations.csv` est présent, chaque
+        parcelle reçoit la météo de ses `station_neighbors` stations les plus
+        proches, pondérée par l'inverse de la distance (`idw_power`, None pour
+        des poids égaux). Les ajouts incrémentaux (append_monitoring,
+        append_weather) mettent à jour les statistiques de normalisation ; les
+        caractéristiques ne sont renormalisées que si elles dérivent de plus de
+        `scaler_tolerance` écart-type.
+        """
+        if weather_grain not in ('daily', 'hourly'):
+            raise ValueError(f"Granularité météo inconnue : {weather_grain}")
+        self.data_dir = data_dir
+        self.weather_grain = weather_grain
+        self.weather_aggregator = WeatherAggregator()
+        self.cache = AgriculturalDataCache(cache_dir or os.path.join(data_dir, '.cache'))
+        self.cache.enabled = self.cache.enabled and use_cache
         self.monitoring_data = None  # Données de suivi des cultures
-        self.weather_data = None     # Données météorologiques
+        self.weather_data = None     # Données météorologiques (journalières ou horaires)
+        self.weather_monthly = None  # Agrégats météorologiques mensuels
         self.soil_data = None        # Données des sols
         self.yield_history = None    # Historique des rendements
-        self.scaler = StandardScaler()  # Pour normaliser les données
+        self.station_data = None     # Coordonnées des stations météo (facultatif)
+        self.station_index = None    # Index spatial des stations, construit au chargement
+        self.station_neighbors = station_neighbors
+        self.idw_power = idw_power
+        self.scaler = OnlineStandardScaler(scaler_tolerance)  # Pour normaliser les données
+        self.load_stats = []         # Statistiques du dernier chargement
+        self.data_version = None     # Empreinte des fichiers sources chargés
+        self.ingested_rows = 0       # Relevés de monitoring ajoutés depuis le chargement
+        self.feature_store = AgriculturalFeatureStore(self)
+        self.risk_engine = AgriculturalRiskEngine(self)
+
+    @property
+    def monitoring_data(self):
+        """Données de suivi des cultures (les lots ajoutés y sont intégrés à la première lecture)."""
+        if self._monitoring_batches:
+            self._monitoring = concat_aligned([self._monitoring, *self._monitoring_batches])
+            self._monitoring_batches = []
+        return self._monitoring
+
+    @monitoring_data.setter
+    def monitoring_data(self, data):
+        self._monitoring = data
+        self._monitoring_batches = []
+
+    def _read_source(self, name):
+        """Retourne une fonction de lecture CSV avec conversion des types pour une source."""
+        spec = DATA_SOURCES[name]
+
+        if name == 'weather_data' and self.weather_grain == 'daily':
+            # Lecture en flux : seuls les agrégats journaliers sont matérialisés
+            def reader(path):
+                return optimize_dtypes(self.weather_aggregator.aggregate_csv(path), ['station_id'])
+
+            return reader
+
+        def reader(path):
+            data = pd.read_csv(path, parse_dates=spec['parse_dates'])
+            return optimize_dtypes(data, spec['categorical'], keep_float64=COORDINATE_COLUMNS)
+
+        return reader
 
-    def load_data(self):
-        """Charge les données depuis les fichiers CSV."""
+    def _cache_name(self, name):
+        """Nom de l'entrée de cache d'une source (les agrégats météo ont leur propre entrée)."""
+        if name == 'weather_data' and self.weather_grain == 'daily':
+            return 'weather_daily'
+        return name
+
+    def _load_source(self, name, refresh_cache=False):
+        """Charge une source (cache ou CSV) et enregistre ses statistiques de chargement."""
+        path = os.path.join(self.data_dir, DATA_SOURCES[name]['file'])
+        cache_name = self._cache_name(name)
+        start = time.perf_counter()
+        with stage(f"load_data.{cache_name}") as record:
+            data, origin = self.cache.load(cache_name, path, self._read_source(name), refresh=refresh_cache)
+            record.rows = len(data)
+        self.load_stats.append({
+            'source': cache_name,
+            'origin': origin,
+            'rows': len(data),
+            'seconds': time.perf_counter() - start,
+            'memory_mb': data.memory_usage(deep=True).sum() / 1e6,
+        })
+        setattr(self, name, data)
+        return data
+
+    def _compute_data_version(self):
+        """Calcule la version des données à partir des empreintes des fichiers sources."""
+        digest = hashlib.sha256()
+        for name, spec in DATA_SOURCES.items():
+            path = os.path.join(self.data_dir, spec['file'])
+            if spec.get('optional') and not os.path.exists(path):
+                continue
+            digest.update(self._cache_name(name).encode())
+            digest.update(self.cache.source_hash(self._cache_name(name), path).encode())
+        return digest.hexdigest()[:16]
+
+    @instrumented('load_data')
+    def load_data(self, refresh_cache=False):
+        """Charge les données depuis le cache Parquet ou, à défaut, les fichiers CSV.
+
+        `refresh_cache=True` force la relecture des CSV et la reconstruction du cache.
+        Une erreur de chargement est journalisée puis propagée. Les relevés
+        ajoutés depuis le dernier chargement sont abandonnés.
+        """
+        self.load_stats = []
+        self.ingested_rows = 0
+        self.feature_store.invalidate()
         try:
             # Chargement des données de suivi des cultures
-            self.monitoring_data = pd.read_csv('data/monitoring_cultures.csv', parse_dates=['date'])
-            print("Données de monitoring chargées avec succès.")
+            self._load_source('monitoring_data', refresh_cache)
+            logger.info("Données de monitoring chargées avec succès.")
 
             # Chargement des données météorologiques
-            self.weather_data = pd.read_csv('data/meteo_detaillee.csv', parse_dates=['date'])
-            print("Données météorologiques chargées avec succès.")
+            self._load_source('weather_data', refresh_cache)
+            if self.weather_grain == 'daily':
+                self.weather_monthly = self.weather_aggregator.monthly(self.weather_data)
+            logger.info("Données météorologiques chargées avec succès.")
 
             # Chargement des données des sols
-            self.soil_data = pd.read_csv('data/sols.csv')
-            print("Données des sols chargées avec succès.")
+            self._load_source('soil_data', refresh_cache)
+            logger.info("Données des sols chargées avec succès.")
 
             # Chargement de l'historique des rendements
-            self.yield_history = pd.read_csv('data/historique_rendements.csv', parse_dates=['date'])
-            print("Historique des rendements chargé avec succès.")
+            self._load_source('yield_history', refresh_cache)
+            logger.info("Historique des rendements chargé avec succès.")
+
+            # Chargement facultatif des stations météo et construction de l'index spatial
+            self.station_data = None
+            self.station_index = None
+            if os.path.exists(os.path.join(self.data_dir, DATA_SOURCES['station_data']['file'])):
+                self._load_source('station_data', refresh_cache)
+                self.station_index = WeatherStationIndex(self.station_data)
+                logger.info("Stations météorologiques chargées avec succès.")
 
             # Générer une colonne 'rendement' fictive si elle n'existe pas
             if 'rendement' not in self.monitoring_data.columns:
-                self.monitoring_data['rendement'] = np.random.uniform(10, 20, size=len(self.monitoring_data))
-                print("Colonne 'rendement' fictive générée avec succès.")
+                # Générateur à graine fixe : la colonne est identique d'un chargement à l'autre
+                rng = np.random.default_rng(42)
+                self.monitoring_data['rendement'] = rng.uniform(
+                    10, 20, size=len(self.monitoring_data)).astype(np.float32)
+                logger.info("Colonne 'rendement' fictive générée avec succès.")
+
+            self.data_version = self._compute_data_version()
+
+        except Exception:
+            logger.exception("Erreur lors du chargement des données depuis %s", self.data_dir)
+            raise
 
-        except Exception as e:
-            print(f"Erreur lors du chargement des données : {e}")
+    def get_load_report(self):
+        """Retourne les temps de chargement et l'empreinte mémoire du dernier load_data()."""
+        report = pd.DataFrame(self.load_stats, columns=['source', 'origin', 'rows', 'seconds', 'memory_mb'])
+        report.attrs['total_seconds'] = report['seconds'].sum()
+        report.attrs['rss_mb'] = current_rss_mb()
+        return report
 
     def prepare_features(self):
-        """Prépare les caractéristiques pour l'analyse en fusionnant les données."""
-        if self.monitoring_data is None or self.weather_data is None or self.soil_data is None:
+        """Retourne les caractéristiques fusionnées et normalisées de toutes les parcelles.
+
+        Le résultat est mémorisé par le magasin de caractéristiques jusqu'au
+        prochain changement des données.
+        """
+        return self.feature_store.get_features()
+
+    def get_features(self, parcelle_id=None):
+        """Retourne les caractéristiques d'une parcelle (ou de toutes si `parcelle_id` est None)."""
+        return self.feature_store.get_features(parcelle_id)
+
+    def _require_loaded(self):
+        if self._monitoring is None or self.weather_data is None or self.soil_data is None:
             raise ValueError("Les données n'ont pas été chargées. Utilisez load_data() d'abord.")
 
-        # Fusion des données de monitoring et météo
-        merged_data = pd.merge_asof(
-            self.monitoring_data.sort_values('date'),
-            self.weather_data.sort_values('date'),
-            on='date'
-        )
+    def _join_features(self, monitoring, weather=None):
+        """Fusionne des relevés de monitoring avec la météo et le sol (valeurs brutes, triées par date).
+
+        `weather` restreint la météo utilisée (fenêtre d'un ajout incrémental).
+        Les métadonnées des agrégats ne sont pas fusionnées, et un agrégat
+        journalier n'est associé qu'aux relevés du lendemain ou après (voir
+        _weather_lag).
+        """
+        weather = self.weather_data if weather is None else weather
+        weather = weather.drop(columns=METADATA_COLUMNS, errors='ignore')
+        lag = self._weather_lag()
+        if lag:
+            weather = weather.assign(date=weather['date'] + lag)
+        if self.station_index is not None and 'station_id' in weather.columns:
+            # Fusion spatio-temporelle : météo pondérée des stations les plus proches
+            assignments = self.station_index.assign_parcelles(self.soil_data, self.station_neighbors, self.idw_power)
+            monitoring = monitoring[monitoring['parcelle_id'].isin(self.soil_data['parcelle_id'])]
+            with stage('prepare_features.spatial_join', rows=len(monitoring)):
+                merged_data = spatial_weather_join(monitoring, weather, assignments)
+            merged_data = merged_data.sort_values('date', ignore_index=True)
+        else:
+            # Fusion des données de monitoring et météo
+            with stage('prepare_features.merge_asof', rows=len(monitoring)):
+                merged_data = pd.merge_asof(
+                    monitoring.sort_values('date'),
+                    weather.sort_values('date'),
+                    on='date'
+                )
 
         # Fusion avec les données du sol
-        merged_data = pd.merge(merged_data, self.soil_data, on='parcelle_id')
+        return pd.merge(merged_data, self.soil_data, on='parcelle_id')
+
+    @instrumented('prepare_features')
+    def build_features(self):
+        """Construit les caractéristiques pour l'analyse en fusionnant les données."""
+        self._require_loaded()
+        merged_data = self._join_features(self.monitoring_data)
 
         # Normalisation des données
         numeric_cols = merged_data.select_dtypes(include=[np.number]).columns
-        merged_data[numeric_cols] = self.scaler.fit_transform(merged_data[numeric_cols])
+        with stage('prepare_features.standard_scaler', rows=len(merged_data)):
+            merged_data[numeric_cols] = self.scaler.fit_transform(merged_data[numeric_cols])
+
+        return merged_data
+
+    def _weather_lag(self):
+        """Délai avant qu'une météo soit utilisable par un relevé de monitoring.
+
+        Un agrégat journalier, daté de minuit, résume toute sa journée : il
+        n'est connu que le lendemain. Un relevé horaire l'est dès son heure.
+        """
+        return pd.Timedelta(days=1) if self.weather_grain == 'daily' else pd.Timedelta(0)
+
+    def _weather_window(self, since):
+        """Météo utile à la fusion de relevés datés de `since` ou après.
+
+        Le dernier relevé utilisable à `since` de chaque station est conservé
+        pour la correspondance « plus récent avant » de merge_asof.
+        """
+        dates = self.weather_data['date']
+        before = dates + self._weather_lag() <= since
+        if 'station_id' in self.weather_data.columns:
+            cutoff = dates[before].groupby(self.weather_data['station_id'][before], observed=True).max().min()
+        else:
+            cutoff = dates[before].max()
+        return self.weather_data if pd.isna(cutoff) else self.weather_data[dates >= cutoff]
+
+    def _advance_version(self, rows):
+        """Dérive la version des données de la précédente et du contenu du lot ajouté."""
+        digest = hashlib.sha256(self.data_version.encode())
+        digest.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+        self.data_version = digest.hexdigest()[:16]
+
+    def _update_features(self, joined, rows, replaced=None, since=None):
+        """Normalise des lignes fusionnées et les transmet au magasin de caractéristiques.
+
+        `replaced` contient les lignes fusionnées (brutes) que `joined` remplace,
+        celles des mêmes parcelles datées de `since` ou après. Retourne les
+        parcelles dont les caractéristiques ont changé.
+        """
+        columns = list(self.scaler.feature_names_in_)
+
+        # Moments courants : les lignes remplacées sont retirées, les nouvelles ajoutées
+        with stage('append.online_scaler', rows=len(joined)):
+            if replaced is not None:
+                self.scaler.remove(replaced[columns])
+            self.scaler.partial_fit(joined[columns])
+
+            renormalize = self.scaler.needs_refresh()
+            if renormalize:
+                # Dérive trop forte : toutes les lignes passent aux nouveaux paramètres
+                old_mean, old_scale = self.scaler.refresh()
+                self.feature_store.rescale(columns, old_scale / self.scaler.scale_,
+                                           (old_mean - self.scaler.mean_) / self.scaler.scale_)
+                logger.info("Statistiques de normalisation renouvelées : toutes les parcelles sont mises à jour.")
+
+            normalized = joined.copy()
+            normalized[columns] = self.scaler.transform(joined[columns])
+
+        self._advance_version(rows)
+        changed = self.feature_store.append(normalized, self.data_version, since=since, all_changed=renormalize)
+        return set(self.feature_store.parcelles) if changed is None else changed
+
+    def _conform_monitoring(self, rows):
+        """Convertit un lot de relevés de monitoring au schéma des données chargées."""
+        spec = DATA_SOURCES['monitoring_data']
+        rows = pd.DataFrame(rows)
+        for col in spec['parse_dates']:
+            rows[col] = pd.to_datetime(rows[col])
+        if 'rendement' not in rows.columns and 'rendement' in self._monitoring.columns:
+            # Même colonne fictive qu'au chargement, avec une graine propre à chaque lot
+            rng = np.random.default_rng([42, self.ingested_rows])
+            rows['rendement'] = rng.uniform(10, 20, size=len(rows)).astype(np.float32)
+
+        missing = self._monitoring.columns.difference(rows.columns)
+        if len(missing):
+            raise KeyError(f"Colonnes manquantes dans les relevés ajoutés : {list(missing)}")
+        rows = optimize_dtypes(rows[self._monitoring.columns], keep_float64=COORDINATE_COLUMNS)
+
+        # Les catégories existantes sont reprises (et étendues si besoin) pour éviter les recodages
+        dtypes = self._monitoring.dtypes.to_dict()
+        for col in spec['categorical']:
+            categories = dtypes[col].categories
+            extra = pd.Index(rows[col].dropna().unique()).difference(categories)
+            if len(extra):
+                dtypes[col] = pd.CategoricalDtype(categories.append(extra))
+        return rows.astype(dtypes)
+
+    @instrumented('append_monitoring')
+    def append_monitoring(self, rows):
+        """Ajoute de nouveaux relevés de monitoring sans recharger ni refusionner tout l'historique.
+
+        Seuls les relevés du lot sont fusionnés avec la météo et le sol puis
+        normalisés ; les partitions des parcelles concernées sont mises à jour
+        et les abonnés du magasin de caractéristiques en sont prévenus. Les
+        relevés ajoutés restent en mémoire (les fichiers sources ne sont pas
+        modifiés). Retourne les parcelles dont les caractéristiques ont changé.
+        """
+        self._require_loaded()
+        self.feature_store.ensure_built()
+        rows = self._conform_monitoring(rows)
+        if rows.empty:
+            return set()
+
+        self._monitoring_batches.append(rows)
+        self.ingested_rows += len(rows)
+        joined = self._join_features(rows, self._weather_window(rows['date'].min()))
+        return self._update_features(joined, rows)
+
+    def _weather_series_rows(self, rows):
+        """Rattache des relevés météo par parcelle (ex. WeatherAPI) aux séries météo chargées.
+
+        Avec un réseau de stations, chaque parcelle est rattachée à sa station la
+        plus proche ; sans stations, la météo est une série unique. Dans les deux
+        cas, les relevés de plusieurs parcelles d'une même série à la même heure
+        sont moyennés en un seul relevé.
+        """
+        if 'parcelle_id' not in rows.columns:
+            return rows
+        if 'station_id' in rows.columns:
+            return rows.drop(columns=['parcelle_id'])
+
+        keys = ['date']
+        if self.station_index is not None and 'station_id' in self.weather_data.columns:
+            soil = self.soil_data.assign(parcelle_id=self.soil_data['parcelle_id'].astype(str))
+            soil = soil.drop_duplicates('parcelle_id').set_index('parcelle_id')
+            parcelles = rows['parcelle_id'].astype(str)
+            unknown = parcelles[~parcelles.isin(soil.index)].unique()
+            if len(unknown):
+                raise KeyError(f"Parcelles inconnues dans les relevés météo ajoutés : {list(unknown)}")
+            coords = soil.loc[parcelles, ['latitude', 'longitude']].to_numpy()
+            _, positions = self.station_index.nearest(coords[:, 0], coords[:, 1])
+            rows = rows.assign(station_id=self.station_index.station_ids[positions[:, 0]])
+            keys = ['station_id', 'date']
+        rows = rows.drop(columns=['parcelle_id'])
+        return rows.groupby(keys, as_index=False, sort=False).mean(numeric_only=True)
+
+    @instrumented('append_weather')
+    def append_weather(self, rows):
+        """Ajoute des relevés météo horaires (schéma de meteo_detaillee.csv, station_id facultatif).
+
+        En granularité journalière, seuls les jours touchés par le lot sont
+        réagrégés (ainsi que les mois correspondants). Les relevés de
+        monitoring dont la météo la plus récente a pu changer, à partir du
+        premier jour du lot et pour les parcelles des stations concernées, sont
+        refusionnés. Des relevés par parcelle (colonne parcelle_id) sont
+        rattachés aux séries chargées (voir _weather_series_rows). Retourne les
+        parcelles dont les caractéristiques ont changé.
+        """
+        self._require_loaded()
+        self.feature_store.ensure_built()
+        rows = pd.DataFrame(rows)
+        if rows.empty:
+            return set()
+        rows['date'] = pd.to_datetime(rows['date']).astype(self.weather_data['date'].dtype)
+        rows = self._weather_series_rows(rows)
+
+        # Météo utilisée jusqu'ici par les relevés concernés, pour retirer leurs anciennes valeurs
+        since = rows['date'].min().floor('D') if self.weather_grain == 'daily' else rows['date'].min()
+        previous_window = self._weather_window(since)
+
+        if self.weather_grain == 'daily':
+            with stage('append_weather.aggregate', rows=len(rows)):
+                self.weather_data, since = self.weather_aggregator.update_daily(self.weather_data, rows)
+                month = since.to_period('M').start_time
+                recent = self.weather_monthly['date'] >= month
+                monthly = self.weather_aggregator.monthly(self.weather_data[self.weather_data['date'] >= month])
+                keys = ['station_id'] if 'station_id' in monthly.columns else []
+                self.weather_monthly = concat_aligned([self.weather_monthly[~recent], monthly]).sort_values(
+                    keys + ['date'], ignore_index=True)
+        else:
+            rows = optimize_dtypes(rows.reindex(columns=self.weather_data.columns), ['station_id'])
+            self.weather_data = concat_aligned([self.weather_data, rows])
+            since = rows['date'].min()
+
+        # Relevés dont la correspondance météo peut avoir changé
+        monitoring = self.monitoring_data
+        affected = monitoring[monitoring['date'] >= since]
+        if self.station_index is not None and 'station_id' in rows.columns:
+            assignments = self.station_index.assign_parcelles(self.soil_data, self.station_neighbors, self.idw_power)
+            stations = rows['station_id'].astype(str).unique()
+            parcelles = assignments.loc[assignments['station_id'].isin(stations), 'parcelle_id'].unique()
+            affected = affected[affected['parcelle_id'].astype(str).isin(parcelles)]
+
+        if affected.empty:
+            # Météo postérieure à tous les relevés : aucune caractéristique ne change
+            self._advance_version(rows)
+            return self.feature_store.append(affected, self.data_version)
+        replaced = self._join_features(affected, previous_window)
+        joined = self._join_features(affected, self._weather_window(since))
+        return self._update_features(joined, rows, replaced=replaced, since=since)
+
+
+# Comparaison des temps de chargement à froid (CSV) et à chaud (cache Parquet)
+if __name__ == "__main__":
+    configure_logging()
+    data_manager = AgriculturalDataManager()
+
+    data_manager.load_data(refresh_cache=True)
+    cold_report = data_manager.get_load_report()
+    data_manager.load_data()
+    warm_report = data_manager.get_load_report()
 
-        return merged_data
\ No newline at end of file
+    print("Chargement à froid :")
+    print(cold_report)
+    print("Chargement à chaud :")
+    print(warm_report)
+    speedup = cold_report.attrs['total_seconds'] / max(warm_report.attrs['total_seconds'], 1e-9)
+    print(f"Accélération : x{speedup:.1f} - mémoire résidente : {warm_report.attrs['rss_mb']:.1f} Mo")
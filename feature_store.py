@@ -0,0 +1,188 @@
+import threading
+
+import numpy as np
+
+from data_cache import concat_aligned
+
+
+class _FeatureUpdate:
+    def __init__(self, rows, since=None):
+        """Lot de lignes normalisées ajouté au magasin ; avec `since`, remplace les lignes
+        de ses parcelles datées de `since` ou après."""
+        self.rows = rows
+        self.since = since
+        self.parcelle_ids = rows['parcelle_id'].astype(str)
+        self.parcelles = set(self.parcelle_ids.unique())
+        self._index = None
+
+    def rows_for(self, parcelle_id):
+        if self._index is None:
+            self._index = self.rows.groupby(self.parcelle_ids, sort=False).indices
+        return self.rows.iloc[self._index[parcelle_id]]
+
+    def supersedes(self, frame):
+        """Masque des lignes de `frame` remplacées par ce lot."""
+        if self.since is None:
+            return np.zeros(len(frame), dtype=bool)
+        return (frame['parcelle_id'].astype(str).isin(self.parcelles) & (frame['date'] >= self.since)).to_numpy()
+
+
+class AgriculturalFeatureStore:
+    def __init__(self, data_manager):
+        """Initialise le magasin de caractéristiques adossé au gestionnaire de données.
+
+        Le tableau fusionné et normalisé est construit une seule fois par version
+        des données, puis découpé par parcelle via un index de partitions. Les
+        ajouts incrémentaux sont journalisés par lot et ne sont intégrés aux
+        partitions qu'à leur lecture ; les abonnés sont prévenus des parcelles
+        modifiées. Un verrou protège le cache contre les threads concurrents
+        (reconstruction, recomposition paresseuse des partitions, ajouts).
+        """
+        self.data_manager = data_manager
+        self.version = None        # Version des données du tableau en cache
+        self.build_count = 0       # Nombre de reconstructions (fusion + normalisation)
+        self.update_count = 0      # Nombre de mises à jour incrémentales
+        self._base = None           # Tableau complet à la dernière construction ou compaction
+        self._partition_index = {}  # parcelle_id -> positions des lignes dans _base
+        self._partitions = {}       # parcelle_id -> DataFrame déjà découpé
+        self._updates = []          # Lots ajoutés depuis _base
+        self._parcelles = None
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        """Vide le cache ; la prochaine lecture reconstruira les caractéristiques."""
+        with self._lock:
+            self.version = None
+            self._base = None
+            self._partition_index = {}
+            self._partitions = {}
+            self._updates = []
+            self._parcelles = None
+
+    def subscribe(self, callback):
+        """Abonne `callback(parcelle_ids, version, previous_version)` aux mises à jour incrémentales.
+
+        `parcelle_ids` est l'ensemble des parcelles dont les caractéristiques ont
+        changé, ou None lorsque toutes ont changé (renormalisation).
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def ensure_built(self):
+        """Reconstruit les caractéristiques si la version des données a changé."""
+        with self._lock:
+            current_version = self.data_manager.data_version
+            if self._base is not None and self.version == current_version:
+                return
+
+            self._set_base(self.data_manager.build_features())
+            self.version = current_version
+            self.build_count += 1
+
+    def _set_base(self, features):
+        self._base = features
+        self._partition_index = features.groupby('parcelle_id', observed=True, sort=False).indices
+        self._partitions = {}
+        self._updates = []
+        self._parcelles = None
+
+    @property
+    def parcelles(self):
+        """Liste des identifiants de parcelles présents dans les caractéristiques."""
+        with self._lock:
+            self.ensure_built()
+            if self._parcelles is None:
+                parcelles = dict.fromkeys(self._partition_index)
+                for update in self._updates:
+                    parcelles.update(dict.fromkeys(update.parcelles))
+                self._parcelles = list(parcelles)
+            return self._parcelles
+
+    def _compact(self):
+        """Intègre les lots ajoutés au tableau complet, en une seule concaténation vectorisée."""
+        frames = [self._base] + [update.rows for update in self._updates]
+        kept = []
+        for position, frame in enumerate(frames):
+            superseded = np.zeros(len(frame), dtype=bool)
+            for update in self._updates[position:]:
+                superseded |= update.supersedes(frame)
+            kept.append(frame[~superseded])
+        self._set_base(concat_aligned(kept).sort_values('date', kind='stable', ignore_index=True))
+
+    def get_features(self, parcelle_id=None):
+        """Retourne les caractéristiques de toutes les parcelles ou d'une seule.
+
+        Les DataFrames retournés sont partagés par tous les appelants et ne
+        doivent pas être modifiés en place.
+        """
+        with self._lock:
+            self.ensure_built()
+            if parcelle_id is None:
+                if self._updates:
+                    self._compact()
+                return self._base
+
+            partition = self._partitions.get(parcelle_id)
+            if partition is None:
+                positions = self._partition_index.get(parcelle_id)
+                partition = self._base.iloc[0:0] if positions is None else self._base.iloc[positions]
+                updates = [update for update in self._updates if parcelle_id in update.parcelles]
+                if updates:
+                    for update in updates:
+                        if update.since is not None:
+                            partition = partition[partition['date'] < update.since]
+                        partition = concat_aligned([partition, update.rows_for(parcelle_id)])
+                    partition = partition.sort_values('date', kind='stable', ignore_index=True)
+                elif positions is None:
+                    return partition
+                self._partitions[parcelle_id] = partition
+            return partition
+
+    def rescale(self, columns, factor, offset):
+        """Applique `x * factor + offset` aux colonnes normalisées de toutes les lignes.
+
+        Utilisé lorsque les paramètres de normalisation changent : les valeurs
+        déjà normalisées sont converties sans refaire la fusion.
+        """
+        columns = list(columns)
+
+        def apply(frame):
+            frame = frame.copy()
+            frame[columns] = frame[columns].to_numpy() * factor + offset
+            return frame
+
+        with self._lock:
+            self.ensure_built()
+            self._base = apply(self._base)
+            for update in self._updates:
+                update.rows = apply(update.rows)
+            self._partitions = {}
+
+    def append(self, rows, version, since=None, all_changed=False):
+        """Ajoute des lignes normalisées (toutes parcelles confondues) et passe à `version`.
+
+        Avec `since`, les lignes existantes des parcelles de `rows` datées de
+        `since` ou après sont remplacées. Le coût ne dépend que de la taille du
+        lot : les partitions concernées sont recomposées à leur prochaine
+        lecture. Les abonnés reçoivent les parcelles modifiées, ou None si
+        `all_changed` (toutes les lignes ont été renormalisées).
+        """
+        update = _FeatureUpdate(rows, since)
+        with self._lock:
+            previous_version = self.version
+            if len(rows):
+                self._updates.append(update)
+                for parcelle_id in update.parcelles:
+                    self._partitions.pop(parcelle_id, None)
+                self._parcelles = None
+            self.version = version
+            self.update_count += 1
+
+        # Les abonnés sont prévenus hors du verrou
+        changed = None if all_changed else update.parcelles
+        for callback in list(self._subscribers):
+            callback(changed, version, previous_version)
+        return changed
@@ -0,0 +1,259 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class _State:
+    """État global de l'instrumentation (désactivée par défaut)."""
+    enabled = os.environ.get('AGRI_INSTRUMENTATION', '') not in ('', '0', 'false')
+    track_memory = os.environ.get('AGRI_INSTRUMENTATION_MEMORY', '') not in ('', '0', 'false')
+    registry = None
+
+
+class StageRecord:
+    def __init__(self, name):
+        """Mesures d'une étape ; `rows` peut être renseigné par le code instrumenté."""
+        self.name = name
+        self.rows = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_memory_bytes = None
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'peak_memory_bytes': self.peak_memory_bytes,
+            'rows': self.rows,
+        }
+
+
+class _MemoryTracker:
+    def __init__(self):
+        """Pics de mémoire des étapes ouvertes, tous threads confondus.
+
+        tracemalloc n'a qu'un pic global : avant chaque remise à zéro (entrée
+        d'une étape), il est reporté sur toutes les étapes ouvertes, relativement
+        à leur mémoire de départ. Une étape imbriquée ou concurrente n'efface
+        donc plus le pic des autres. Les allocations des autres threads sont
+        comptées dans les étapes ouvertes pendant qu'elles ont lieu.
+        """
+        self.lock = threading.Lock()
+        self.frames = {}  # jeton -> [mémoire au départ, pic relatif]
+        self.started_tracing = False
+        self._next_token = 0
+
+    def _fold(self):
+        """Reporte le pic global courant sur les étapes ouvertes ; retourne la mémoire courante."""
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self.frames.values():
+            frame[1] = max(frame[1], peak - frame[0])
+        return current
+
+    def enter(self):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            current = self._fold()
+            tracemalloc.reset_peak()
+            token = self._next_token
+            self._next_token += 1
+            self.frames[token] = [current, 0]
+            return token
+
+    def exit(self, token):
+        """Ferme une étape et retourne son pic de mémoire (octets au-delà de la mémoire de départ)."""
+        with self.lock:
+            self._fold()
+            _, peak = self.frames.pop(token)
+            if not self.frames and self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+            return max(peak, 0)
+
+
+_memory = _MemoryTracker()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Registre en mémoire des mesures cumulées par étape, exportable au format Prometheus."""
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        with self._lock:
+            stats = self._stages.setdefault(record.name, {
+                'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0, 'peak_memory_bytes': 0,
+            })
+            stats['calls'] += 1
+            stats['wall_seconds'] += record.wall_seconds
+            stats['cpu_seconds'] += record.cpu_seconds
+            stats['rows'] += record.rows or 0
+            if record.peak_memory_bytes is not None:
+                stats['peak_memory_bytes'] = max(stats['peak_memory_bytes'], record.peak_memory_bytes)
+
+    def snapshot(self):
+        """Copie des mesures cumulées : étape -> statistiques."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def to_prometheus(self, prefix='agri_stage'):
+        """Exporte les mesures au format texte d'exposition Prometheus."""
+        metrics = [
+            ('calls_total', 'counter', "Nombre d'exécutions de l'étape", 'calls'),
+            ('wall_seconds_total', 'counter', "Temps réel cumulé de l'étape", 'wall_seconds'),
+            ('cpu_seconds_total', 'counter', "Temps CPU cumulé de l'étape", 'cpu_seconds'),
+            ('rows_total', 'counter', "Lignes traitées par l'étape", 'rows'),
+            ('peak_memory_bytes', 'gauge', "Pic de mémoire allouée pendant l'étape", 'peak_memory_bytes'),
+        ]
+        snapshot = self.snapshot()
+        lines = []
+        for suffix, kind, help_text, key in metrics:
+            name = f"{prefix}_{suffix}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage_name, stats in sorted(snapshot.items()):
+                label = stage_name.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{name}{{stage="{label}"}} {stats[key]}')
+        return "\n".join(lines) + "\n"
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formate chaque enregistrement de log en une ligne JSON (mesures d'étape incluses)."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if hasattr(record, 'metrics'):
+            entry.update(record.metrics)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=logging.INFO, structured=False):
+    """Configure un gestionnaire de logs sur la sortie d'erreur (JSON si `structured`)."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter() if structured else logging.Formatter('%(message)s'))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+
+
+def enable(metrics=True, track_memory=False):
+    """Active l'instrumentation ; `metrics` crée le registre, `track_memory` mesure les pics via tracemalloc."""
+    _State.enabled = True
+    _State.track_memory = track_memory
+    if metrics and _State.registry is None:
+        _State.registry = MetricsRegistry()
+    return _State.registry
+
+
+def disable():
+    """Désactive l'instrumentation (les appels instrumentés ne mesurent plus rien)."""
+    _State.enabled = False
+
+
+def is_enabled():
+    return _State.enabled
+
+
+def get_registry():
+    """Registre des mesures, ou None si enable(metrics=True) n'a pas été appelé."""
+    return _State.registry
+
+
+def _count_rows(result):
+    """Nombre de lignes d'un résultat tabulaire (DataFrame, Series, tableau), sinon None."""
+    if hasattr(result, 'shape') and len(getattr(result, 'shape', ())) > 0:
+        return int(result.shape[0])
+    return None
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Mesure une étape : temps réel, temps CPU, pic de mémoire (optionnel) et lignes traitées.
+
+    La mesure est écrite dans les logs structurés et, s'il existe, dans le
+    registre. Désactivée, l'étape ne coûte qu'un test.
+    """
+    record = StageRecord(name)
+    record.rows = rows
+    if not _State.enabled:
+        yield record
+        return
+
+    memory_token = _memory.enter() if _State.track_memory else None
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    failed = False
+    try:
+        yield record
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record.wall_seconds = time.perf_counter() - wall_start
+        record.cpu_seconds = time.process_time() - cpu_start
+        if memory_token is not None:
+            record.peak_memory_bytes = _memory.exit(memory_token)
+
+        metrics = record.as_dict()
+        metrics['status'] = 'erreur' if failed else 'ok'
+        logger.info("Étape %s terminée en %.3f s", name, record.wall_seconds, extra={'metrics': metrics})
+        if _State.registry is not None:
+            _State.registry.record(record)
+
+
+def instrumented(name=None):
+    """Décorateur mesurant chaque appel comme une étape (voir `stage`).
+
+    Le nombre de lignes est déduit du résultat lorsqu'il est tabulaire.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _State.enabled:
+                return func(*args, **kwargs)
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if record.rows is None:
+                    record.rows = _count_rows(result)
+                return result
+
+        return wrapper
+    return decorator
+
+
+def profile_call(func, *args, output_file=None, **kwargs):
+    """Exécute un appel sous cProfile et enregistre le profil (lisible avec pstats ou snakeviz).
+
+    Retourne le résultat de l'appel ; le profil est écrit dans `output_file`
+    (par défaut `<nom de la fonction>.prof`).
+    """
+    output_file = output_file or f"{getattr(func, '__qualname__', 'appel')}.prof"
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(output_file)
+        logger.info("Profil cProfile enregistré : %s", output_file)
@@ -1,32 +1,141 @@
-import folium
-from folium.plugins import MarkerCluster
+import numpy as np
 from data_manager import AgriculturalDataManager
+from instrumentation import configure_logging, instrumented, stage
+
+# Indicateurs disponibles pour colorer les parcelles : (libellé, couleurs du plus bas au plus haut)
+COLOR_SCALES = {
+    'ndvi': ("NDVI le plus récent", ['#d73027', '#fee08b', '#1a9850']),
+    'rendement': ("Rendement moyen (tonnes/ha)", ['#d73027', '#fee08b', '#1a9850']),
+    'risque': ("Score de risque", ['#1a9850', '#fee08b', '#d73027']),
+}
+
+# Création d'un marqueur par point dans le navigateur (FastMarkerCluster)
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(row[2]);
+    return marker;
+};
+"""
+
 
 class AgriculturalMap:
     def __init__(self, data_manager):
-        """Initialise la carte avec le gestionnaire de données."""
+        """Initialise la carte avec le gestionnaire de données.
+
+        La carte folium n'est créée qu'au premier accès à `map` : les agrégats
+        par parcelle (parcel_summary) restent disponibles sans importer folium.
+        """
         self.data_manager = data_manager
-        self.map = folium.Map(location=[45.5236, -122.6750], zoom_start=13)
+        self._map = None
+        self.version = None
+        self._summary = None
+
+    @property
+    def map(self):
+        if self._map is None:
+            import folium
+
+            self._map = folium.Map(location=[45.5236, -122.6750], zoom_start=13)
+        return self._map
+
+    @instrumented('map.parcel_summary')
+    def parcel_summary(self):
+        """Agrège le monitoring en une ligne par parcelle avec les coordonnées brutes de sols.csv.
+
+        Colonnes : parcelle_id, latitude, longitude, ndvi (dernier relevé),
+        rendement (moyenne), risque (score de la table du moteur de risque) et
+        rang (entier nullable, 1 = parcelle la plus à risque). Le résultat est
+        mémorisé par version des données, comme la table du moteur de risque.
+        """
+        if self._summary is not None and self.version == self.data_manager.data_version:
+            return self._summary
 
-    def create_base_map(self):
-        """Crée la carte de base avec les parcelles."""
-        data = self.data_manager.prepare_features()
+        monitoring = self.data_manager.monitoring_data
+        latest = monitoring.sort_values('date').groupby('parcelle_id', observed=True)['ndvi'].last()
+        grouped = monitoring.groupby('parcelle_id', observed=True)
+        summary = grouped['rendement'].mean().to_frame()
+        summary['ndvi'] = latest
+        summary.index = summary.index.astype(str)
+        risk = self.data_manager.risk_engine.risk_table().set_index('parcelle_id')
+        summary['risque'] = risk['score_risque'].reindex(summary.index)
+        summary['rang'] = risk['rang'].reindex(summary.index).astype('Int64')
 
-        # Ajouter des marqueurs pour chaque parcelle
-        marker_cluster = MarkerCluster().add_to(self.map)
-        for _, row in data.iterrows():
-            folium.Marker(
-                location=[row['latitude_x'], row['longitude_x']],
-                popup=f"Parcelle {row['parcelle_id']}<br>NDVI: {row['ndvi']:.2f}<br>Rendement: {row['rendement']:.2f}",
-            ).add_to(marker_cluster)
+        soil = self.data_manager.soil_data[['parcelle_id', 'latitude', 'longitude']]
+        soil = soil.assign(parcelle_id=soil['parcelle_id'].astype(str))
+        summary = soil.merge(summary.reset_index(), on='parcelle_id', how='inner')
 
+        # Textes des popups construits en une seule opération vectorisée
+        summary['popup'] = ("Parcelle " + summary['parcelle_id']
+                            + "<br>NDVI: " + summary['ndvi'].map('{:.2f}'.format)
+                            + "<br>Rendement: " + summary['rendement'].map('{:.2f}'.format)
+                            + "<br>Risque: " + summary['risque'].map('{:.0%}'.format)
+                            + " (rang " + summary['rang'].astype('string').fillna('-') + ")")
+
+        self._summary = summary
+        self.version = self.data_manager.data_version
+        return summary
+
+    @instrumented('map.create_base_map')
+    def create_base_map(self, color_by=None):
+        """Crée la carte de base avec une entité par parcelle.
+
+        Sans `color_by`, les parcelles sont regroupées dans un FastMarkerCluster ;
+        avec `color_by` ('ndvi', 'rendement' ou 'risque'), elles sont dessinées
+        en une couche GeoJSON de cercles colorés selon l'indicateur.
+        """
+        import folium
+        from branca.colormap import LinearColormap
+        from folium.plugins import FastMarkerCluster
+
+        summary = self.parcel_summary()
+        if summary.empty:
+            return self.map
+        self.map.fit_bounds([[summary['latitude'].min(), summary['longitude'].min()],
+                             [summary['latitude'].max(), summary['longitude'].max()]])
+
+        if color_by is None:
+            # Ajouter des marqueurs pour chaque parcelle
+            with stage('map.markers', rows=len(summary)):
+                points = summary[['latitude', 'longitude', 'popup']].to_numpy().tolist()
+                FastMarkerCluster(points, callback=MARKER_CALLBACK).add_to(self.map)
+            return self.map
+
+        if color_by not in COLOR_SCALES:
+            raise ValueError(f"Indicateur de couleur inconnu : {color_by}")
+        caption, colors = COLOR_SCALES[color_by]
+        values = summary[color_by].to_numpy(dtype=np.float64)
+        colormap = LinearColormap(colors, vmin=np.nanmin(values), vmax=np.nanmax(values), caption=caption)
+        # Colonne ajoutée à une copie : le résumé mémorisé reste intact
+        summary = summary.assign(couleur=[colormap(value) if np.isfinite(value) else '#808080' for value in values])
+
+        features = [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': {'parcelle_id': parcelle_id, 'popup': popup, 'couleur': couleur},
+            }
+            for parcelle_id, lat, lon, popup, couleur in summary[
+                ['parcelle_id', 'latitude', 'longitude', 'popup', 'couleur']].itertuples(index=False)
+        ]
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            name=caption,
+            marker=folium.CircleMarker(radius=8, fill=True, fill_opacity=0.8, weight=1),
+            style_function=lambda feature: {'fillColor': feature['properties']['couleur'], 'color': '#333333'},
+            popup=folium.GeoJsonPopup(fields=['popup'], labels=False),
+        ).add_to(self.map)
+        colormap.add_to(self.map)
         return self.map
 
-# Initialisation de la carte
-data_manager = AgriculturalDataManager()
-data_manager.load_data()
-agricultural_map = AgriculturalMap(data_manager)
-base_map = agricultural_map.create_base_map()
+if __name__ == "__main__":
+    configure_logging()
+
+    # Initialisation de la carte
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+    agricultural_map = AgriculturalMap(data_manager)
+    base_map = agricultural_map.create_base_map()
 
-# Sauvegarder la carte dans un fichier HTML
-base_map.save("carte_parcelles.html")
\ No newline at end of file
+    # Sauvegarder la carte dans un fichier HTML
+    base_map.save("carte_parcelles.html")
@@ -0,0 +1,256 @@
+import glob
+import hashlib
+import os
+import threading
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented, stage
+
+POOLED_KEY = '_pooled'  # Clé du modèle commun à toutes les parcelles
+
+
+def _fit_model(estimator, X, y):
+    """Entraîne un estimateur (exécuté dans un processus de travail joblib)."""
+    return estimator.fit(X, y)
+
+
+class YieldModelRegistry:
+    def __init__(self, data_manager, estimator, model_dir=None, n_jobs=-1):
+        """Initialise le registre des modèles de rendement.
+
+        `estimator` sert de modèle de référence, cloné pour chaque parcelle. Les
+        modèles sont entraînés sur les valeurs brutes (dénormalisées) et
+        sauvegardés dans `model_dir` (par défaut `<cache>/models`) ; ils ne
+        sont réentraînés que si les données de la parcelle ou le schéma des
+        caractéristiques changent, et non à chaque nouvelle normalisation.
+        Un verrou par clé empêche deux threads d'entraîner le même modèle.
+        """
+        self.data_manager = data_manager
+        self.estimator = estimator
+        self.model_dir = model_dir or os.path.join(data_manager.cache.cache_dir, 'models')
+        self.n_jobs = n_jobs
+        self._models = {}      # clé -> (empreinte, modèle entraîné)
+        self._hashes = {}      # (version des caractéristiques, clé) -> empreinte
+        self.fit_count = 0     # Nombre de modèles entraînés par ce registre
+        self._lock = threading.Lock()  # Protège _hashes, _key_locks et fit_count
+        self._key_locks = {}           # clé -> verrou d'entraînement du modèle
+        data_manager.feature_store.subscribe(self._on_features_changed)
+
+    def _on_features_changed(self, parcelle_ids, version, previous_version):
+        """Reporte sur la nouvelle version les empreintes des parcelles inchangées."""
+        with self._lock:
+            if parcelle_ids is None:
+                self._hashes = {}
+                return
+            self._hashes = {(version, key): value for (hash_version, key), value in self._hashes.items()
+                            if hash_version == previous_version and key != POOLED_KEY and key not in parcelle_ids}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def split_target(data):
+        """Sépare les caractéristiques numériques et la cible 'rendement'."""
+        if 'rendement' not in data.columns:
+            raise KeyError("La colonne 'rendement' est manquante dans les données.")
+        X = data.select_dtypes(include=[np.number]).drop(columns=['rendement'])
+        return X, data['rendement']
+
+    def _scaling(self, columns):
+        """Moyennes et écarts-types de normalisation de `columns` (0 et 1 pour les colonnes non normalisées)."""
+        scaler = self.data_manager.scaler
+        names = getattr(scaler, 'feature_names_in_', None)
+        index = pd.Index([] if names is None else list(names)).get_indexer(list(columns))
+        known = index >= 0
+        mean = np.zeros(len(index))
+        scale = np.ones(len(index))
+        mean[known] = scaler.mean_[index[known]]
+        scale[known] = scaler.scale_[index[known]]
+        return mean, scale
+
+    def to_raw(self, data):
+        """Revient aux valeurs brutes des colonnes numériques normalisées (float32).
+
+        Les mesures sources étant en float32, l'arrondi retrouve exactement les
+        valeurs lues quels que soient les paramètres de normalisation courants.
+        """
+        columns = data.select_dtypes(include=[np.number]).columns
+        mean, scale = self._scaling(columns)
+        raw = data.copy()
+        raw[columns] = (data[columns].to_numpy(np.float64) * scale + mean).astype(np.float32)
+        return raw
+
+    def to_yield(self, predictions):
+        """Ramène des rendements normalisés (sortie de predict) en tonnes/ha."""
+        mean, scale = self._scaling(['rendement'])
+        return np.asarray(predictions, dtype=np.float64) * scale[0] + mean[0]
+
+    def _raw_training(self, key):
+        """Caractéristiques et cible brutes d'entraînement d'une parcelle ou du modèle commun."""
+        return self.split_target(self.to_raw(self._training_data(key)))
+
+    def schema_hash(self, columns, estimator=None):
+        """Empreinte du schéma des caractéristiques et des hyperparamètres du modèle.
+
+        `estimator` remplace le modèle de référence du registre (modèles de pli
+        de la validation progressive, par exemple).
+        """
+        estimator = estimator if estimator is not None else self.estimator
+        params = sorted((k, repr(v)) for k, v in estimator.get_params().items() if k != 'n_jobs')
+        digest = hashlib.sha256(repr((list(columns), type(estimator).__name__, params)).encode())
+        return digest.hexdigest()[:12]
+
+    def _training_data(self, key):
+        """Retourne les données d'entraînement d'une parcelle ou du modèle commun."""
+        if key == POOLED_KEY:
+            return self.data_manager.get_features()
+        return self.data_manager.get_features(key)
+
+    def _data_hash(self, key, data):
+        """Empreinte du contenu brut des données d'entraînement, mémorisée par version.
+
+        Elle porte sur les valeurs dénormalisées : une nouvelle normalisation,
+        provoquée par les données d'une autre parcelle, ne la modifie pas.
+        """
+        cache_key = (self.data_manager.feature_store.version, key)
+        value = self._hashes.get(cache_key)
+        if value is None:
+            if key == POOLED_KEY:
+                value = self.data_manager.data_version
+            else:
+                row_hashes = pd.util.hash_pandas_object(self.to_raw(data), index=False).to_numpy()
+                value = hashlib.sha256(row_hashes.tobytes()).hexdigest()[:16]
+            with self._lock:
+                self._hashes[cache_key] = value
+        return value
+
+    def _fingerprint(self, key):
+        data = self._training_data(key)
+        X, _ = self.split_target(data)
+        return f"{self.schema_hash(X.columns)}-{self._data_hash(key, data)}"
+
+    def _model_path(self, key, fingerprint):
+        return os.path.join(self.model_dir, f"{key}-{fingerprint}.joblib")
+
+    def _store(self, key, fingerprint, model):
+        """Garde le modèle en mémoire et le sauvegarde sur disque, en remplaçant l'ancien."""
+        import joblib
+
+        self._models[key] = (fingerprint, model)
+        os.makedirs(self.model_dir, exist_ok=True)
+        path = self._model_path(key, fingerprint)
+        for old_path in glob.glob(os.path.join(self.model_dir, f"{glob.escape(key)}-*.joblib")):
+            if old_path != path:
+                os.remove(old_path)
+        tmp_path = f"{path}.tmp"
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _lookup(self, key, fingerprint):
+        """Retourne un modèle à jour depuis la mémoire ou le disque, sinon None."""
+        import joblib
+
+        cached = self._models.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        path = self._model_path(key, fingerprint)
+        if os.path.exists(path):
+            model = joblib.load(path)
+            self._models[key] = (fingerprint, model)
+            return model
+        return None
+
+    def _fit_stale(self, stale):
+        """Entraîne les modèles des clés `stale`, en parallèle sur tous les cœurs."""
+        from joblib import Parallel, delayed
+        from sklearn.base import clone
+
+        if len(stale) == 1:
+            # Un seul modèle : le parallélisme se fait au niveau des arbres
+            X, y = self._raw_training(stale[0][0])
+            return [_fit_model(clone(self.estimator).set_params(n_jobs=self.n_jobs), X, y)]
+
+        # Plusieurs modèles : un modèle par processus de travail
+        jobs = []
+        for key, _ in stale:
+            X, y = self._raw_training(key)
+            jobs.append(delayed(_fit_model)(clone(self.estimator).set_params(n_jobs=1), X, y))
+        return Parallel(n_jobs=self.n_jobs)(jobs)
+
+    @instrumented('model_registry.train')
+    def train(self, parcelle_ids=None, pooled=False):
+        """Entraîne en parallèle les modèles des parcelles dont les données ont changé.
+
+        Par défaut, toutes les parcelles sont traitées ; `pooled=True` entraîne
+        également le modèle commun à toutes les parcelles. Retourne la liste des
+        clés effectivement réentraînées.
+        """
+        keys = list(dict.fromkeys(self.data_manager.feature_store.parcelles if parcelle_ids is None
+                                  else parcelle_ids))
+
+        with ExitStack() as locks:
+            # Verrous pris dans un ordre fixe : deux entraînements concurrents ne s'interbloquent pas ;
+            # un thread qui attend retrouve ensuite le modèle déjà entraîné par l'autre
+            for key in sorted(keys, key=str):
+                locks.enter_context(self._key_lock(key))
+
+            stale = []
+            for key in keys:
+                fingerprint = self._fingerprint(key)
+                if self._lookup(key, fingerprint) is None:
+                    stale.append((key, fingerprint))
+
+            if stale:
+                with stage('model_registry.random_forest_fit', rows=len(stale)):
+                    models = self._fit_stale(stale)
+                for (key, fingerprint), model in zip(stale, models):
+                    self._store(key, fingerprint, model)
+                with self._lock:
+                    self.fit_count += len(stale)
+
+        retrained = [key for key, _ in stale]
+        if pooled:
+            with self._key_lock(POOLED_KEY):
+                fingerprint = self._fingerprint(POOLED_KEY)
+                if self._lookup(POOLED_KEY, fingerprint) is None:
+                    # Le modèle commun utilise directement tous les cœurs pour ses arbres
+                    from sklearn.base import clone
+
+                    X, y = self._raw_training(POOLED_KEY)
+                    model = _fit_model(clone(self.estimator).set_params(n_jobs=self.n_jobs), X, y)
+                    self._store(POOLED_KEY, fingerprint, model)
+                    with self._lock:
+                        self.fit_count += 1
+                    retrained.append(POOLED_KEY)
+        return retrained
+
+    def get_model(self, parcelle_id=None):
+        """Retourne le modèle d'une parcelle (ou le modèle commun si `parcelle_id` est None)."""
+        key = POOLED_KEY if parcelle_id is None else parcelle_id
+        model = self._lookup(key, self._fingerprint(key))
+        if model is None:
+            self.train([] if key == POOLED_KEY else [key], pooled=key == POOLED_KEY)
+            model = self._models[key][1]
+        return model
+
+    def predict(self, parcelle_id, X_new):
+        """Prédit les rendements de nouvelles observations avec le modèle de la parcelle.
+
+        `parcelle_id=None` utilise le modèle commun. `X_new` est normalisé comme
+        les caractéristiques ; ses colonnes sont réalignées sur celles vues à
+        l'entraînement, puis dénormalisées pour le modèle. Les prédictions sont
+        renvoyées normalisées avec les paramètres courants du rendement.
+        """
+        model = self.get_model(parcelle_id)
+        columns = list(model.feature_names_in_)
+        if isinstance(X_new, pd.DataFrame):
+            X_new = X_new.reindex(columns=columns)
+        mean, scale = self._scaling(columns)
+        X_raw = pd.DataFrame((np.asarray(X_new, dtype=np.float64) * scale + mean).astype(np.float32),
+                             columns=columns)
+        target_mean, target_scale = self._scaling(['rendement'])
+        return (model.predict(X_raw) - target_mean[0]) / target_scale[0]
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+def _moments(values):
+    """Effectifs, moyennes et sommes des carrés des écarts par colonne, en ignorant les NaN."""
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, np.where(valid, values, 0.0).sum(axis=0) / counts, 0.0)
+    m2 = np.where(valid, values - means, 0.0)
+    return counts, means, (m2 * m2).sum(axis=0)
+
+
+def _scale(variance):
+    """Écarts-types, remplacés par 1 pour les colonnes constantes (comme StandardScaler)."""
+    scale = np.sqrt(variance)
+    return np.where(scale < 10 * np.finfo(np.float64).eps, 1.0, scale)
+
+
+class OnlineStandardScaler:
+    def __init__(self, tolerance=0.02):
+        """Normalisation centrée réduite dont les statistiques se mettent à jour par lots.
+
+        Les moments courants (effectifs, moyennes, sommes des carrés des
+        écarts) sont combinés lot par lot (formule de Chan), avec partial_fit
+        pour de nouvelles lignes et remove pour des lignes remplacées. La
+        transformation utilise les paramètres appliqués (`mean_`, `scale_`),
+        qui ne suivent les moments courants qu'à l'appel de refresh() :
+        tant que la dérive reste sous `tolerance` (en écarts-types), les
+        valeurs déjà normalisées restent valables. Compatible avec les
+        attributs de sklearn.preprocessing.StandardScaler.
+        """
+        self.tolerance = tolerance
+        self.feature_names_in_ = None
+        self.n_samples_seen_ = None
+        self._mean = None
+        self._m2 = None
+        self.mean_ = None
+        self.var_ = None
+        self.scale_ = None
+
+    @staticmethod
+    def _values(X):
+        return np.asarray(X, dtype=np.float64).reshape(len(X), -1)
+
+    def fit(self, X):
+        """Calcule les statistiques de X et les applique."""
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object) if isinstance(X, pd.DataFrame) else None
+        self.n_samples_seen_, self._mean, self._m2 = _moments(self._values(X))
+        self.refresh()
+        return self
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def partial_fit(self, X):
+        """Ajoute les lignes de X aux moments courants (sans modifier les paramètres appliqués)."""
+        if self.n_samples_seen_ is None:
+            return self.fit(X)
+        counts, means, m2 = _moments(self._values(X))
+        total = self.n_samples_seen_ + counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = means - self._mean
+            ratio = np.where(total > 0, counts / total, 0.0)
+            self._mean = self._mean + delta * ratio
+            self._m2 = self._m2 + m2 + delta * delta * self.n_samples_seen_ * ratio
+        self.n_samples_seen_ = total
+        return self
+
+    def remove(self, X):
+        """Retire des moments courants des lignes déjà comptées (inverse de partial_fit)."""
+        counts, means, m2 = _moments(self._values(X))
+        remaining = self.n_samples_seen_ - counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            kept_mean = np.where(remaining > 0,
+                                 (self.n_samples_seen_ * self._mean - counts * means) / remaining, 0.0)
+            delta = means - kept_mean
+            correction = np.where(remaining > 0, delta * delta * remaining * counts / self.n_samples_seen_, 0.0)
+            self._m2 = np.maximum(self._m2 - m2 - correction, 0.0)
+        self._mean = kept_mean
+        self.n_samples_seen_ = remaining
+        return self
+
+    def drift(self):
+        """Écart maximal, en écarts-types appliqués, entre moments courants et paramètres appliqués."""
+        if self.mean_ is None:
+            return np.inf
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = np.where(self.n_samples_seen_ > 0, self._m2 / self.n_samples_seen_, 0.0)
+            mean_shift = np.abs(self._mean - self.mean_) / self.scale_
+            scale_shift = np.abs(_scale(variance) / self.scale_ - 1)
+        shifts = np.concatenate([mean_shift, scale_shift])
+        return float(np.nanmax(shifts)) if shifts.size else 0.0
+
+    def needs_refresh(self):
+        """Indique si la dérive des moments dépasse la tolérance."""
+        return self.drift() > self.tolerance
+
+    def refresh(self):
+        """Applique les moments courants ; retourne les anciens paramètres (moyennes, échelles)."""
+        previous = (self.mean_, self.scale_)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.var_ = np.where(self.n_samples_seen_ > 0, self._m2 / self.n_samples_seen_, 0.0)
+        self.mean_ = self._mean.copy()
+        self.scale_ = _scale(self.var_)
+        return previous
+
+    def transform(self, X):
+        return (self._values(X) - self.mean_) / self.scale_
+
+    def inverse_transform(self, X):
+        return self._values(X) * self.scale_ + self.mean_
@@ -0,0 +1,255 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented, stage
+from weather_aggregator import WeatherAggregator
+
+# Grille de seuils de stress hydrique pour les probabilités de dépassement
+STRESS_THRESHOLDS = (0.1, 0.15, 0.2, 0.3, 0.4, 0.5)
+
+# Seuil de référence du stress hydrique (score de risque, indicateurs glissants)
+REFERENCE_THRESHOLD = 0.15
+
+# Fenêtres glissantes des indicateurs, en jours
+ROLLING_WINDOWS = (7, 30, 90)
+
+# Chaleur latente de vaporisation (MJ/kg) pour convertir le rayonnement en lame d'eau
+LATENT_HEAT = 2.45
+
+logger = logging.getLogger(__name__)
+
+
+def exceedance_probabilities(codes, n_groups, values, thresholds):
+    """Probabilités de dépasser chaque seuil, groupe par groupe, en une seule passe.
+
+    Chaque valeur est classée par np.searchsorted dans la grille de seuils
+    (triée), les effectifs (groupe, classe) sont comptés avec np.bincount puis
+    cumulés depuis la classe la plus haute. Les NaN sont ignorés. Retourne un
+    tableau (n_groups x n_seuils) ; NaN pour un groupe sans valeur.
+    """
+    # Seuils comparés dans le type des valeurs (0.15 en float32 vaut la valeur lue, pas 0.15000001)
+    thresholds = np.asarray(thresholds, dtype=values.dtype)
+    codes = np.asarray(codes, dtype=np.intp)
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+
+    # Classe k : valeur strictement supérieure aux k premiers seuils
+    levels = np.searchsorted(thresholds, values, side='left')
+    n_levels = len(thresholds) + 1
+    counts = np.bincount(codes * n_levels + levels, minlength=n_groups * n_levels).reshape(n_groups, n_levels)
+    exceed = counts[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return exceed / counts.sum(axis=1, keepdims=True)
+
+
+def hargreaves_et0(temperature, rayonnement_wh):
+    """Évapotranspiration de référence (mm/jour), formule de Hargreaves sur le rayonnement mesuré.
+
+    `rayonnement_wh` est le rayonnement global journalier en Wh/m² (somme des
+    relevés horaires de meteo_detaillee.csv).
+    """
+    radiation_mj = rayonnement_wh * 0.0036
+    return np.maximum(0.0135 * (temperature + 17.8) * radiation_mj / LATENT_HEAT, 0.0)
+
+
+class AgriculturalRiskEngine:
+    def __init__(self, data_manager, thresholds=STRESS_THRESHOLDS, windows=ROLLING_WINDOWS,
+                 reference_threshold=REFERENCE_THRESHOLD, max_reserve_mm=150.0):
+        """Initialise le moteur de risque de toutes les parcelles.
+
+        Le risque combine les probabilités de dépassement des `thresholds` de
+        stress hydrique, des indicateurs sur les `windows` derniers jours et un
+        bilan hydrique journalier : un réservoir de réserve utile
+        `capacite_retention_eau` x `max_reserve_mm` (mm), rempli par les
+        précipitations et vidé par l'évapotranspiration de référence. La table
+        est calculée en une passe vectorisée et mémorisée par version des données.
+        """
+        self.data_manager = data_manager
+        self.thresholds = tuple(sorted(thresholds))
+        self.windows = tuple(sorted(windows))
+        self.reference_threshold = reference_threshold
+        self.max_reserve_mm = max_reserve_mm
+        self.version = None
+        self._table = None
+        self._lock = threading.Lock()  # Un seul calcul de la table à la fois entre threads
+
+    @property
+    def score_window(self):
+        """Fenêtre (jours) retenue pour le score de risque : la fenêtre médiane."""
+        return self.windows[len(self.windows) // 2]
+
+    def _daily_weather(self):
+        """Météo journalière (agrégée à la volée si les données chargées sont horaires)."""
+        weather = self.data_manager.weather_data
+        if 'nb_mesures' not in weather.columns:
+            weather = WeatherAggregator().aggregate(weather)
+        return weather
+
+    def _parcel_weather(self, parcelle_ids):
+        """Précipitations et évapotranspiration journalières par parcelle sur un calendrier continu.
+
+        Retourne les jours (D,) et deux tableaux (P x D), ou (1 x D) si toutes
+        les parcelles partagent la même météo. Avec des stations, chaque
+        parcelle reçoit la moyenne pondérée de ses stations voisines.
+        """
+        weather = self._daily_weather()
+        days = pd.date_range(weather['date'].min(), weather['date'].max(), freq='D')
+        day_index = days.get_indexer(weather['date'].dt.floor('D'))
+        et0 = hargreaves_et0(weather['temperature'].to_numpy(np.float64),
+                             weather['rayonnement_solaire'].to_numpy(np.float64))
+        precipitation = weather['precipitation'].to_numpy(np.float64)
+
+        dm = self.data_manager
+        if dm.station_index is None or 'station_id' not in weather.columns:
+            grid = np.full((2, 1, len(days)), np.nan)
+            grid[0, 0, day_index] = precipitation
+            grid[1, 0, day_index] = et0
+            return days, np.nan_to_num(grid[0]), np.nan_to_num(grid[1])
+
+        # Séries par station, puis moyenne pondérée par parcelle (poids renormalisés sur les valeurs présentes)
+        stations = pd.Index(weather['station_id'].astype(str).unique())
+        grid = np.full((2, len(stations), len(days)), np.nan)
+        station_codes = stations.get_indexer(weather['station_id'].astype(str))
+        grid[0, station_codes, day_index] = precipitation
+        grid[1, station_codes, day_index] = et0
+
+        assignments = dm.station_index.assign_parcelles(dm.soil_data, dm.station_neighbors, dm.idw_power)
+        rows = pd.Index(parcelle_ids).get_indexer(assignments['parcelle_id'])
+        cols = stations.get_indexer(assignments['station_id'])
+        known = (rows >= 0) & (cols >= 0)
+        weights = np.zeros((len(parcelle_ids), len(stations)))
+        np.add.at(weights, (rows[known], cols[known]), assignments['poids'].to_numpy()[known])
+
+        series = []
+        for values in grid:
+            valid = ~np.isnan(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                series.append(np.nan_to_num((weights @ np.where(valid, values, 0.0)) / (weights @ valid)))
+        return days, series[0], series[1]
+
+    def _water_balance(self, capacity, precipitation, et0, keep_days):
+        """Fait évoluer le réservoir de toutes les parcelles jour par jour (vectorisé sur les parcelles).
+
+        Retourne les réserves relatives des `keep_days` derniers jours (P x keep_days).
+        """
+        reserve = capacity.copy()
+        n_days = precipitation.shape[1]
+        history = np.empty((len(capacity), min(keep_days, n_days)))
+        start = n_days - history.shape[1]
+        for day in range(n_days):
+            reserve = np.clip(reserve + precipitation[:, day] - et0[:, day], 0.0, capacity)
+            if day >= start:
+                history[:, day - start] = reserve
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return history / capacity[:, None]
+
+    @instrumented('risk.risk_table')
+    def risk_table(self):
+        """Table de risque classée, une ligne par parcelle (mémorisée par version des données).
+
+        Colonnes : rang et score_risque (moyenne de la probabilité de stress
+        au seuil de référence, de cette probabilité sur la fenêtre du score et
+        du déficit hydrique moyen sur cette fenêtre), p_stress_<seuil> pour
+        chaque seuil, stress_moyen_<n>j et p_stress_<n>j sur les derniers
+        relevés, capacite_retention_eau, reserve_utile_mm, reserve_relative
+        (dernier jour), precipitation_<n>j et deficit_hydrique_<n>j.
+        """
+        with self._lock:
+            # Version lue avant le calcul : des données modifiées entre-temps invalident la table
+            version = self.data_manager.data_version
+            if self._table is None or self.version != version:
+                self._table = self._compute_table()
+                self.version = version
+            return self._table
+
+    def _compute_table(self):
+        """Calcule la table de risque de toutes les parcelles (voir risk_table)."""
+        monitoring = self.data_manager.monitoring_data
+        parcelles = monitoring['parcelle_id'].astype('category')
+        parcelle_ids = parcelles.cat.categories.astype(str)
+        codes = parcelles.cat.codes.to_numpy().astype(np.intp)
+        present = np.bincount(codes, minlength=len(parcelle_ids)) > 0
+        stress = monitoring['stress_hydrique'].to_numpy()
+        dates = monitoring['date'].to_numpy()
+        table = pd.DataFrame({'parcelle_id': parcelle_ids})
+
+        with stage('risk.exceedance', rows=len(monitoring)):
+            probabilities = exceedance_probabilities(codes, len(parcelle_ids), stress, self.thresholds)
+            for position, threshold in enumerate(self.thresholds):
+                table[f"p_stress_{threshold:g}"] = probabilities[:, position]
+            reference = exceedance_probabilities(codes, len(parcelle_ids), stress, [self.reference_threshold])[:, 0]
+
+        with stage('risk.rolling', rows=len(monitoring)):
+            # Fenêtres mesurées depuis le dernier relevé de chaque parcelle
+            last = np.full(len(parcelle_ids), np.datetime64('NaT'), dtype=dates.dtype)
+            last_values = pd.Series(dates).groupby(codes).max()
+            last[last_values.index.to_numpy()] = last_values.to_numpy()
+            age = last[codes] - dates
+            for window in self.windows:
+                recent = (age < np.timedelta64(window, 'D')) & ~np.isnan(stress)
+                counts = np.bincount(codes[recent], minlength=len(parcelle_ids))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    table[f"stress_moyen_{window}j"] = np.bincount(
+                        codes[recent], stress[recent], minlength=len(parcelle_ids)) / counts
+                    table[f"p_stress_{window}j"] = np.bincount(
+                        codes[recent], stress[recent] > self.reference_threshold,
+                        minlength=len(parcelle_ids)) / counts
+
+        with stage('risk.water_balance', rows=len(parcelle_ids)):
+            soil = self.data_manager.soil_data
+            retention = pd.Series(soil['capacite_retention_eau'].to_numpy(np.float64),
+                                  index=soil['parcelle_id'].astype(str))
+            retention = retention[~retention.index.duplicated()].reindex(parcelle_ids).to_numpy()
+            capacity = retention * self.max_reserve_mm
+            days, precipitation, et0 = self._parcel_weather(parcelle_ids)
+            precipitation = np.broadcast_to(precipitation, (len(parcelle_ids), len(days)))
+            et0 = np.broadcast_to(et0, (len(parcelle_ids), len(days)))
+            relative = self._water_balance(capacity, precipitation, et0, max(self.windows))
+
+            table['capacite_retention_eau'] = retention
+            table['reserve_utile_mm'] = capacity
+            table['reserve_relative'] = relative[:, -1]
+            for window in self.windows:
+                table[f"precipitation_{window}j"] = precipitation[:, -window:].sum(axis=1)
+                table[f"deficit_hydrique_{window}j"] = 1 - relative[:, -window:].mean(axis=1)
+
+        window = self.score_window
+        components = np.column_stack([reference, table[f"p_stress_{window}j"],
+                                      table[f"deficit_hydrique_{window}j"]])
+        known = ~np.isnan(components)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            score = np.where(known, components, 0.0).sum(axis=1) / known.sum(axis=1)
+        table.insert(1, 'score_risque', score)
+        table = table[present]
+        table.insert(1, 'rang', table['score_risque'].rank(ascending=False, method='min').astype('Int64'))
+        table = table.sort_values(['rang', 'parcelle_id'], ignore_index=True)
+        table.attrs['thresholds'] = self.thresholds
+        table.attrs['windows'] = self.windows
+
+        return table
+
+    def parcelle_risk(self, parcelle_id):
+        """Ligne de la table de risque d'une parcelle, sous forme de dictionnaire (vide si inconnue)."""
+        table = self.risk_table()
+        rows = table[table['parcelle_id'] == str(parcelle_id)]
+        return rows.iloc[0].to_dict() if len(rows) else {}
+
+    def water_balance(self, parcelle_id):
+        """Bilan hydrique journalier d'une parcelle : précipitations, ET0, réserve (mm) et réserve relative."""
+        soil = self.data_manager.soil_data
+        retention = soil.loc[soil['parcelle_id'].astype(str) == str(parcelle_id), 'capacite_retention_eau']
+        if retention.empty:
+            raise KeyError(f"Parcelle inconnue dans les données des sols : {parcelle_id}")
+        capacity = np.array([float(retention.iloc[0]) * self.max_reserve_mm])
+        days, precipitation, et0 = self._parcel_weather(pd.Index([str(parcelle_id)]))
+        relative = self._water_balance(capacity, precipitation, et0, len(days))[0]
+        return pd.DataFrame({
+            'date': days,
+            'precipitation': precipitation[0],
+            'et0': et0[0],
+            'reserve_mm': relative * capacity[0],
+            'reserve_relative': relative,
+        })
@@ -0,0 +1,462 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented, stage
+from weather_aggregator import DAILY_COLUMNS
+
+# Scénarios prédéfinis : perturbations (variable, mois concernés, facteur, décalage)
+SCENARIO_PRESETS = {
+    'reference': [],
+    'printemps_sec': [
+        ('precipitation', (3, 4, 5), 0.3, 0.0),
+        ('humidite', (3, 4, 5), 0.85, 0.0),
+    ],
+    'canicule': [
+        ('temperature', (6, 7, 8), 1.0, 5.0),
+        ('temperature_min', (6, 7, 8), 1.0, 4.0),
+        ('temperature_max', (6, 7, 8), 1.0, 6.0),
+        ('humidite', (6, 7, 8), 0.8, 0.0),
+        ('precipitation', (6, 7, 8), 0.5, 0.0),
+    ],
+    'automne_humide': [
+        ('precipitation', (9, 10, 11), 1.8, 0.0),
+        ('rayonnement_solaire', (9, 10, 11), 0.85, 0.0),
+    ],
+}
+
+# Quantiles de rendement retournés par défaut
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Bornes physiques des variables après perturbation
+VALUE_BOUNDS = {
+    'precipitation': (0.0, None),
+    'humidite': (0.0, 100.0),
+    'rayonnement_solaire': (0.0, None),
+    'vitesse_vent': (0.0, None),
+    'vitesse_vent_max': (0.0, None),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def seasonal_block_bootstrap(day_of_year, valid, target_day_of_year, n_scenarios, block_days, window, rng):
+    """Tire des trajectoires par blocs de jours consécutifs pris à la même saison.
+
+    `day_of_year` (D,) donne le jour de l'année de chaque jour historique et
+    `valid` (D,) les jours sans valeur manquante. Pour chaque bloc de
+    `block_days` jours de l'horizon (`target_day_of_year`, H,), le premier jour
+    est tiré uniformément parmi les blocs historiques complets qui commencent à
+    moins de `window` jours (dans l'année) du début du bloc cible ; sans bloc
+    complet à cette saison, tous les blocs complets sont candidats et un
+    avertissement est émis. Retourne les jours historiques sources
+    (n_scenarios x H, int32).
+    """
+    n_starts = len(day_of_year) - block_days + 1
+    if n_starts <= 0:
+        raise ValueError(f"Historique météo trop court pour des blocs de {block_days} jours.")
+    missing = np.concatenate([[0], np.cumsum(~valid)])
+    complete = missing[block_days:] - missing[:n_starts] == 0
+    start_day_of_year = day_of_year[:n_starts]
+    offsets = np.arange(block_days, dtype=np.int32)
+
+    horizon = len(target_day_of_year)
+    source = np.empty((n_scenarios, horizon), dtype=np.int32)
+    out_of_season = []
+    for begin in range(0, horizon, block_days):
+        gap = np.abs(start_day_of_year - target_day_of_year[begin])
+        gap = np.minimum(gap, 366 - gap)
+        candidates = np.flatnonzero(complete & (gap <= window))
+        if len(candidates) == 0:
+            # Saison absente de l'historique : on se rabat sur tous les blocs complets
+            out_of_season.append(int(target_day_of_year[begin]))
+            candidates = np.flatnonzero(complete)
+        if len(candidates) == 0:
+            raise ValueError("Aucun bloc météo historique complet pour le tirage des scénarios.")
+        length = min(block_days, horizon - begin)
+        picks = candidates[rng.integers(len(candidates), size=n_scenarios)].astype(np.int32)
+        source[:, begin:begin + length] = picks[:, None] + offsets[:length]
+    if out_of_season:
+        logger.warning("Aucun bloc météo complet à moins de %d jours de la saison pour %d bloc(s) de l'horizon "
+                       "(jours de l'année %s) : tirés toutes saisons confondues.",
+                       window, len(out_of_season), out_of_season[:10])
+    return source
+
+
+def unique_states(positions, source):
+    """Dédoublonne les couples (jour de l'horizon, jour historique) tirés.
+
+    `positions` (k,) sont des jours de l'horizon et `source` (n x k) les jours
+    historiques tirés à ces positions. Retourne les positions et jours sources
+    distincts (u,) et l'indice (n x k, int32) de chaque tirage parmi eux.
+    """
+    n_days = int(source.max()) + 1
+    codes = positions.astype(np.int64)[None, :] * n_days + source
+    unique, inverse = np.unique(codes, return_inverse=True)
+    return unique // n_days, unique % n_days, inverse.reshape(source.shape).astype(np.int32)
+
+
+class WeatherScenarios:
+    def __init__(self, dates, variables, history, stations, source, perturbations=(),
+                 precipitation_factor=1.0, gdd_base=10.0, parcelle_ids=None, weights=None):
+        """Trajectoires météo simulées, gardées sous forme compacte.
+
+        `source` (n_scenarios x jours, int32) donne pour chaque jour de
+        l'horizon `dates` le jour historique tiré, et `history` (stations x
+        jours historiques x variables, float32) la météo journalière des
+        `stations` (une seule série sans stations). Les `perturbations` du
+        scénario et le `precipitation_factor` sont appliqués à la lecture, si
+        bien que deux tirages identiques donnent la même météo. `weights`
+        (parcelles x stations) donne les poids des stations des `parcelle_ids`.
+        """
+        self.dates = dates
+        self.variables = list(variables)
+        self.history = history
+        self.stations = stations
+        self.source = source
+        self.perturbations = list(perturbations)
+        self.precipitation_factor = precipitation_factor
+        self.gdd_base = gdd_base
+        self.parcelle_ids = parcelle_ids
+        self.weights = weights
+
+    @property
+    def n_scenarios(self):
+        return self.source.shape[0]
+
+    def station_weather(self, weights=None):
+        """Météo historique (jours x variables) pondérée par `weights` (une valeur par station).
+
+        Sans poids, les stations sont moyennées ; les valeurs manquantes sont
+        exclues et les poids renormalisés.
+        """
+        if weights is None:
+            weights = np.ones(self.history.shape[0])
+        weights = np.asarray(weights, dtype=np.float64)
+        valid = ~np.isnan(self.history)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weighted = (np.tensordot(weights, np.where(valid, self.history, 0.0), axes=1)
+                        / np.tensordot(weights, valid, axes=1))
+        return weighted.astype(np.float32)
+
+    def values(self, positions, source_days, history):
+        """Météo perturbée (k x variables, float32) des jours `positions` de l'horizon.
+
+        Chaque ligne reprend le jour historique `source_days` de `history`
+        (jours x variables), puis les perturbations du mois cible sont
+        appliquées ; les degrés-jours sont recalculés si les températures
+        extrêmes ont changé.
+        """
+        values = history[source_days].astype(np.float32, copy=True)
+        months = self.dates.month.to_numpy()[positions]
+        columns = {name: index for index, name in enumerate(self.variables)}
+        changed = set()
+        for variable, month_set, factor, shift in self.perturbations:
+            if variable not in columns:
+                continue
+            rows = np.isin(months, month_set)
+            column = columns[variable]
+            values[rows, column] = values[rows, column] * np.float32(factor) + np.float32(shift)
+            changed.add(variable)
+
+        if 'precipitation' in columns and self.precipitation_factor != 1.0:
+            values[:, columns['precipitation']] *= np.float32(self.precipitation_factor)
+        for variable, (low, high) in VALUE_BOUNDS.items():
+            if variable in columns:
+                np.clip(values[:, columns[variable]], low, high, out=values[:, columns[variable]])
+        if {'gdd', 'temperature_min', 'temperature_max'} <= columns.keys() and \
+                changed & {'temperature_min', 'temperature_max'}:
+            mean = (values[:, columns['temperature_min']] + values[:, columns['temperature_max']]) / 2
+            values[:, columns['gdd']] = np.maximum(mean - np.float32(self.gdd_base), 0)
+        return values
+
+    def matrix(self, weights=None):
+        """Trajectoires complètes (n_scenarios x jours x variables, float32)."""
+        history = self.station_weather(weights)
+        positions = np.broadcast_to(np.arange(len(self.dates)), self.source.shape).ravel()
+        values = self.values(positions, self.source.ravel(), history)
+        return values.reshape(*self.source.shape, len(self.variables))
+
+    def totals(self, variable='precipitation', weights=None):
+        """Cumul de `variable` sur l'horizon, par scénario (float32).
+
+        Seuls les couples (jour de l'horizon, jour historique) distincts sont
+        perturbés, puis redistribués aux scénarios.
+        """
+        column = self.variables.index(variable)
+        positions, source_days, inverse = unique_states(np.arange(len(self.dates)), self.source)
+        values = self.values(positions, source_days, self.station_weather(weights))[:, column]
+        return values[inverse].sum(axis=1, dtype=np.float64).astype(np.float32)
+
+    def parcel_totals(self, variable='precipitation'):
+        """Cumul de `variable` sur l'horizon pour chaque parcelle (parcelles x scénarios, float32).
+
+        La météo de chaque parcelle est pondérée par les poids de ses stations
+        (`weights`) ; les parcelles aux mêmes poids ne sont calculées qu'une fois.
+        """
+        weights = np.ones((1, self.history.shape[0])) if self.weights is None else self.weights
+        column = self.variables.index(variable)
+        positions, source_days, inverse = unique_states(np.arange(len(self.dates)), self.source)
+        rows, groups = np.unique(weights, axis=0, return_inverse=True)
+        totals = np.empty((len(rows), self.n_scenarios), dtype=np.float32)
+        for index, row in enumerate(rows):
+            values = self.values(positions, source_days, self.station_weather(row))[:, column]
+            totals[index] = values[inverse].sum(axis=1, dtype=np.float64)
+        return totals[groups.ravel()]
+
+
+class AgriculturalScenarioEngine:
+    def __init__(self, analyzer, block_days=7, season_window=15, step_days=7, n_jobs=-1, random_state=42):
+        """Initialise le simulateur de rendements sous scénarios météo (Monte-Carlo).
+
+        Les trajectoires sont tirées par bootstrap de blocs de `block_days`
+        jours pris à moins de `season_window` jours de la même date dans
+        l'historique journalier, puis perturbées selon le scénario. Le modèle
+        de rendement de chaque parcelle (celui de `analyzer.predict_yield`) est
+        évalué tous les `step_days` jours de l'horizon, en une seule
+        prédiction par parcelle sur les états météo distincts ; les parcelles
+        sont réparties sur `n_jobs` threads.
+        """
+        self.analyzer = analyzer
+        self.data_manager = analyzer.data_manager
+        self.block_days = block_days
+        self.season_window = season_window
+        self.step_days = step_days
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.version = None
+        self._history = None
+
+    def _weather_history(self):
+        """Météo journalière historique : jours (D,), variables, tableau (stations x D x variables, float32)
+        et identifiants des stations (None sans stations). Mémorisée par version des données."""
+        if self._history is not None and self.version == self.data_manager.data_version:
+            return self._history
+
+        weather = self.data_manager.weather_data
+        if weather is None:
+            raise ValueError("Les données n'ont pas été chargées. Utilisez load_data() d'abord.")
+        if 'nb_mesures' not in weather.columns:
+            raise ValueError("Les scénarios se construisent sur la météo journalière : "
+                             "chargez les données avec weather_grain='daily'.")
+
+        variables = [col for col in DAILY_COLUMNS if col in weather.columns]
+        days = pd.date_range(weather['date'].min().floor('D'), weather['date'].max().floor('D'), freq='D')
+        day_index = days.get_indexer(weather['date'].dt.floor('D'))
+        stations = None
+        station_codes = np.zeros(len(weather), dtype=np.intp)
+        if self.data_manager.station_index is not None and 'station_id' in weather.columns:
+            stations = pd.Index(weather['station_id'].astype(str).unique())
+            station_codes = stations.get_indexer(weather['station_id'].astype(str))
+
+        history = np.full((1 if stations is None else len(stations), len(days), len(variables)), np.nan,
+                          dtype=np.float32)
+        history[station_codes, day_index] = weather[variables].to_numpy(np.float32)
+
+        self._history = days, variables, history, stations
+        self.version = self.data_manager.data_version
+        return self._history
+
+    def _station_weights(self, parcelle_ids, stations):
+        """Poids des stations de chaque parcelle (P x stations) ; un poids unique sans stations."""
+        if stations is None:
+            return np.ones((len(parcelle_ids), 1))
+        dm = self.data_manager
+        assignments = dm.station_index.assign_parcelles(dm.soil_data, dm.station_neighbors, dm.idw_power)
+        rows = pd.Index(parcelle_ids).get_indexer(assignments['parcelle_id'])
+        cols = stations.get_indexer(assignments['station_id'])
+        known = (rows >= 0) & (cols >= 0)
+        weights = np.zeros((len(parcelle_ids), len(stations)))
+        np.add.at(weights, (rows[known], cols[known]), assignments['poids'].to_numpy()[known])
+        return weights
+
+    def _target_scaling(self):
+        """Moyenne et écart-type de normalisation du rendement, pour revenir en t/ha."""
+        scaler = self.data_manager.scaler
+        names = list(getattr(scaler, 'feature_names_in_', []))
+        if 'rendement' not in names:
+            return 0.0, 1.0
+        index = names.index('rendement')
+        return float(scaler.mean_[index]), float(scaler.scale_[index])
+
+    @staticmethod
+    def _valid_days(history, weights):
+        """Jours historiques où la météo pondérée de chaque parcelle est complète.
+
+        Une variable manque pour une parcelle seulement si toutes ses stations
+        (de poids non nul) la manquent ce jour-là, comme dans station_weather.
+        Le calcul porte sur chaque ensemble de stations distinct (jours x
+        variables), et non sur chaque parcelle.
+        """
+        valid = np.ones(history.shape[1], dtype=bool)
+        for stations in np.unique(weights > 0, axis=0):
+            valid &= ~np.isnan(history[stations]).all(axis=0).any(axis=1)
+        return valid
+
+    @instrumented('scenarios.generate')
+    def generate(self, n_scenarios=1000, start=None, days=182, scenario='reference', perturbations=(),
+                 precipitation_percentile=None, random_state=None, parcelle_ids=None):
+        """Génère `n_scenarios` trajectoires météo de `days` jours à partir de `start`.
+
+        Les jours tirés sont communs à toutes les `parcelle_ids` (toutes par
+        défaut), et complets pour la météo pondérée de chacune.
+        `start` vaut par défaut le lendemain du dernier jour de météo.
+        `scenario` est un nom de SCENARIO_PRESETS, complété par des
+        `perturbations` (variable, mois, facteur, décalage). Avec
+        `precipitation_percentile` (0-100), les précipitations sont mises à
+        l'échelle pour que le cumul médian des scénarios égale ce centile des
+        cumuls tirés (cumuls pondérés de chaque parcelle, moyennés sur les
+        parcelles). Retourne un WeatherScenarios.
+        """
+        if scenario not in SCENARIO_PRESETS:
+            raise ValueError(f"Scénario inconnu : {scenario} (disponibles : {', '.join(SCENARIO_PRESETS)}).")
+        history_days, variables, history, stations = self._weather_history()
+        parcelle_ids = [str(pid) for pid in (self.data_manager.feature_store.parcelles
+                                             if parcelle_ids is None else parcelle_ids)]
+        weights = self._station_weights(parcelle_ids, stations)
+        start = history_days[-1] + pd.Timedelta(days=1) if start is None else pd.Timestamp(start).floor('D')
+        dates = pd.date_range(start, periods=days, freq='D')
+        rng = np.random.default_rng(self.random_state if random_state is None else random_state)
+
+        with stage('scenarios.block_bootstrap', rows=n_scenarios):
+            valid = self._valid_days(history, weights)
+            source = seasonal_block_bootstrap(history_days.dayofyear.to_numpy(), valid, dates.dayofyear.to_numpy(),
+                                              n_scenarios, self.block_days, self.season_window, rng)
+
+        scenarios = WeatherScenarios(dates, variables, history, stations, source,
+                                     SCENARIO_PRESETS[scenario] + list(perturbations),
+                                     gdd_base=self.data_manager.weather_aggregator.gdd_base,
+                                     parcelle_ids=parcelle_ids, weights=weights)
+        if precipitation_percentile is not None and 'precipitation' in variables and parcelle_ids:
+            totals = scenarios.parcel_totals('precipitation').mean(axis=0)
+            median = float(np.median(totals))
+            if median > 0:
+                scenarios.precipitation_factor = float(np.percentile(totals, precipitation_percentile)) / median
+        return scenarios
+
+    def _seasonal_profile(self, features, columns, step_dates):
+        """Caractéristiques hors météo (normalisées) d'une parcelle à chaque pas de l'horizon.
+
+        Moyenne des observations prises à moins de `season_window` jours de la
+        même date (dans l'année), ou de toutes les observations à défaut.
+        """
+        values = features[columns].to_numpy(np.float64)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        gap = np.abs(step_dates.dayofyear.to_numpy()[:, None] - features['date'].dt.dayofyear.to_numpy()[None, :])
+        near = (np.minimum(gap, 366 - gap) <= self.season_window).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            profile = (near @ filled) / (near @ valid)
+            overall = filled.sum(axis=0) / valid.sum(axis=0)
+        return np.where(np.isnan(profile), overall, profile).astype(np.float32)
+
+    def _simulate_parcelle(self, parcelle_id, scenarios, weights, steps):
+        """Rendement simulé (t/ha, float32) de chaque scénario pour une parcelle."""
+        features = self.data_manager.get_features(parcelle_id)
+        X, _ = self.analyzer.model_registry.split_target(features)
+        weather_cols = [col for col in X.columns if col in scenarios.variables]
+        other_cols = [col for col in X.columns if col not in scenarios.variables]
+
+        # Une ligne par état météo distinct (pas de l'horizon, jour historique)
+        positions, source_days, inverse = unique_states(steps, scenarios.source[:, steps])
+        weather = scenarios.values(positions, source_days, scenarios.station_weather(weights))
+        # Normalisation en float64 : le registre retrouve exactement les valeurs brutes float32
+        weather = weather[:, [scenarios.variables.index(col) for col in weather_cols]].astype(np.float64)
+        scaler = self.data_manager.scaler
+        names = list(getattr(scaler, 'feature_names_in_', []))
+        for position, col in enumerate(weather_cols):
+            if col in names:
+                index = names.index(col)
+                weather[:, position] = (weather[:, position] - scaler.mean_[index]) / scaler.scale_[index]
+
+        profile = self._seasonal_profile(features, other_cols, scenarios.dates[steps])
+        step_rows = np.searchsorted(steps, positions)
+        X_states = pd.concat([pd.DataFrame(profile[step_rows], columns=other_cols),
+                              pd.DataFrame(weather, columns=weather_cols)], axis=1)[list(X.columns)]
+
+        predictions = np.asarray(self.analyzer.predict_yield(parcelle_id, X_states), dtype=np.float32)
+        mean, scale = self._target_scaling()
+        predictions = predictions * np.float32(scale) + np.float32(mean)
+        # Rendement d'un scénario : moyenne des prédictions aux pas de l'horizon
+        return predictions[inverse].mean(axis=1)
+
+    @instrumented('scenarios.simulate')
+    def simulate(self, parcelle_ids=None, n_scenarios=10_000, scenario='reference', target=None,
+                 quantiles=DEFAULT_QUANTILES, **options):
+        """Distribution des rendements de chaque parcelle sous un scénario météo.
+
+        `options` sont transmises à generate() (start, days, perturbations,
+        precipitation_percentile, random_state) ; à graine égale, deux
+        scénarios partagent les mêmes tirages, ce qui rend leurs écarts
+        directement comparables. `target` (t/ha, valeur unique ou dictionnaire
+        par parcelle) vaut par défaut le rendement moyen observé de la parcelle.
+
+        Retourne un DataFrame, une ligne par parcelle : rendement_moyen,
+        rendement_q<centile> pour chaque quantile, objectif et p_sous_objectif
+        (part des scénarios sous l'objectif). Les rendements simulés et les
+        cumuls de précipitations de chaque parcelle (parcelles x scénarios,
+        float32) sont dans attrs['rendements'] et attrs['precipitation_totale'].
+        """
+        parcelle_ids = [str(pid) for pid in (self.data_manager.feature_store.parcelles
+                                             if parcelle_ids is None else parcelle_ids)]
+        scenarios = self.generate(n_scenarios, scenario=scenario, parcelle_ids=parcelle_ids, **options)
+        steps = np.arange(0, len(scenarios.dates), self.step_days)
+        weights = scenarios.weights
+
+        from joblib import Parallel, delayed
+
+        self.analyzer.model_registry.train(parcelle_ids)
+        with stage('scenarios.predict', rows=len(parcelle_ids) * n_scenarios):
+            # Les arbres de scikit-learn libèrent le GIL : des threads suffisent et évitent de copier les modèles
+            yields = Parallel(n_jobs=self.n_jobs, prefer='threads')(
+                delayed(self._simulate_parcelle)(pid, scenarios, weights[row], steps)
+                for row, pid in enumerate(parcelle_ids))
+        yields = np.vstack(yields) if yields else np.empty((0, n_scenarios), dtype=np.float32)
+
+        if target is None:
+            monitoring = self.data_manager.monitoring_data
+            observed = monitoring.groupby(monitoring['parcelle_id'].astype(str), observed=True)['rendement'].mean()
+            targets = observed.reindex(parcelle_ids).to_numpy(np.float64)
+        elif isinstance(target, dict):
+            targets = np.array([target.get(pid, np.nan) for pid in parcelle_ids], dtype=np.float64)
+        else:
+            targets = np.full(len(parcelle_ids), float(target))
+
+        table = pd.DataFrame({'parcelle_id': parcelle_ids, 'rendement_moyen': yields.mean(axis=1)})
+        levels = np.quantile(yields, quantiles, axis=1) if len(parcelle_ids) else np.empty((len(quantiles), 0))
+        for quantile, values in zip(quantiles, levels):
+            table[f"rendement_q{round(quantile * 100):02d}"] = values
+        table['objectif'] = targets
+        table['p_sous_objectif'] = np.where(np.isnan(targets), np.nan, (yields < targets[:, None]).mean(axis=1))
+
+        precipitation = (scenarios.parcel_totals('precipitation') if 'precipitation' in scenarios.variables
+                         else np.empty((len(parcelle_ids), 0), dtype=np.float32))
+        table.attrs['scenario'] = scenario
+        table.attrs['n_scenarios'] = n_scenarios
+        table.attrs['horizon'] = (scenarios.dates[0], scenarios.dates[-1])
+        table.attrs['facteur_precipitation'] = scenarios.precipitation_factor
+        table.attrs['precipitation_totale'] = precipitation
+        table.attrs['rendements'] = yields
+        logger.info("Scénario %s : %d trajectoires simulées pour %d parcelles", scenario, n_scenarios,
+                    len(parcelle_ids))
+        return table
+
+
+# Test de la classe AgriculturalScenarioEngine
+if __name__ == "__main__":
+    from analyzer import AgriculturalAnalyzer
+    from data_manager import AgriculturalDataManager
+    from instrumentation import configure_logging
+
+    configure_logging()
+
+    data_manager = AgriculturalDataManager()
+    data_manager.load_data()
+    engine = AgriculturalScenarioEngine(AgriculturalAnalyzer(data_manager))
+
+    for name in SCENARIO_PRESETS:
+        table = engine.simulate(n_scenarios=2000, scenario=name)
+        print(f"Scénario {name} :")
+        print(table.head().to_string(index=False))
+    print(engine.simulate(n_scenarios=2000, precipitation_percentile=10).head().to_string(index=False))
@@ -0,0 +1,83 @@
+import hashlib
+import math
+import os
+
+import numpy as np
+
+from map_visualization import AgriculturalMap, COLOR_SCALES
+
+# Couleur des marqueurs lorsque les parcelles ne sont pas colorées par un indicateur
+DEFAULT_MARKER_COLOR = '#2a81cb'
+
+
+class StaticMapRenderer:
+    def __init__(self, data_manager, cache_dir=None, figsize=(8, 6), dpi=150):
+        """Initialise le rendu statique (PNG) de la carte des parcelles, sans navigateur.
+
+        Les images sont dessinées avec matplotlib à partir des mêmes agrégats par
+        parcelle que AgriculturalMap et mises en cache dans `cache_dir` (par
+        défaut `<cache>/cartes`) selon l'ensemble de parcelles, l'indicateur de
+        couleur et la version des données.
+        """
+        self.data_manager = data_manager
+        self.cache_dir = cache_dir or os.path.join(data_manager.cache.cache_dir, 'cartes')
+        self.figsize = figsize
+        self.dpi = dpi
+        self.map = AgriculturalMap(data_manager)
+
+    def _cache_path(self, parcelle_ids, color_by):
+        # La clé ne dépend que de la demande : un succès de cache n'a pas à calculer les agrégats
+        parcelles = None if parcelle_ids is None else sorted({str(p) for p in parcelle_ids})
+        key = repr((self.data_manager.data_version, parcelles, color_by, self.figsize, self.dpi))
+        return os.path.join(self.cache_dir, f"carte_{hashlib.sha256(key.encode()).hexdigest()[:16]}.png")
+
+    def render(self, parcelle_ids=None, color_by=None):
+        """Dessine la carte des parcelles (toutes par défaut) et retourne le chemin du PNG.
+
+        `color_by` reprend les indicateurs de AgriculturalMap ('ndvi',
+        'rendement' ou 'risque') ; sans indicateur, les parcelles ont une couleur
+        unique. L'image n'est redessinée que si elle n'est pas déjà en cache.
+        """
+        if color_by is not None and color_by not in COLOR_SCALES:
+            raise ValueError(f"Indicateur de couleur inconnu : {color_by}")
+
+        path = self._cache_path(parcelle_ids, color_by)
+        if os.path.exists(path):
+            return path
+
+        summary = self.map.parcel_summary()
+        if parcelle_ids is not None:
+            summary = summary[summary['parcelle_id'].isin([str(p) for p in parcelle_ids])]
+
+        # matplotlib n'est importé que si l'image doit être dessinée
+        from matplotlib.colors import LinearSegmentedColormap
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=self.figsize)
+        ax = fig.subplots()
+        if color_by is None:
+            ax.scatter(summary['longitude'], summary['latitude'], s=60, c=DEFAULT_MARKER_COLOR,
+                       edgecolors='#333333', linewidths=0.5, zorder=2)
+        else:
+            caption, colors = COLOR_SCALES[color_by]
+            points = ax.scatter(summary['longitude'], summary['latitude'], s=60, c=summary[color_by],
+                                cmap=LinearSegmentedColormap.from_list(color_by, colors),
+                                edgecolors='#333333', linewidths=0.5, zorder=2)
+            fig.colorbar(points, ax=ax, label=caption)
+
+        for parcelle_id, lon, lat in summary[['parcelle_id', 'longitude', 'latitude']].itertuples(index=False):
+            ax.annotate(parcelle_id, (lon, lat), xytext=(4, 4), textcoords='offset points', fontsize=6)
+
+        # Correction de l'aspect pour que les distances est-ouest et nord-sud soient comparables
+        if not summary.empty:
+            ax.set_aspect(1 / max(math.cos(math.radians(np.mean(summary['latitude']))), 1e-6))
+        ax.set_xlabel("Longitude")
+        ax.set_ylabel("Latitude")
+        ax.set_title("Carte des parcelles")
+        ax.grid(True, linestyle=':', linewidth=0.5, zorder=1)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.png"
+        fig.savefig(tmp_path, dpi=self.dpi, bbox_inches='tight')
+        os.replace(tmp_path, path)
+        return path
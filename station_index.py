@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class WeatherStationIndex:
+    def __init__(self, stations):
+        """Indexe les coordonnées des stations météo dans un BallTree (distance haversine).
+
+        `stations` contient les colonnes station_id, latitude et longitude.
+        """
+        from sklearn.neighbors import BallTree
+
+        self.stations = stations.reset_index(drop=True)
+        self.station_ids = self.stations['station_id'].astype(str).to_numpy()
+        coords = np.radians(self.stations[['latitude', 'longitude']].to_numpy(dtype=np.float64))
+        self.tree = BallTree(coords, metric='haversine')
+        self._assignments = {}  # (k, idw_power, parcelles) -> affectations mémorisées
+
+    def nearest(self, latitudes, longitudes, k=1):
+        """Retourne les distances (km) et les positions des `k` stations les plus proches."""
+        k = min(k, len(self.station_ids))
+        coords = np.radians(np.column_stack([latitudes, longitudes]).astype(np.float64))
+        distances, positions = self.tree.query(coords, k=k)
+        return distances * EARTH_RADIUS_KM, positions
+
+    def assign_parcelles(self, soil_data, k=1, idw_power=2.0):
+        """Associe chaque parcelle à ses `k` stations les plus proches avec un poids.
+
+        Les poids sont proportionnels à 1 / distance**idw_power (pondération par
+        l'inverse de la distance) et normalisés par parcelle ; avec
+        `idw_power=None`, les stations ont le même poids. Le résultat est
+        mémorisé pour les appels suivants.
+        """
+        key = (k, idw_power, tuple(soil_data['parcelle_id'].astype(str)))
+        if key in self._assignments:
+            return self._assignments[key]
+
+        distances, positions = self.nearest(soil_data['latitude'], soil_data['longitude'], k)
+        if idw_power is None:
+            weights = np.ones_like(distances)
+        else:
+            # Une station sur la parcelle elle-même ne doit pas produire un poids infini
+            weights = 1.0 / np.maximum(distances, 1e-3) ** idw_power
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        n_neighbors = distances.shape[1]
+        assignments = pd.DataFrame({
+            'parcelle_id': np.repeat(soil_data['parcelle_id'].astype(str).to_numpy(), n_neighbors),
+            'rang': np.tile(np.arange(n_neighbors), len(soil_data)),
+            'station_id': self.station_ids[positions.ravel()],
+            'distance_km': distances.ravel(),
+            'poids': weights.ravel(),
+        })
+        self._assignments[key] = assignments
+        return assignments
+
+
+def spatial_weather_join(monitoring, weather, assignments):
+    """Associe à chaque relevé de monitoring la météo pondérée de ses stations voisines.
+
+    Pour chaque ligne de `monitoring`, la météo la plus récente de chacune des
+    stations affectées à la parcelle est trouvée par merge_asof(by='station_id'),
+    puis les valeurs sont moyennées avec les poids des stations (les valeurs
+    manquantes sont exclues et les poids renormalisés).
+    """
+    n_neighbors = int(assignments['rang'].max()) + 1
+    station_codes = pd.Index(assignments['station_id'].unique())
+
+    left = monitoring[['parcelle_id', 'date']].assign(
+        ligne=np.arange(len(monitoring)),
+        parcelle_id=monitoring['parcelle_id'].astype(str),
+    )
+    left = left.merge(assignments[['parcelle_id', 'rang', 'station_id', 'distance_km', 'poids']],
+                      on='parcelle_id')
+    if len(left) != len(monitoring) * n_neighbors:
+        raise ValueError("Certaines parcelles du monitoring n'ont pas de station affectée.")
+    left['station_code'] = station_codes.get_indexer(left['station_id'])
+
+    right = weather[weather['station_id'].astype(str).isin(station_codes)]
+    right = right.assign(station_code=station_codes.get_indexer(right['station_id'].astype(str)))
+    value_cols = right.select_dtypes(include=[np.number]).columns.drop('station_code')
+
+    joined = pd.merge_asof(
+        left.sort_values('date'),
+        right[['date', 'station_code'] + list(value_cols)].sort_values('date'),
+        on='date',
+        by='station_code',
+    ).sort_values(['ligne', 'rang'])
+
+    # Chaque ligne possède exactement n_neighbors voisins : moyenne pondérée vectorisée
+    values = joined[value_cols].to_numpy(dtype=np.float64).reshape(len(monitoring), n_neighbors, -1)
+    weights = joined['poids'].to_numpy(dtype=np.float64).reshape(len(monitoring), n_neighbors, 1)
+    valid = ~np.isnan(values)
+    weight_sum = np.where(valid, weights, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted = np.where(valid, values * weights, 0.0).sum(axis=1) / weight_sum
+
+    result = monitoring.reset_index(drop=True).copy()
+    weighted = pd.DataFrame(weighted, columns=value_cols)
+    result[value_cols] = weighted.astype(right[value_cols].dtypes.to_dict())
+    nearest = joined[joined['rang'] == 0]
+    result['station_id'] = nearest['station_id'].to_numpy()
+    result['distance_station_km'] = nearest['distance_km'].to_numpy()
+    return result
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+# Les modules du projet sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzer import grouped_correlations  # noqa: E402
+
+
+class GroupedCorrelationsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 300
+        parcelles = np.repeat(['P001', 'P002', 'P003'], n // 3)
+        rendement = rng.normal(10, 2, n)
+        self.data = pd.DataFrame({
+            'parcelle_id': parcelles,
+            'ndvi': 0.05 * rendement + rng.normal(0, 0.1, n),
+            'temperature': rng.normal(20, 5, n),
+            # Constantes par parcelle, non représentables exactement en binaire
+            'latitude': np.select([parcelles == 'P001', parcelles == 'P002'], [33.902364324940045, 0.1], 47.3),
+            'azote': np.where(parcelles == 'P003', rng.normal(50, 5, n), 0.7),
+            'rendement': rendement,
+        })
+        self.data.loc[5, 'ndvi'] = np.nan
+
+    def test_matches_pandas_per_parcel(self):
+        features = ['ndvi', 'temperature', 'latitude', 'azote']
+        codes, parcelles = pd.factorize(self.data['parcelle_id'], sort=True)
+        correlations, counts = grouped_correlations(codes, len(parcelles), self.data[features].to_numpy(),
+                                                    self.data['rendement'].to_numpy())
+
+        for row, parcelle_id in enumerate(parcelles):
+            group = self.data[self.data['parcelle_id'] == parcelle_id]
+            expected = group[features + ['rendement']].corr()['rendement'].drop('rendement')
+            np.testing.assert_allclose(correlations[row], expected.to_numpy(), rtol=1e-10, atol=1e-12)
+            np.testing.assert_array_equal(counts[row], group[features].notna().sum().to_numpy())
+
+        # Colonnes constantes : NaN, et non un bruit d'arrondi
+        self.assertTrue(np.isnan(correlations[:, 2]).all())
+        self.assertTrue(np.isnan(correlations[:2, 3]).all())
+        self.assertFalse(np.isnan(correlations[2, 3]))
+
+
+if __name__ == "__main__":
+    unittest.main()
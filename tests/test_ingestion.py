@@ -0,0 +1,176 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+# Les modules du projet sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_manager import AgriculturalDataManager  # noqa: E402
+from online_scaler import OnlineStandardScaler  # noqa: E402
+
+PARCELLES = ['P001', 'P002', 'P003', 'P004']
+
+
+def write_dataset(data_dir, rng):
+    """Jeu de données réduit : 4 parcelles suivies chaque semaine, météo horaire sur six mois."""
+    hours = pd.date_range('2021-01-01', '2021-06-30 23:00', freq='h')
+    pd.DataFrame({
+        'date': hours,
+        'temperature': 10 + 8 * np.sin(np.arange(len(hours)) * 2 * np.pi / 24) + rng.normal(0, 2, len(hours)),
+        'humidite': rng.uniform(40, 95, len(hours)).round(1),
+        'precipitation': np.where(rng.random(len(hours)) < 0.1, rng.exponential(2.0, len(hours)), 0.0).round(2),
+        'rayonnement_solaire': rng.uniform(0, 800, len(hours)).round(1),
+        'vitesse_vent': rng.uniform(0, 12, len(hours)).round(1),
+        'direction_vent': rng.uniform(0, 360, len(hours)).round(1),
+    }).to_csv(os.path.join(data_dir, 'meteo_detaillee.csv'), index=False)
+
+    soil = pd.DataFrame({
+        'parcelle_id': PARCELLES,
+        'latitude': [45.0, 45.1, 45.2, 45.3],
+        'longitude': [2.0, 2.1, 2.2, 2.3],
+        'type_sol': ['argileux', 'limoneux', 'sableux', 'argileux'],
+        'surface_ha': rng.uniform(2, 20, len(PARCELLES)).round(2),
+        'capacite_retention_eau': rng.uniform(0.3, 0.9, len(PARCELLES)).round(2),
+        'ph': rng.uniform(5.5, 8.0, len(PARCELLES)).round(1),
+    })
+    soil.to_csv(os.path.join(data_dir, 'sols.csv'), index=False)
+
+    days = pd.date_range('2021-01-04', '2021-06-28', freq='7D')
+    monitoring = soil[['parcelle_id', 'latitude', 'longitude']].merge(pd.DataFrame({'date': days}), how='cross')
+    monitoring = monitoring.assign(
+        culture='Ble',
+        ndvi=rng.uniform(0.2, 0.9, len(monitoring)).round(3),
+        stress_hydrique=rng.uniform(0, 1, len(monitoring)).round(3),
+        rendement=rng.uniform(10, 20, len(monitoring)).round(2),
+    )
+    monitoring.to_csv(os.path.join(data_dir, 'monitoring_cultures.csv'), index=False)
+
+    pd.DataFrame({'parcelle_id': PARCELLES, 'date': '2020-07-15', 'culture': 'Ble',
+                  'rendement_estime': 15.0, 'rendement_final': 15.0, 'progression': 1.0}).to_csv(
+        os.path.join(data_dir, 'historique_rendements.csv'), index=False)
+
+
+class OnlineStandardScalerTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = rng.normal(5, 3, (1000, 4))
+        self.X[rng.random(self.X.shape) < 0.05] = np.nan
+
+    def assert_moments_equal(self, scaler, rows):
+        reference = StandardScaler().fit(rows)
+        scaler.refresh()
+        np.testing.assert_array_equal(scaler.n_samples_seen_, reference.n_samples_seen_)
+        np.testing.assert_allclose(scaler.mean_, reference.mean_, rtol=1e-12)
+        np.testing.assert_allclose(scaler.var_, reference.var_, rtol=1e-10)
+        np.testing.assert_allclose(scaler.scale_, reference.scale_, rtol=1e-10)
+
+    def test_partial_fit_matches_a_single_fit(self):
+        scaler = OnlineStandardScaler().fit(self.X[:300]).partial_fit(self.X[300:700]).partial_fit(self.X[700:])
+
+        self.assert_moments_equal(scaler, self.X)
+
+    def test_remove_matches_a_fit_on_the_remaining_rows(self):
+        scaler = OnlineStandardScaler().fit(self.X[:700]).partial_fit(self.X[700:])
+        scaler.remove(self.X[100:200]).remove(self.X[900:])
+
+        self.assert_moments_equal(scaler, np.concatenate([self.X[:100], self.X[200:900]]))
+
+    def test_applied_parameters_wait_for_refresh(self):
+        scaler = OnlineStandardScaler().fit(self.X[:500])
+        mean = scaler.mean_.copy()
+
+        scaler.partial_fit(self.X[500:] + 10)
+
+        np.testing.assert_array_equal(scaler.mean_, mean)
+        self.assertTrue(scaler.needs_refresh())
+
+
+class IncrementalIngestionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.data_dir = os.path.join(cls.tmp.name, 'data')
+        os.makedirs(cls.data_dir)
+        write_dataset(cls.data_dir, np.random.default_rng(1))
+        cls.monitoring = pd.read_csv(os.path.join(cls.data_dir, 'monitoring_cultures.csv'), parse_dates=['date'])
+        cls.weather = pd.read_csv(os.path.join(cls.data_dir, 'meteo_detaillee.csv'), parse_dates=['date'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def partial_manager(self, monitoring_cut, weather_cut, **options):
+        """Gestionnaire chargé avec les relevés antérieurs aux dates de coupure."""
+        data_dir = tempfile.mkdtemp(dir=self.tmp.name)
+        for name in ('sols.csv', 'historique_rendements.csv'):
+            pd.read_csv(os.path.join(self.data_dir, name)).to_csv(os.path.join(data_dir, name), index=False)
+        self.monitoring[self.monitoring['date'] < monitoring_cut].to_csv(
+            os.path.join(data_dir, 'monitoring_cultures.csv'), index=False)
+        self.weather[self.weather['date'] < weather_cut].to_csv(
+            os.path.join(data_dir, 'meteo_detaillee.csv'), index=False)
+        data_manager = AgriculturalDataManager(data_dir, use_cache=False, **options)
+        data_manager.load_data()
+        data_manager.prepare_features()
+        return data_manager
+
+    def assert_same_features(self, expected, actual):
+        self.assertEqual(list(expected.columns), list(actual.columns))
+        expected = expected.sort_values(['parcelle_id', 'date'], kind='stable', ignore_index=True)
+        actual = actual.sort_values(['parcelle_id', 'date'], kind='stable', ignore_index=True)
+        pd.testing.assert_series_equal(expected['date'], actual['date'])
+        columns = expected.select_dtypes(include=[np.number]).columns
+        np.testing.assert_allclose(actual[columns].to_numpy(np.float64), expected[columns].to_numpy(np.float64),
+                                   rtol=1e-6, atol=1e-6)
+
+    def test_appended_batches_match_a_full_rebuild(self):
+        monitoring_cut = pd.Timestamp('2021-05-03')
+        # La météo ajoutée commence en cours de journée, avant les relevés ajoutés
+        weather_cut = monitoring_cut - pd.Timedelta(days=10) + pd.Timedelta(hours=7)
+        for grain in ('daily', 'hourly'):
+            with self.subTest(weather_grain=grain):
+                full = AgriculturalDataManager(self.data_dir, use_cache=False, weather_grain=grain)
+                full.load_data()
+                part = self.partial_manager(monitoring_cut, weather_cut, weather_grain=grain, scaler_tolerance=0.0)
+
+                part.append_weather(self.weather[self.weather['date'] >= weather_cut])
+                new = self.monitoring[self.monitoring['date'] >= monitoring_cut]
+                for start in range(0, len(new), 10):
+                    part.append_monitoring(new.iloc[start:start + 10])
+
+                self.assertEqual(part.feature_store.build_count, 1)
+                self.assert_same_features(full.prepare_features(), part.prepare_features())
+                self.assert_same_features(full.get_features('P002'), part.get_features('P002'))
+
+    def test_subscribers_receive_the_changed_parcels(self):
+        monitoring_cut = pd.Timestamp('2021-06-01')
+        part = self.partial_manager(monitoring_cut, pd.Timestamp('2021-07-01'), scaler_tolerance=100.0)
+        events = []
+        part.feature_store.subscribe(lambda parcelle_ids, version, previous: events.append(parcelle_ids))
+
+        batch = self.monitoring[(self.monitoring['date'] >= monitoring_cut)
+                                & self.monitoring['parcelle_id'].isin(['P001', 'P003'])]
+        changed = part.append_monitoring(batch)
+
+        self.assertEqual(changed, {'P001', 'P003'})
+        self.assertEqual(events, [{'P001', 'P003'}])
+
+    def test_subscribers_receive_none_after_renormalization(self):
+        monitoring_cut = pd.Timestamp('2021-06-01')
+        part = self.partial_manager(monitoring_cut, pd.Timestamp('2021-07-01'), scaler_tolerance=0.0)
+        events = []
+        part.feature_store.subscribe(lambda parcelle_ids, version, previous: events.append(parcelle_ids))
+
+        batch = self.monitoring[(self.monitoring['date'] >= monitoring_cut) & (self.monitoring['parcelle_id'] == 'P001')]
+        changed = part.append_monitoring(batch)
+
+        self.assertEqual(events, [None])
+        self.assertEqual(changed, set(PARCELLES))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+# Les modules du projet sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli  # noqa: E402
+from scenario_engine import (SCENARIO_PRESETS, AgriculturalScenarioEngine, WeatherScenarios,  # noqa: E402
+                             seasonal_block_bootstrap)
+
+
+def season_gaps(days, source, dates):
+    """Écart (jours dans l'année) entre chaque jour tiré et le jour de l'horizon qu'il remplace."""
+    gap = np.abs(days.dayofyear.to_numpy()[source] - dates.dayofyear.to_numpy()[None, :])
+    return np.minimum(gap, 366 - gap)
+
+
+class SeasonalBlockBootstrapTest(unittest.TestCase):
+    def setUp(self):
+        self.days = pd.date_range('2020-01-01', '2023-12-31', freq='D')
+        self.dates = pd.date_range('2024-03-01', periods=120, freq='D')
+        self.rng = np.random.default_rng(0)
+
+    def bootstrap(self, valid, window=15):
+        return seasonal_block_bootstrap(self.days.dayofyear.to_numpy(), valid, self.dates.dayofyear.to_numpy(),
+                                        500, 7, window, self.rng)
+
+    def test_blocks_stay_in_season(self):
+        source = self.bootstrap(np.ones(len(self.days), dtype=bool))
+
+        self.assertEqual(source.dtype, np.int32)
+        self.assertEqual(source.shape, (500, len(self.dates)))
+        self.assertLessEqual(season_gaps(self.days, source, self.dates).max(), 15)
+        # Jours consécutifs à l'intérieur d'un bloc
+        self.assertTrue((np.diff(source[:, :7], axis=1) == 1).all())
+
+    def test_incomplete_days_are_never_drawn(self):
+        valid = np.ones(len(self.days), dtype=bool)
+        valid[self.days.year == 2021] = False
+
+        source = self.bootstrap(valid)
+
+        self.assertTrue(valid[source].all())
+        self.assertLessEqual(season_gaps(self.days, source, self.dates).max(), 15)
+
+    def test_fallback_ignores_season_with_a_warning(self):
+        valid = np.asarray(self.days.month.isin([1, 2, 12]))
+
+        with self.assertLogs('scenario_engine', level='WARNING'):
+            source = self.bootstrap(valid)
+        self.assertTrue(valid[source].all())
+
+
+class ValidDaysTest(unittest.TestCase):
+    def test_a_parcel_needs_only_one_of_its_stations(self):
+        history = np.ones((3, 10, 2), dtype=np.float32)
+        history[2, 5:, 0] = np.nan  # Station 2 interrompue au jour 5
+        history[1, 8, 1] = np.nan   # Station 1 privée d'une variable au jour 8
+        weights = np.array([[0.5, 0.0, 0.5],    # Stations 0 et 2
+                            [0.0, 1.0, 0.0]])   # Station 1 seule
+
+        valid = AgriculturalScenarioEngine._valid_days(history, weights)
+
+        np.testing.assert_array_equal(valid, np.arange(10) != 8)
+
+
+class ParcelTotalsTest(unittest.TestCase):
+    def test_each_parcel_sums_its_own_stations(self):
+        history = np.zeros((2, 4, 1), dtype=np.float32)
+        history[0, :, 0] = 1.0   # Station 0 : 1 mm par jour
+        history[1, :, 0] = 3.0   # Station 1 : 3 mm par jour
+        history[1, 2, 0] = np.nan
+        weights = np.array([[1.0, 0.0], [0.0, 1.0], [0.5, 0.5], [1.0, 0.0]])
+        source = np.array([[0, 1, 2], [3, 3, 3]], dtype=np.int32)
+        scenarios = WeatherScenarios(pd.date_range('2024-06-01', periods=3, freq='D'), ['precipitation'],
+                                     history, pd.Index(['S0', 'S1']), source, weights=weights)
+
+        totals = scenarios.parcel_totals('precipitation')
+
+        # Jour 2 manquant à la station 1 : la parcelle 1 n'a pas de valeur, la parcelle 2 reprend la station 0
+        np.testing.assert_allclose(totals, [[3.0, 3.0], [np.nan, 9.0], [5.0, 6.0], [3.0, 3.0]])
+        self.assertEqual(totals.dtype, np.float32)
+
+
+class CliScenariosTest(unittest.TestCase):
+    def test_cli_choices_match_presets(self):
+        # cli.py recopie les noms pour ne pas importer numpy avec `--help`
+        self.assertEqual(tuple(cli.SCENARIOS), tuple(SCENARIO_PRESETS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+# Les modules du projet sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AgriculturalValidation import AgriculturalValidation  # noqa: E402
+from model_registry import YieldModelRegistry  # noqa: E402
+
+
+class ValidateRecommendationsTest(unittest.TestCase):
+    def setUp(self):
+        # Rendement normalisé autour de 15 t/ha avec un écart-type de 2 t/ha
+        scaler = SimpleNamespace(feature_names_in_=np.array(['ndvi', 'rendement']),
+                                 mean_=np.array([0.5, 15.0]), scale_=np.array([0.1, 2.0]))
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        data_manager = SimpleNamespace(scaler=scaler, cache=SimpleNamespace(cache_dir=cache_dir.name),
+                                       feature_store=SimpleNamespace(subscribe=lambda callback: None))
+        self.registry = YieldModelRegistry(data_manager, LinearRegression())
+        self.predictions = np.array([-1.0, 0.0, 2.0])
+
+    def validate(self, actual_yields):
+        analyzer = SimpleNamespace(model_registry=self.registry, predict_yield=lambda parcelle_id: self.predictions)
+        return AgriculturalValidation(analyzer).validate_recommendations('P001', actual_yields)
+
+    def test_error_is_measured_in_tonnes_per_hectare(self):
+        self.assertEqual(self.validate([13.0, 15.0, 19.0]), 0.0)
+        # 1 t/ha d'écart sur une observation sur trois
+        self.assertAlmostEqual(self.validate([14.0, 15.0, 19.0]), 1 / 3)
+
+    def test_length_mismatch_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.validate([13.0, 15.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+# Les modules du projet sont à la racine du dépôt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weather_api import WEATHER_COLUMNS, RateLimiter, WeatherAPI, WeatherAPIError  # noqa: E402
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """Serveur OpenWeatherMap minimal : rejoue les codes d'erreur prévus, puis répond 200."""
+
+    def do_GET(self):
+        server = self.server
+        query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        with server.lock:
+            server.requests.append(query)
+            status = server.statuses.pop(0) if server.statuses else 200
+
+        if status != 200:
+            self.send_response(status)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        body = json.dumps({
+            'dt': 1_700_000_000,
+            'main': {'temp': 12.5, 'humidity': 80},
+            'wind': {'speed': 3.2, 'deg': 270},
+            'rain': {'1h': 0.4},
+            'coord': {'lat': float(query['lat']), 'lon': float(query['lon'])},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WeatherAPIStubServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubWeatherHandler)
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/data/2.5/weather"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests = []
+        self.server.statuses = []
+
+    def make_api(self, **options):
+        options = {'rate_limit': 1000.0, 'backoff_factor': 0.0, **options}
+        api = WeatherAPI('cle-test', base_url=self.url, **options)
+        self.addCleanup(api.close)
+        return api
+
+    def test_one_request_per_rounded_coordinate(self):
+        soil = pd.DataFrame({
+            'parcelle_id': ['P001', 'P002', 'P003'],
+            'latitude': [45.001, 45.004, 45.2],
+            'longitude': [2.001, 2.002, 2.3],
+        })
+        api = self.make_api(data_manager=SimpleNamespace(soil_data=soil))
+
+        weather = api.get_weather_for_parcels()
+
+        # P001 et P002 tombent dans la même zone de 0,01°
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(sorted((q['lat'], q['lon']) for q in self.server.requests),
+                         [('45.0', '2.0'), ('45.2', '2.3')])
+        self.assertEqual(list(weather.columns), WEATHER_COLUMNS)
+        self.assertEqual(list(weather['parcelle_id']), ['P001', 'P002', 'P003'])
+        for col in WEATHER_COLUMNS[1:-1]:
+            self.assertEqual(weather[col].dtype, np.float32)
+        self.assertTrue((weather['temperature'] == np.float32(12.5)).all())
+        self.assertTrue(weather['rayonnement_solaire'].isna().all())
+
+        # Réponses en cache : aucune nouvelle requête
+        api.get_weather_for_parcels(['P003'])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_retries_after_429_and_5xx(self):
+        self.server.statuses = [429, 503]
+        api = self.make_api(max_retries=3)
+
+        data = api.get_weather_data(45.0, 2.0)
+
+        self.assertEqual(data['main']['temp'], 12.5)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.statuses = [500, 502, 503]
+        api = self.make_api(max_retries=2)
+
+        with self.assertRaises(WeatherAPIError):
+            api.get_weather_data(45.0, 2.0)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_error_is_not_retried(self):
+        self.server.statuses = [401]
+        api = self.make_api(max_retries=3)
+
+        with self.assertRaises(WeatherAPIError):
+            api.get_weather_data(45.0, 2.0)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_failed_parcels_are_skipped(self):
+        self.server.statuses = [404]
+        soil = pd.DataFrame({'parcelle_id': ['P001'], 'latitude': [45.0], 'longitude': [2.0]})
+        api = self.make_api(data_manager=SimpleNamespace(soil_data=soil))
+
+        weather = api.get_weather_for_parcels()
+
+        self.assertEqual(list(weather.columns), WEATHER_COLUMNS)
+        self.assertEqual(len(weather), 0)
+
+    def test_cache_entries_expire(self):
+        api = self.make_api(cache_ttl=0.05)
+
+        api.get_weather_data(45.0, 2.0)
+        api.get_weather_data(45.0, 2.0)
+        self.assertEqual(len(self.server.requests), 1)
+        time.sleep(0.1)
+        api.get_weather_data(45.0, 2.0)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_rate_limit_spaces_requests(self):
+        api = self.make_api(rate_limit=20.0)
+        api.rate_limiter = RateLimiter(20.0, burst=1)
+
+        start = time.monotonic()
+        api.get_weather_batch([(45.0 + i / 10, 2.0) for i in range(5)])
+
+        # Un jeton disponible, puis un toutes les 50 ms
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Colonnes de rendement candidates, par ordre de préférence
+YIELD_COLUMNS = ('rendement', 'rendement_estime', 'rendement_final')
+COMPONENT_COLUMNS = ['parcelle_id', 'date', 'observed', 'trend', 'seasonal', 'resid']
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_yield_column(columns, value_col=None):
+    """Retourne la colonne de rendement à décomposer."""
+    if value_col is not None:
+        if value_col not in columns:
+            raise KeyError(f"La colonne '{value_col}' est manquante dans les données.")
+        return value_col
+    for col in YIELD_COLUMNS:
+        if col in columns:
+            return col
+    raise KeyError("Aucune colonne de rendement ('rendement', 'rendement_estime') dans les données.")
+
+
+def _decompose_chunk(series_chunk, period, model):
+    """Décompose un lot de séries avec statsmodels (exécuté dans un processus de travail)."""
+    from statsmodels.tsa.seasonal import seasonal_decompose
+
+    frames = []
+    for parcelle_id, dates, values in series_chunk:
+        decomposition = seasonal_decompose(values, model=model, period=period)
+        frames.append(pd.DataFrame({
+            'parcelle_id': parcelle_id,
+            'date': dates,
+            'observed': values,
+            'trend': decomposition.trend,
+            'seasonal': decomposition.seasonal,
+            'resid': decomposition.resid,
+        }))
+    return frames
+
+
+def moving_average_decompose(values, period, model='additive'):
+    """Décomposition classique par moyenne mobile, vectorisée sur les lignes de `values`.
+
+    `values` est une matrice séries x périodes (NaN pour les valeurs absentes).
+    Reproduit seasonal_decompose : moyenne mobile centrée (2 x `period` pour une
+    période paire), composante saisonnière moyenne par position dans le cycle,
+    puis centrée. Retourne (trend, seasonal, resid) de même forme que `values`.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if period % 2 == 0:
+        weights = np.r_[0.5, np.ones(period - 1), 0.5] / period
+    else:
+        weights = np.ones(period) / period
+    half = len(weights) // 2
+
+    trend = np.full_like(values, np.nan)
+    if values.shape[1] >= len(weights):
+        windows = np.lib.stride_tricks.sliding_window_view(values, len(weights), axis=1)
+        trend[:, half:values.shape[1] - half] = windows @ weights
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        detrended = values / trend if model == 'multiplicative' else values - trend
+
+    # Moyenne des valeurs sans tendance pour chaque position dans le cycle
+    n_cycles = math.ceil(values.shape[1] / period)
+    padded = np.full((values.shape[0], n_cycles * period), np.nan)
+    padded[:, :values.shape[1]] = detrended
+    cycles = padded.reshape(values.shape[0], n_cycles, period)
+    with np.errstate(invalid='ignore'):
+        counts = np.sum(~np.isnan(cycles), axis=1)
+        period_means = np.where(counts > 0, np.nansum(cycles, axis=1) / np.maximum(counts, 1), np.nan)
+        if model == 'multiplicative':
+            period_means = period_means / np.nanmean(period_means, axis=1, keepdims=True)
+        else:
+            period_means = period_means - np.nanmean(period_means, axis=1, keepdims=True)
+
+    seasonal = np.tile(period_means, n_cycles)[:, :values.shape[1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if model == 'multiplicative':
+            resid = values / (trend * seasonal)
+        else:
+            resid = values - trend - seasonal
+    return trend, seasonal, resid
+
+
+class YieldTrendEngine:
+    def __init__(self, yield_history, value_col=None, period=12, model='additive', max_workers=None):
+        """Initialise le moteur de décomposition des séries de rendement par parcelle.
+
+        `yield_history` suit le format de historique_rendements.csv ; la colonne
+        décomposée est `value_col` ou, à défaut, la première colonne de rendement
+        disponible ('rendement', puis 'rendement_estime').
+        """
+        self.yield_history = yield_history
+        self.value_col = resolve_yield_column(yield_history.columns, value_col)
+        self.period = period
+        self.model = model
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def _series(self, parcelle_ids=None):
+        """Découpe l'historique en séries (parcelle, dates, valeurs) triées par date."""
+        data = self.yield_history[['parcelle_id', 'date', self.value_col]]
+        if parcelle_ids is not None:
+            data = data[data['parcelle_id'].isin(parcelle_ids)]
+        data = data.sort_values(['parcelle_id', 'date'])
+
+        series, skipped = [], []
+        for parcelle_id, group in data.groupby('parcelle_id', observed=True, sort=True):
+            values = group[self.value_col].to_numpy(dtype=np.float64)
+            # seasonal_decompose exige deux cycles complets sans valeur manquante
+            if len(values) < 2 * self.period or np.isnan(values).any():
+                skipped.append(parcelle_id)
+                continue
+            series.append((parcelle_id, group['date'].to_numpy(), values))
+        return series, skipped
+
+    def decompose(self, parcelle_ids=None, method='numpy', chunksize=None):
+        """Décompose les séries de rendement de toutes les parcelles (ou de `parcelle_ids`).
+
+        `method='numpy'` utilise la décomposition par moyenne mobile vectorisée ;
+        `method='statsmodels'` répartit les séries par lots sur un pool de
+        processus. Retourne un DataFrame au format long (parcelle_id, date,
+        observed, trend, seasonal, resid) ; les parcelles sans historique
+        suffisant sont listées dans `attrs['skipped']`.
+        """
+        if method == 'numpy':
+            components, skipped = self._decompose_numpy(parcelle_ids)
+        elif method == 'statsmodels':
+            components, skipped = self._decompose_statsmodels(parcelle_ids, chunksize)
+        else:
+            raise ValueError(f"Méthode de décomposition inconnue : {method}")
+
+        if skipped:
+            logger.warning("Historique insuffisant pour %d parcelle(s), ignorée(s) : %s", len(skipped), skipped[:10])
+        components.attrs['skipped'] = skipped
+        return components
+
+    def _decompose_statsmodels(self, parcelle_ids, chunksize):
+        series, skipped = self._series(parcelle_ids)
+        if not series:
+            return pd.DataFrame(columns=COMPONENT_COLUMNS), skipped
+
+        workers = min(self.max_workers, len(series))
+        chunksize = chunksize or max(1, math.ceil(len(series) / (workers * 4)))
+        chunks = [series[i:i + chunksize] for i in range(0, len(series), chunksize)]
+
+        if workers == 1:
+            results = [_decompose_chunk(chunk, self.period, self.model) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_decompose_chunk, chunks,
+                                            [self.period] * len(chunks), [self.model] * len(chunks)))
+
+        frames = [frame for chunk_frames in results for frame in chunk_frames]
+        return pd.concat(frames, ignore_index=True), skipped
+
+    def _decompose_numpy(self, parcelle_ids):
+        series, skipped = self._series(parcelle_ids)
+        if not series:
+            return pd.DataFrame(columns=COMPONENT_COLUMNS), skipped
+
+        # Les séries de même longueur sont empilées et décomposées en une seule passe
+        by_length = {}
+        for item in series:
+            by_length.setdefault(len(item[2]), []).append(item)
+
+        frames = []
+        for group in by_length.values():
+            values = np.vstack([item[2] for item in group])
+            trend, seasonal, resid = moving_average_decompose(values, self.period, self.model)
+            length = values.shape[1]
+            frames.append(pd.DataFrame({
+                'parcelle_id': np.repeat([item[0] for item in group], length),
+                'date': np.concatenate([item[1] for item in group]),
+                'observed': values.ravel(),
+                'trend': trend.ravel(),
+                'seasonal': seasonal.ravel(),
+                'resid': resid.ravel(),
+            }))
+        components = pd.concat(frames, ignore_index=True)
+        return components.sort_values(['parcelle_id', 'date'], ignore_index=True), skipped
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+from data_cache import concat_aligned
+
+# Colonnes des agrégats journaliers produits par WeatherAggregator
+DAILY_COLUMNS = [
+    'temperature', 'temperature_min', 'temperature_max', 'humidite', 'precipitation',
+    'rayonnement_solaire', 'vitesse_vent', 'vitesse_vent_max', 'direction_vent', 'gdd',
+]
+
+# Métadonnées des agrégats (effectif de relevés horaires), exclues des caractéristiques
+METADATA_COLUMNS = ['nb_mesures']
+
+
+class WeatherAggregator:
+    def __init__(self, chunksize=100_000, gdd_base=10.0):
+        """Initialise l'agrégation en flux des données météorologiques horaires.
+
+        Le fichier est lu par blocs de `chunksize` lignes ; seuls des agrégats
+        partiels par jour (sommes, minima, maxima, effectifs) sont conservés, de
+        sorte que la mémoire dépend de la taille des blocs et non du fichier.
+        `gdd_base` est la température de base des degrés-jours de croissance.
+        """
+        self.chunksize = chunksize
+        self.gdd_base = gdd_base
+
+    @staticmethod
+    def _group_keys(columns):
+        """Clés de regroupement : la station (si présente) et le jour."""
+        return ['station_id', 'jour'] if 'station_id' in columns else ['jour']
+
+    def _partial_aggregates(self, chunk):
+        """Calcule les agrégats partiels (associatifs) d'un bloc de lignes horaires."""
+        chunk = chunk.assign(
+            jour=chunk['date'].dt.floor('D'),
+            vent_u=chunk['vitesse_vent'] * np.sin(np.radians(chunk['direction_vent'])),
+            vent_v=chunk['vitesse_vent'] * np.cos(np.radians(chunk['direction_vent'])),
+        )
+        grouped = chunk.groupby(self._group_keys(chunk.columns), observed=True, sort=False)
+        partial = grouped.agg(
+            nb_mesures=('temperature', 'count'),
+            temperature_somme=('temperature', 'sum'),
+            temperature_min=('temperature', 'min'),
+            temperature_max=('temperature', 'max'),
+            humidite_somme=('humidite', 'sum'),
+            nb_humidite=('humidite', 'count'),
+            precipitation=('precipitation', 'sum'),
+            rayonnement_solaire=('rayonnement_solaire', 'sum'),
+            vent_somme=('vitesse_vent', 'sum'),
+            nb_vent=('vitesse_vent', 'count'),
+            vitesse_vent_max=('vitesse_vent', 'max'),
+            vent_u=('vent_u', 'sum'),
+            vent_v=('vent_v', 'sum'),
+        )
+        return partial
+
+    @staticmethod
+    def _combine(partials):
+        """Fusionne des agrégats partiels qui se chevauchent (jours coupés entre deux blocs)."""
+        partial = pd.concat(partials)
+        how = {col: 'sum' for col in partial.columns}
+        how.update({'temperature_min': 'min', 'temperature_max': 'max', 'vitesse_vent_max': 'max'})
+        return partial.groupby(level=list(range(partial.index.nlevels)), observed=True).agg(how)
+
+    def _finalize_daily(self, partial):
+        """Transforme les agrégats partiels en statistiques journalières."""
+        daily = pd.DataFrame(index=partial.index)
+        daily['temperature'] = partial['temperature_somme'] / partial['nb_mesures']
+        daily['temperature_min'] = partial['temperature_min']
+        daily['temperature_max'] = partial['temperature_max']
+        daily['humidite'] = partial['humidite_somme'] / partial['nb_humidite']
+        daily['precipitation'] = partial['precipitation']
+        daily['rayonnement_solaire'] = partial['rayonnement_solaire']
+        daily['vitesse_vent'] = partial['vent_somme'] / partial['nb_vent']
+        daily['vitesse_vent_max'] = partial['vitesse_vent_max']
+        # Direction dominante : moyenne vectorielle des vents horaires
+        daily['direction_vent'] = np.degrees(np.arctan2(partial['vent_u'], partial['vent_v'])) % 360
+        daily['gdd'] = ((daily['temperature_min'] + daily['temperature_max']) / 2 - self.gdd_base).clip(lower=0)
+        daily['nb_mesures'] = partial['nb_mesures']
+
+        daily = daily.reset_index().rename(columns={'jour': 'date'})
+        float_cols = daily.columns.difference(['station_id', 'date'])
+        daily[float_cols] = daily[float_cols].astype(np.float32)
+        return daily.sort_values(self._group_keys(daily.columns)[:-1] + ['date'], ignore_index=True)
+
+    @staticmethod
+    def _partials_from_daily(daily):
+        """Reconstitue les agrégats partiels de lignes journalières déjà finalisées.
+
+        Exact pour les sommes, extrêmes et moyennes de température et de vent ;
+        l'humidité est supposée mesurée à chaque relevé et le vecteur vent
+        reconstruit à partir de la vitesse et de la direction moyennes.
+        """
+        n = daily['nb_mesures'].astype(np.float64)
+        radians = np.radians(daily['direction_vent'].astype(np.float64))
+        wind = daily['vitesse_vent'].astype(np.float64) * n
+        keys = ['station_id'] if 'station_id' in daily.columns else []
+        partial = pd.DataFrame({
+            'nb_mesures': n,
+            'temperature_somme': daily['temperature'] * n,
+            'temperature_min': daily['temperature_min'],
+            'temperature_max': daily['temperature_max'],
+            'humidite_somme': daily['humidite'] * n,
+            'nb_humidite': n,
+            'precipitation': daily['precipitation'],
+            'rayonnement_solaire': daily['rayonnement_solaire'],
+            'vent_somme': wind,
+            'nb_vent': n,
+            'vitesse_vent_max': daily['vitesse_vent_max'],
+            'vent_u': wind * np.sin(radians),
+            'vent_v': wind * np.cos(radians),
+        })
+        index = [daily[key] for key in keys] + [daily['date'].rename('jour')]
+        partial.index = pd.MultiIndex.from_arrays(index) if keys else pd.Index(index[0])
+        return partial.astype(np.float64)
+
+    def aggregate(self, hourly):
+        """Agrège en statistiques journalières des relevés horaires déjà en mémoire."""
+        return self._finalize_daily(self._combine([self._partial_aggregates(hourly)]))
+
+    def update_daily(self, daily, hourly):
+        """Intègre de nouveaux relevés horaires à des agrégats journaliers existants.
+
+        Seuls les jours à partir du premier jour des nouveaux relevés sont
+        recalculés ; un jour déjà partiellement agrégé est complété. Retourne
+        les agrégats mis à jour et ce premier jour.
+        """
+        since = hourly['date'].min().floor('D')
+        recent = daily['date'] >= since
+        partials = [self._partial_aggregates(hourly)]
+        if recent.any():
+            partials.insert(0, self._partials_from_daily(daily[recent]))
+        updated = self._finalize_daily(self._combine(partials))
+        return concat_aligned([daily[~recent], updated]).sort_values(
+            self._group_keys(daily.columns)[:-1] + ['date'], ignore_index=True), since
+
+    def aggregate_csv(self, path):
+        """Lit un fichier météo horaire par blocs et retourne ses agrégats journaliers."""
+        partials = []
+        for chunk in pd.read_csv(path, parse_dates=['date'], chunksize=self.chunksize):
+            partials.append(self._partial_aggregates(chunk))
+            # Les agrégats sont compactés régulièrement pour borner la mémoire
+            if len(partials) >= 16:
+                partials = [self._combine(partials)]
+
+        if not partials:
+            return pd.DataFrame(columns=['date'] + DAILY_COLUMNS)
+        return self._finalize_daily(self._combine(partials))
+
+    @staticmethod
+    def monthly(daily):
+        """Agrège les statistiques journalières au mois."""
+        keys = ['station_id'] if 'station_id' in daily.columns else []
+        grouped = daily.groupby(keys + [daily['date'].dt.to_period('M').dt.start_time.rename('mois')],
+                                observed=True)
+        monthly = grouped.agg(
+            temperature=('temperature', 'mean'),
+            temperature_min=('temperature_min', 'min'),
+            temperature_max=('temperature_max', 'max'),
+            humidite=('humidite', 'mean'),
+            precipitation=('precipitation', 'sum'),
+            rayonnement_solaire=('rayonnement_solaire', 'sum'),
+            vitesse_vent=('vitesse_vent', 'mean'),
+            vitesse_vent_max=('vitesse_vent_max', 'max'),
+            gdd=('gdd', 'sum'),
+            nb_jours=('date', 'count'),
+        )
+        return monthly.reset_index().rename(columns={'mois': 'date'})
@@ -0,0 +1,204 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENWEATHERMAP_URL = "http://api.openweathermap.org/data/2.5/weather"
+
+# Codes HTTP pour lesquels une nouvelle tentative a du sens
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Colonnes produites par get_weather_for_parcels (schéma de meteo_detaillee.csv + parcelle)
+WEATHER_COLUMNS = ['date', 'temperature', 'humidite', 'precipitation', 'rayonnement_solaire',
+                   'vitesse_vent', 'direction_vent', 'parcelle_id']
+
+logger = logging.getLogger(__name__)
+
+
+class WeatherAPIError(Exception):
+    """Erreur lors de la récupération des données météorologiques."""
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        """Limiteur de débit à seau de jetons : `rate` requêtes par seconde, rafales de `burst`."""
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Attend qu'un jeton soit disponible puis le consomme."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TTLCache:
+    def __init__(self, ttl):
+        """Cache mémoire dont les entrées expirent après `ttl` secondes."""
+        self.ttl = ttl
+        self._entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+
+
+class WeatherAPI:
+    def __init__(self, api_key, base_url=OPENWEATHERMAP_URL, data_manager=None, max_workers=8,
+                 rate_limit=10.0, timeout=10.0, max_retries=3, backoff_factor=0.5,
+                 cache_ttl=600, coordinate_precision=2):
+        """Initialise l'API météorologique.
+
+        Les requêtes passent par une session HTTP à connexions réutilisées, un
+        limiteur de débit (`rate_limit` requêtes/s) et des nouvelles tentatives
+        avec attente exponentielle. Les réponses sont gardées `cache_ttl`
+        secondes, indexées par les coordonnées arrondies à
+        `coordinate_precision` décimales (0,01° ≈ 1 km), de sorte que des
+        parcelles voisines partagent une même requête. `base_url` permet de
+        viser un serveur de test local ; `data_manager` fournit les coordonnées
+        des parcelles pour get_weather_for_parcels.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.data_manager = data_manager
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.coordinate_precision = coordinate_precision
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.cache = TTLCache(cache_ttl)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        """Ferme la session HTTP et ses connexions."""
+        self.session.close()
+
+    def _cache_key(self, latitude, longitude):
+        return (round(float(latitude), self.coordinate_precision),
+                round(float(longitude), self.coordinate_precision))
+
+    def _request(self, latitude, longitude):
+        """Effectue la requête HTTP avec nouvelles tentatives et attente exponentielle."""
+        params = {'lat': latitude, 'lon': longitude, 'appid': self.api_key, 'units': 'metric'}
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise WeatherAPIError(f"Erreur lors de la récupération des données météorologiques : {e}") from e
+                retry_after = None
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise WeatherAPIError(
+                        f"Erreur lors de la récupération des données météorologiques : {response.status_code}")
+                retry_after = response.headers.get('Retry-After')
+
+            # Attente exponentielle avec gigue, ou délai imposé par le serveur
+            delay = self.backoff_factor * 2 ** attempt * (1 + random.random())
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            time.sleep(delay)
+
+    def get_weather_data(self, latitude, longitude):
+        """Obtient les données météorologiques pour une localisation donnée."""
+        key = self._cache_key(latitude, longitude)
+        data = self.cache.get(key)
+        if data is None:
+            # Les coordonnées arrondies sont interrogées, pour que la réponse vaille pour toute la zone
+            data = self._request(*key)
+            self.cache.set(key, data)
+        return data
+
+    def get_weather_batch(self, coordinates):
+        """Récupère en parallèle la météo d'une liste de couples (latitude, longitude).
+
+        Retourne un dictionnaire coordonnées arrondies -> réponse JSON (ou
+        exception en cas d'échec) ; chaque zone n'est interrogée qu'une fois.
+        """
+        keys = list(dict.fromkeys(self._cache_key(lat, lon) for lat, lon in coordinates))
+
+        def fetch(key):
+            try:
+                return key, self.get_weather_data(*key)
+            except WeatherAPIError as e:
+                return key, e
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(1, len(keys)))) as executor:
+            return dict(executor.map(fetch, keys))
+
+    def get_weather_for_parcels(self, parcel_ids=None):
+        """Récupère la météo actuelle de plusieurs parcelles (toutes par défaut).
+
+        Retourne un DataFrame au schéma de meteo_detaillee.csv, avec une colonne
+        parcelle_id, prêt à être ajouté aux données météorologiques.
+        """
+        if self.data_manager is None or self.data_manager.soil_data is None:
+            raise ValueError("Un gestionnaire de données chargé est nécessaire pour localiser les parcelles.")
+
+        soil = self.data_manager.soil_data[['parcelle_id', 'latitude', 'longitude']]
+        if parcel_ids is not None:
+            soil = soil[soil['parcelle_id'].isin(parcel_ids)]
+
+        coordinates = list(zip(soil['latitude'], soil['longitude']))
+        responses = self.get_weather_batch(coordinates)
+
+        rows, failed = [], []
+        for parcelle_id, latitude, longitude in soil.itertuples(index=False):
+            data = responses[self._cache_key(latitude, longitude)]
+            if isinstance(data, Exception):
+                failed.append(parcelle_id)
+                continue
+            main, wind = data.get('main', {}), data.get('wind', {})
+            rows.append({
+                'date': pd.to_datetime(data.get('dt'), unit='s') if data.get('dt') else pd.Timestamp.now().floor('h'),
+                'temperature': main.get('temp', np.nan),
+                'humidite': main.get('humidity', np.nan),
+                'precipitation': data.get('rain', {}).get('1h', 0.0),
+                'rayonnement_solaire': np.nan,  # Non fourni par l'API
+                'vitesse_vent': wind.get('speed', np.nan),
+                'direction_vent': wind.get('deg', np.nan),
+                'parcelle_id': parcelle_id,
+            })
+        if failed:
+            logger.warning("Données météorologiques indisponibles pour %d parcelle(s) : %s", len(failed), failed[:10])
+
+        weather = pd.DataFrame(rows, columns=WEATHER_COLUMNS)
+        float_cols = WEATHER_COLUMNS[1:-1]
+        weather[float_cols] = weather[float_cols].astype(np.float32)
+        return weather